@@ -0,0 +1,344 @@
+"""
+Offline benchmark of openchat agents.
+
+    python -m benchmarks.run dialogpt.small blender.small --output results.json
+    python -m benchmarks.run dialogpt.small --compare baseline.json
+    python -m benchmarks.run dialogpt.small --precisions fp32 bf16 int8
+
+every model is measured in a fresh process, with a tiny randomly initialized
+stand-in model unless `--real` is given.
+"""
+
+import argparse
+import json
+import multiprocessing
+import resource
+import sys
+import time
+
+from openchat.agents import registry
+from openchat.base.envs.base import BaseEnvironment
+
+METHODS = ["greedy", "beam", "top_k", "nucleus"]
+
+PRECISIONS = ["fp32", "bf16", "int8"]
+
+CONVERSATION = [
+    "hello. how are you today?",
+    "i am fine. what do you like to do in your free time?",
+    "i like to play the guitar and read books about history.",
+    "do you have any pets? i have a dog and two cats.",
+    "what is your favorite food?",
+    "i have never been there. what is the weather like?",
+    "that sounds nice. i would like to travel more.",
+    "thank you for talking with me. good bye!",
+]
+
+
+def percentiles(values):
+    values = sorted(values)
+
+    def percentile(p):
+        if len(values) == 0:
+            return None
+        return values[min(len(values) - 1, int(len(values) * p))]
+
+    return {
+        "p50": percentile(0.50),
+        "p95": percentile(0.95),
+        "p99": percentile(0.99),
+    }
+
+
+def peak_rss_mb():
+    # kilobytes on linux, bytes on macos
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+class BenchmarkEnvironment(BaseEnvironment):
+
+    def start(self, agent):
+        raise NotImplemented
+
+    def run_turn(self, user_id, agent, message, method):
+        from openchat.base import PromptAgent, SingleTurn
+
+        options = {"method": method}
+
+        if isinstance(agent, PromptAgent):
+            message = f"User: {message} Bot:"
+            options["person_1"], options["person_2"] = "User", "Bot"
+
+        if isinstance(agent, SingleTurn):
+            model_input = message
+        else:
+            model_input = self.make_model_input(user_id, message, agent)
+
+        self.add_user_message(user_id, message)
+        output = agent.predict(model_input, **options)["output"]
+        self.add_bot_message(user_id, output, agent)
+        return model_input, output
+
+
+def time_to_first_token(agent, model_input):
+    """
+    Seconds to encode the input and generate one token.
+    """
+
+    import torch
+    from openchat.base import DecoderLM, HuggingfaceAgent
+
+    start = time.perf_counter()
+
+    if isinstance(agent, HuggingfaceAgent):
+        inputs = agent.tokenize_batch([model_input])
+        input_ids = inputs["input_ids"].to(agent.device)
+
+        with torch.no_grad():
+            agent.model.generate(
+                input_ids=input_ids,
+                attention_mask=inputs["attention_mask"].to(agent.device),
+                max_length=input_ids.size(-1) + 1 if isinstance(agent, DecoderLM) else 2,
+                pad_token_id=agent.tokenizer.eos_token_id,
+                use_cache=True,
+            )
+    else:
+        maxlen, agent.maxlen = agent.maxlen, 1
+
+        try:
+            agent.predict(model_input, method="greedy")
+        finally:
+            agent.maxlen = maxlen
+
+    return time.perf_counter() - start
+
+
+def count_tokens(agent, text):
+    return len(agent.tokenizer(text)["input_ids"]) if len(text) > 0 else 0
+
+
+def greedy_outputs(agent):
+    """
+    Greedy outputs for every message of the conversation as the first turn,
+    so outputs of different precisions are compared on the same inputs.
+    """
+
+    env = BenchmarkEnvironment()
+    outputs = []
+
+    for i, message in enumerate(CONVERSATION):
+        outputs.append(env.run_turn(f"quality_{i}", agent, message, "greedy")[1])
+
+    return outputs
+
+
+def token_f1(output, reference):
+    output, reference = output.lower().split(), reference.lower().split()
+    common = sum(min(output.count(t), reference.count(t)) for t in set(output))
+
+    if len(output) == 0 or len(reference) == 0:
+        return float(output == reference)
+
+    if common == 0:
+        return 0.0
+
+    precision, recall = common / len(output), common / len(reference)
+    return 2 * precision * recall / (precision + recall)
+
+
+def agreement(outputs, references):
+    """
+    Exact match rate and mean token f1 of outputs against fp32 outputs.
+    """
+
+    pairs = list(zip(outputs, references))
+
+    return {
+        "exact_match": sum(o == r for o, r in pairs) / len(pairs),
+        "token_f1": sum(token_f1(o, r) for o, r in pairs) / len(pairs),
+    }
+
+
+def benchmark_model(name, device="cpu", real=False, methods=None, repeats=1, precision="fp32"):
+    """
+    Measure one model.
+
+    Returns:
+        (dict): cold load time, peak rss, greedy outputs and per decoding method throughput and latencies
+    """
+
+    import torch
+    from benchmarks.standins import create_standin_agent
+
+    torch.manual_seed(0)
+    methods = methods or METHODS
+    words = " ".join(CONVERSATION).replace(".", " . ").replace("?", " ? ").split()
+
+    start = time.perf_counter()
+
+    if real:
+        agent = registry.load_agent_class(name)(name, device, -1)
+    else:
+        agent = create_standin_agent(name, device, words=words)
+
+    if precision != "fp32":
+        from openchat.utils.precision_utils import set_precision
+
+        # stand-ins are random, so their quantized modules are not cached.
+        agent = set_precision(agent, precision, cache=real)
+
+    result = {
+        "model": name,
+        "device": device,
+        "precision": precision,
+        "standin": not real,
+        "cold_load_seconds": time.perf_counter() - start,
+        "methods": {},
+    }
+
+    for method in methods:
+        env = BenchmarkEnvironment()
+        latencies, ttfts, num_tokens = [], [], 0
+
+        for repeat in range(repeats):
+            user_id = f"{method}_{repeat}"
+
+            for message in CONVERSATION:
+                start = time.perf_counter()
+                model_input, output = env.run_turn(user_id, agent, message, method)
+                latencies.append(time.perf_counter() - start)
+                num_tokens += count_tokens(agent, output)
+                ttfts.append(time_to_first_token(agent, model_input))
+
+        result["methods"][method] = {
+            "turns": len(latencies),
+            "tokens": num_tokens,
+            "tokens_per_second": num_tokens / sum(latencies) if sum(latencies) > 0 else None,
+            "latency": percentiles(latencies),
+            "time_to_first_token": percentiles(ttfts),
+        }
+
+    result["greedy_outputs"] = greedy_outputs(agent)
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+
+def run_in_process(name, device, real, methods, repeats, precision="fp32"):
+    # a fresh process for each model, so load time and peak rss are not shared.
+    context = multiprocessing.get_context("spawn")
+
+    with context.Pool(1) as pool:
+        return pool.apply(benchmark_model, (name, device, real, methods, repeats, precision))
+
+
+def result_key(result):
+    # results written before precisions were benchmarked are fp32
+    return result["model"], result.get("precision", "fp32")
+
+
+def compare(results, baseline, threshold):
+    """
+    Find metrics which are worse than the baseline by more than `threshold` (ratio).
+    """
+
+    regressions = []
+    baseline = {result_key(result): result for result in baseline}
+
+    for result in results:
+        if result_key(result) not in baseline:
+            continue
+
+        base = baseline[result_key(result)]
+        model = "/".join(result_key(result))
+
+        for method, metrics in result["methods"].items():
+            if method not in base["methods"]:
+                continue
+
+            base_metrics = base["methods"][method]
+
+            for key in ["latency", "time_to_first_token"]:
+                for p, value in metrics[key].items():
+                    base_value = base_metrics[key][p]
+
+                    if value and base_value and value > base_value * (1 + threshold):
+                        regressions.append(f"{model} {method} {key} {p}: {base_value:.4f} -> {value:.4f}")
+
+            value, base_value = metrics["tokens_per_second"], base_metrics["tokens_per_second"]
+
+            if value and base_value and value < base_value * (1 - threshold):
+                regressions.append(f"{model} {method} tokens/s: {base_value:.1f} -> {value:.1f}")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmark of openchat agents.")
+    parser.add_argument("models", nargs="+", help="registered model names")
+    parser.add_argument("--device", default="cpu")
+    parser.add_argument("--methods", nargs="+", default=METHODS, choices=METHODS)
+    parser.add_argument("--precisions", nargs="+", default=["fp32"], choices=PRECISIONS,
+                        help="precisions of weights, compared with fp32 outputs")
+    parser.add_argument("--repeats", type=int, default=1, help="number of scripted conversations per method")
+    parser.add_argument("--real", action="store_true", help="load the real checkpoints instead of stand-ins")
+    parser.add_argument("--output", default=None, help="path of the json results")
+    parser.add_argument("--compare", default=None, help="path of baseline json results")
+    parser.add_argument("--threshold", type=float, default=0.2, help="allowed ratio of regression")
+    args = parser.parse_args()
+
+    results = []
+
+    precisions = ["fp32"] + [p for p in args.precisions if p != "fp32"]
+
+    for name in args.models:
+        references = None
+
+        for precision in precisions:
+            result = run_in_process(name, args.device, args.real, args.methods, args.repeats, precision)
+            results.append(result)
+            tag = f"{name}/{precision}"
+
+            if references is None:
+                references = result["greedy_outputs"]
+            else:
+                result["quality"] = agreement(result["greedy_outputs"], references)
+
+            for method, metrics in result["methods"].items():
+                print(
+                    f"[{tag}] {method}: "
+                    f"{metrics['tokens_per_second'] or 0:.1f} tok/s, "
+                    f"p50 {metrics['latency']['p50'] * 1000:.1f} ms, "
+                    f"p99 {metrics['latency']['p99'] * 1000:.1f} ms, "
+                    f"ttft p50 {metrics['time_to_first_token']['p50'] * 1000:.1f} ms"
+                )
+
+            print(
+                f"[{tag}] load {result['cold_load_seconds']:.2f} s, "
+                f"peak rss {result['peak_rss_mb']:.0f} MB"
+            )
+
+            if "quality" in result:
+                print(
+                    f"[{tag}] vs fp32: "
+                    f"exact match {result['quality']['exact_match']:.2f}, "
+                    f"token f1 {result['quality']['token_f1']:.2f}"
+                )
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+
+        for regression in regressions:
+            print(f"[REGRESSION] {regression}")
+
+        if len(regressions) > 0:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+import os
+import tempfile
+
+from openchat.agents import registry
+
+EOS_TOKEN = "<|endoftext|>"
+
+
+def create_byte_tokenizer(model_max_length=1024):
+    """
+    Byte level tokenizer which needs no vocabulary files.
+    every utf-8 byte is a token and id 256 is the end of text token.
+    """
+
+    from transformers import PreTrainedTokenizer
+
+    class ByteTokenizer(PreTrainedTokenizer):
+        model_input_names = ["input_ids", "attention_mask"]
+
+        def __init__(self, **kwargs):
+            # the vocabulary must exist before the base class registers special tokens
+            self.encoder = {chr(i): i for i in range(256)}
+            self.encoder[EOS_TOKEN] = 256
+            self.decoder = {i: token for token, i in self.encoder.items()}
+            super().__init__(eos_token=EOS_TOKEN, **kwargs)
+
+        @property
+        def vocab_size(self):
+            return len(self.encoder)
+
+        def get_vocab(self):
+            return dict(self.encoder)
+
+        def _tokenize(self, text, **kwargs):
+            return [chr(b) for b in text.encode("utf-8")]
+
+        def _convert_token_to_id(self, token):
+            return self.encoder.get(token, 256)
+
+        def _convert_id_to_token(self, index):
+            return self.decoder.get(index, EOS_TOKEN)
+
+        def convert_tokens_to_string(self, tokens):
+            return bytes(
+                ord(token) for token in tokens if len(token) == 1
+            ).decode("utf-8", errors="ignore")
+
+        def save_vocabulary(self, save_directory, filename_prefix=None):
+            return ()
+
+    return ByteTokenizer(model_max_length=model_max_length)
+
+
+def create_huggingface_model(spec):
+    """
+    Tiny randomly initialized decoder of the same architecture family.
+    """
+
+    if spec.family == "gptneo":
+        from transformers import GPTNeoConfig, GPTNeoForCausalLM
+
+        config = GPTNeoConfig(
+            vocab_size=257,
+            max_position_embeddings=1024,
+            hidden_size=32,
+            num_layers=2,
+            num_heads=2,
+            attention_types=[[["global", "local"], 1]],
+            window_size=256,
+            bos_token_id=256,
+            eos_token_id=256,
+        )
+        return GPTNeoForCausalLM(config)
+
+    from transformers import GPT2Config, GPT2LMHeadModel
+
+    config = GPT2Config(
+        vocab_size=257,
+        n_positions=1024,
+        n_embd=32,
+        n_layer=2,
+        n_head=2,
+        bos_token_id=256,
+        eos_token_id=256,
+    )
+    return GPT2LMHeadModel(config)
+
+
+def create_parlai_model(words):
+    """
+    Tiny randomly initialized parlai transformer generator with a dictionary of `words`.
+    """
+
+    from parlai.core.agents import create_agent
+    from parlai.core.params import ParlaiParser
+
+    directory = tempfile.mkdtemp(prefix="openchat_benchmark_")
+    dict_file = os.path.join(directory, "model.dict")
+
+    with open(dict_file, "w", encoding="utf-8") as f:
+        for token in ["__null__", "__start__", "__end__", "__unk__"] + sorted(set(words)):
+            f.write(f"{token}\t1\n")
+
+    parser = ParlaiParser(True, True)
+    opt = parser.parse_args([
+        "--model", "transformer/generator",
+        "--dict-file", dict_file,
+        "--embedding-size", "32",
+        "--ffn-size", "64",
+        "--n-heads", "2",
+        "--n-layers", "1",
+        "--n-positions", "1024",
+        "--truncate", "1024",
+        "--no-cuda",
+    ])
+
+    return create_agent(opt, requireModelExists=False)
+
+
+def create_standin_agent(name, device="cpu", maxlen=-1, words=()):
+    """
+    Agent of the registered model with a tiny random model in place of the checkpoint.
+    the agent class, suffix and decoding code are the real ones, so they are benchmarked offline.
+
+    Args:
+        name (str): registered model name
+        device (str): device of the model
+        maxlen (int): maximum length of model input, default of the model if `maxlen <= 0`
+        words (List[str]): vocabulary of parlai stand-ins
+
+    Returns:
+        (BaseAgent): stand-in agent
+    """
+
+    from openchat.base import (
+        HuggingfaceAgent,
+        ParlaiGenerationAgent,
+        WizardOfWikipediaAgent,
+    )
+
+    spec = registry.get_model_spec(name)
+    agent_class = registry.load_agent_class(name)
+    maxlen = maxlen if maxlen > 0 else spec.default_maxlen
+    agent = agent_class.__new__(agent_class)
+
+    if issubclass(agent_class, HuggingfaceAgent):
+        HuggingfaceAgent.__init__(
+            agent,
+            name=name,
+            suffix=spec.suffix,
+            device=device,
+            maxlen=maxlen,
+            model=create_huggingface_model(spec).to(device).eval(),
+            tokenizer=create_byte_tokenizer(),
+        )
+
+    elif issubclass(agent_class, ParlaiGenerationAgent) and \
+            not issubclass(agent_class, WizardOfWikipediaAgent) and \
+            not spec.has(registry.WIZARD_OF_WIKIPEDIA):
+        ParlaiGenerationAgent.__init__(
+            agent,
+            name=name,
+            suffix=spec.suffix,
+            device=device,
+            maxlen=maxlen,
+            model=create_parlai_model(words),
+        )
+
+    else:
+        # classifiers and knowledge grounded models need their data files.
+        raise Exception(f"no offline stand-in for model: {name}")
+
+    return agent
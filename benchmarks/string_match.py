@@ -0,0 +1,101 @@
+"""
+Benchmark of the offensive string matcher against parlai's `OffensiveStringMatcher`.
+
+    python -m benchmarks.string_match --texts 2000 --phrases 3300
+
+both matchers get the same phrases (parlai's word list if it is downloaded, random words otherwise),
+their results are checked to be equal and the time of scanning the texts is reported.
+"""
+
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+
+from benchmarks.run import CONVERSATION
+from openchat.utils.string_utils import PhraseMatcher, trie_phrases
+
+
+def random_word(rng):
+    return "".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(5, 10)))
+
+
+def create_reference(num_phrases, real, rng):
+    from parlai.utils.safety import OffensiveStringMatcher
+
+    if real:
+        return OffensiveStringMatcher()
+
+    phrases = [
+        " ".join(random_word(rng) for _ in range(rng.choice([1, 1, 1, 2, 3])))
+        for _ in range(num_phrases)
+    ]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".txt", delete=False) as f:
+        f.write("\n".join(phrases))
+
+    try:
+        return OffensiveStringMatcher(f.name)
+    finally:
+        os.remove(f.name)
+
+
+def create_texts(num_texts, phrases, rng):
+    texts = []
+
+    for _ in range(num_texts):
+        words = rng.choice(CONVERSATION).split()
+
+        if rng.random() < 0.1:
+            words.insert(rng.randint(0, len(words)), rng.choice(phrases).upper())
+
+        texts.append(" ".join(words))
+
+    return texts
+
+
+def measure(fn, texts, repeats):
+    best = None
+
+    for _ in range(repeats):
+        start = time.perf_counter()
+        results = [fn(text) for text in texts]
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    return results, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the offensive string matcher.")
+    parser.add_argument("--texts", type=int, default=2000, help="number of texts to scan")
+    parser.add_argument("--phrases", type=int, default=3300, help="number of random phrases without --real")
+    parser.add_argument("--real", action="store_true", help="use parlai's offensive word list")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    reference = create_reference(args.phrases, args.real, rng)
+    phrases = trie_phrases(reference.offensive_trie)
+    matcher = PhraseMatcher(phrases)
+    texts = create_texts(args.texts, phrases, rng)
+
+    expected, reference_time = measure(
+        lambda text: reference.contains_offensive_language(text) is not None,
+        texts,
+        args.repeats,
+    )
+    results, matcher_time = measure(matcher.__contains__, texts, args.repeats)
+
+    assert results == expected, "results of the matchers are different"
+
+    print(f"{len(phrases)} phrases, {len(texts)} texts, {sum(results)} matches")
+    print(f"OffensiveStringMatcher: {reference_time:.4f}s")
+    print(f"PhraseMatcher: {matcher_time:.4f}s ({reference_time / matcher_time:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
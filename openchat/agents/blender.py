@@ -1,35 +1,25 @@
-from parlai.core.agents import add_datapath_and_model_args, create_agent_from_opt_file
+from parlai.core.agents import add_datapath_and_model_args
 from parlai.core.build_data import modelzoo_path
+from openchat.utils import create_agent_from_opt_file
 from openchat.base import ConvAI2Agent, Seq2SeqLM
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class BlenderGenerationAgent(ConvAI2Agent, Seq2SeqLM):
 
     def __init__(self, model: str, device: str, maxlen: int) -> None:
         model = self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
-
-        if "xxlarge" in model:
-            size = "9B"
-        elif "xlarge" in model:
-            size = "3B"
-        elif "large" in model:
-            size = "1Bdistill"
-        elif "medium" in model:
-            size = "400Mdistill"
-        elif "small" in model:
-            size = "90M"
-        else:
-            raise Exception("wrong model")
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
 
         option = self.set_options(
-            name=f"zoo:blender/blender_{size}/model",
+            name=spec.checkpoint,
             device=device,
         )
 
         super().__init__(
             name=model,
-            suffix="\n",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
             model=create_agent_from_opt_file(option),
@@ -37,13 +27,7 @@ class BlenderGenerationAgent(ConvAI2Agent, Seq2SeqLM):
 
     @staticmethod
     def available_models():
-        return [
-            "blender.small",
-            "blender.medium",
-            "blender.large",
-            "blender.xlarge",
-            "blender.xxlarge",
-        ]
+        return models_of(BlenderGenerationAgent)
 
     @staticmethod
     def default_maxlen():
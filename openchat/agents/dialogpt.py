@@ -1,19 +1,21 @@
 from transformers import GPT2LMHeadModel, GPT2Tokenizer
 from openchat.base import HuggingfaceAgent, DecoderLM
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class DialoGPTAgent(HuggingfaceAgent, DecoderLM):
 
     def __init__(self, model, device, maxlen):
         model = self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
 
-        name = f"microsoft/DialoGPT-{model.split('.')[-1]}"
+        name = spec.checkpoint
         tokenizer = GPT2Tokenizer.from_pretrained(name)
 
         super().__init__(
             name=model,
-            suffix="<|endoftext|>",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
             model=GPT2LMHeadModel.from_pretrained(name).to(device).eval(),
@@ -22,11 +24,7 @@ class DialoGPTAgent(HuggingfaceAgent, DecoderLM):
 
     @staticmethod
     def available_models():
-        return [
-            "dialogpt.small",
-            "dialogpt.medium",
-            "dialogpt.large",
-        ]
+        return models_of(DialoGPTAgent)
 
     @staticmethod
     def default_maxlen():
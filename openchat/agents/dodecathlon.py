@@ -1,58 +1,46 @@
 from parlai.core.build_data import modelzoo_path
-from parlai.core.agents import (
-    add_datapath_and_model_args,
-    create_agent_from_opt_file,
-)
-from openchat.utils import inherit
+from parlai.core.agents import add_datapath_and_model_args
+from openchat.utils import inherit, create_agent_from_opt_file
 from openchat.base import (
     ParlaiGenerationAgent,
     ConvAI2Agent,
     WizardOfWikipediaAgent,
     Seq2SeqLM,
 )
+from openchat.agents.registry import (
+    get_model_spec,
+    models_of,
+    CONVAI2,
+    WIZARD_OF_WIKIPEDIA,
+)
 
 
 class DodecathlonAgent(ParlaiGenerationAgent, Seq2SeqLM):
 
     def __init__(self, model, device, maxlen):
         model = self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
-
-        model = model + "_ft" if model != "all_tasks_mt" else model
-        name = f"zoo:dodecadialogue/{model.split('.')[-1]}/model"
-        option = self.set_options(name, device)
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
+        option = self.set_options(spec.checkpoint, device)
 
         super().__init__(
             name=model,
-            suffix="\n",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
             model=create_agent_from_opt_file(option),
         )
 
-        if "wizard_of_wikipedia" in name:
+        if spec.has(WIZARD_OF_WIKIPEDIA):
             inherit(self, (WizardOfWikipediaAgent, Seq2SeqLM))
             self.build_wizard_of_wikipedia()
 
-        elif "convai2" in name:
+        elif spec.has(CONVAI2):
             inherit(self, (ConvAI2Agent, Seq2SeqLM))
 
     @staticmethod
     def available_models():
-        return [
-            "dodecathlon.all_tasks_mt",
-            "dodecathlon.convai2",
-            "dodecathlon.wizard_of_wikipedia",
-            "dodecathlon.empathetic_dialogues"
-            "dodecathlon.eli5",
-            "dodecathlon.reddit",
-            "dodecathlon.twitter",
-            "dodecathlon.ubuntu",
-            "dodecathlon.image_chat",
-            "dodecathlon.cornell_movie",
-            "dodecathlon.light_dialog",
-            "dodecathlon.daily_dialog",
-        ]
+        return models_of(DodecathlonAgent)
 
     def set_options(self, name, device):
         option = {
@@ -2,31 +2,22 @@ import torch
 from transformers import AutoTokenizer, AutoModelForCausalLM
 from openchat.base import DecoderLM
 from openchat.base.agents.prompt import PromptAgent
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class GPTNeoAgent(PromptAgent, DecoderLM):
 
     def __init__(self, model, device, maxlen):
         model = self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
 
-        if "xlarge" in model:
-            size = "2.7B"
-        elif "large" in model:
-            size = "1.3B"
-        elif "small" in model:
-            size = "125M"
-        elif "medium" in model:
-            size = "350M"
-        else:
-            raise Exception("wrong model")
-
-        name = f"EleutherAI/gpt-neo-{size}"
+        name = spec.checkpoint
         tokenizer = AutoTokenizer.from_pretrained(name)
 
         super().__init__(
             name=model,
-            suffix=" ",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
             model=AutoModelForCausalLM.from_pretrained(name).to(device).eval(),
@@ -35,12 +26,7 @@ class GPTNeoAgent(PromptAgent, DecoderLM):
 
     @staticmethod
     def available_models():
-        return [
-            "gptneo.small",
-            "gptneo.medium",
-            "gptneo.large",
-            "gptneo.xlarge",
-        ]
+        return models_of(GPTNeoAgent)
 
     @staticmethod
     def default_maxlen():
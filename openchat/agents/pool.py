@@ -0,0 +1,177 @@
+import copy
+import gc
+import threading
+
+from openchat.agents import registry
+
+
+def torch_modules(agent):
+    """
+    Find torch modules held by an agent.
+    huggingface agents hold the module as `model`, parlai agents as `model.model`.
+    """
+
+    import torch
+
+    modules, candidates = [], []
+
+    for value in vars(agent).values():
+        candidates += [value, getattr(value, "model", None)]
+
+    for candidate in candidates:
+        if isinstance(candidate, torch.nn.Module) and \
+                all(candidate is not m for m in modules):
+            modules.append(candidate)
+
+    return modules
+
+
+class ModelPool(object):
+
+    def __init__(self):
+        """
+        Process-wide pool of loaded models keyed by (model name, device, precision).
+        `acquire` returns a shallow copy of the loaded agent, so every caller has
+        its own maxlen and per-agent state but shares the weights and tokenizer.
+        """
+
+        self.entries = {}
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def make_key(name, device, precision="fp32"):
+        return name.lower(), device, precision.lower()
+
+    def acquire(self, name, device, maxlen=-1, precision="fp32"):
+        """
+        Get an agent for the model, loading the weights only if they are not loaded yet.
+
+        Args:
+            name (str): model name
+            device (str): device of the model
+            maxlen (int): maximum length of model input, default of the model if `maxlen <= 0`
+            precision (str): precision of the weights, one of ["fp32", "bf16", "int8"]
+
+        Returns:
+            (BaseAgent): agent sharing the weights of the pool
+        """
+
+        key = self.make_key(name, device, precision)
+
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = {
+                    "agent": self.load(key),
+                    "references": 0,
+                }
+
+            entry = self.entries[key]
+            entry["references"] += 1
+
+        agent = copy.copy(entry["agent"])
+        agent.pool_key = key
+
+        if maxlen > 0:
+            agent.maxlen = maxlen
+
+        return agent
+
+    def release(self, agent):
+        key = getattr(agent, "pool_key", None)
+
+        with self.lock:
+            if key in self.entries:
+                entry = self.entries[key]
+                entry["references"] = max(entry["references"] - 1, 0)
+
+        agent.pool_key = None
+
+    def unload(self, name, device, precision="fp32", force=False):
+        """
+        Remove the loaded weights from the pool.
+
+        Args:
+            force (bool): unload even if some agents still use the weights
+        """
+
+        key = self.make_key(name, device, precision)
+
+        with self.lock:
+            if key not in self.entries:
+                return
+
+            if self.entries[key]["references"] > 0 and not force:
+                raise Exception(
+                    f"model {key} is still used by {self.entries[key]['references']} agents. "
+                    f"release them first or set `force=True`."
+                )
+
+            del self.entries[key]
+
+        gc.collect()
+
+        if "cuda" in device:
+            import torch
+            torch.cuda.empty_cache()
+
+    def preload(self, names, device, precision="fp32", share_memory=False, freeze=True):
+        """
+        Load models before forking worker processes.
+        forked workers share the weights with the parent copy-on-write.
+
+        Args:
+            names (List[str]): model names
+            device (str): device of the models
+            precision (str): precision of the weights
+            share_memory (bool): move weights to shared memory,
+                so workers started with torch.multiprocessing share them too.
+            freeze (bool): move loaded objects to the permanent gc generation,
+                so the garbage collector of workers doesn't touch (and copy) their pages.
+        """
+
+        for name in names:
+            key = self.make_key(name, device, precision)
+
+            with self.lock:
+                if key not in self.entries:
+                    self.entries[key] = {
+                        "agent": self.load(key),
+                        "references": 0,
+                    }
+
+                agent = self.entries[key]["agent"]
+
+            if share_memory:
+                for module in torch_modules(agent):
+                    module.share_memory()
+
+        if freeze and hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+
+    def loaded(self):
+        with self.lock:
+            return {
+                key: entry["references"]
+                for key, entry in self.entries.items()
+            }
+
+    @staticmethod
+    def load(key):
+        name, device, precision = key
+
+        if precision == "fp32":
+            return registry.load_agent_class(name)(name, device, -1)
+
+        from openchat.utils.precision_utils import check_precision, set_precision
+
+        precision = check_precision(precision, device)
+        agent = registry.load_agent_class(name)(name, device, -1)
+        return set_precision(agent, precision)
+
+
+_pool = ModelPool()
+
+
+def get_pool():
+    return _pool
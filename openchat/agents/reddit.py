@@ -1,30 +1,26 @@
-from parlai.core.agents import add_datapath_and_model_args, create_agent_from_opt_file
+from parlai.core.agents import add_datapath_and_model_args
 from parlai.core.build_data import modelzoo_path
+from openchat.utils import create_agent_from_opt_file
 
 from openchat.base import ParlaiGenerationAgent, Seq2SeqLM
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class RedditAgent(ParlaiGenerationAgent, Seq2SeqLM):
 
     def __init__(self, model: str, device: str, maxlen) -> None:
-        self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
-
-        if "xxlarge" in model:
-            size = "9B"
-        elif "xlarge" in model:
-            size = "3B"
-        else:
-            raise Exception("wrong model")
+        model = self.check_agent(model)
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
 
         option = self.set_options(
-            name=f"zoo:blender/reddit_{size}/model",
+            name=spec.checkpoint,
             device=device,
         )
 
         super().__init__(
             name=model,
-            suffix="\n",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
             model=create_agent_from_opt_file(option),
@@ -32,10 +28,7 @@ class RedditAgent(ParlaiGenerationAgent, Seq2SeqLM):
 
     @staticmethod
     def available_models():
-        return [
-            "reddit.xlarge",
-            "reddit.xxlarge",
-        ]
+        return models_of(RedditAgent)
 
     @staticmethod
     def default_maxlen():
@@ -0,0 +1,274 @@
+import importlib
+from dataclasses import dataclass
+from typing import Tuple
+
+ENTRY_POINT_GROUP = "openchat.models"
+
+# capability flags
+DECODER = "decoder"
+SEQ2SEQ = "seq2seq"
+ENCODER = "encoder"
+SINGLE_TURN = "single_turn"
+CONVAI2 = "convai2"
+WIZARD_OF_WIKIPEDIA = "wizard_of_wikipedia"
+PROMPT = "prompt"
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """
+    Static description of a model, available without importing its backend.
+
+    Args:
+        name (str): model name used by `OpenChat(model=name)`
+        backend (str): agent class as "module:class"
+        checkpoint (str): huggingface model id or parlai zoo path
+        default_maxlen (int): default maximum length of model input
+        suffix (str): separator between turns
+        capabilities (Tuple[str]): capability flags of the model
+        batch_size (int): recommended maximum batch size for serving
+    """
+
+    name: str
+    backend: str
+    checkpoint: str
+    default_maxlen: int
+    suffix: str
+    capabilities: Tuple[str, ...] = ()
+    batch_size: int = 16
+
+    @property
+    def family(self):
+        return self.name.split(".")[0]
+
+    def has(self, capability):
+        return capability in self.capabilities
+
+
+MODELS = {}
+_plugins_loaded = False
+
+
+def register(*specs, override=False):
+    for spec in specs:
+        if spec.name in MODELS and not override:
+            raise Exception(f"model is already registered: {spec.name}")
+
+        MODELS[spec.name] = spec
+
+
+def load_plugins():
+    """
+    Register models of installed plugins. a plugin exposes a `ModelSpec`,
+    a list of them or a function returning them in the `openchat.models` entry point group.
+    """
+
+    global _plugins_loaded
+
+    if _plugins_loaded:
+        return
+
+    _plugins_loaded = True
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+
+    entries = entry_points()
+
+    if hasattr(entries, "select"):
+        entries = entries.select(group=ENTRY_POINT_GROUP)
+    else:
+        entries = entries.get(ENTRY_POINT_GROUP, [])
+
+    for entry in entries:
+        specs = entry.load()
+
+        if callable(specs):
+            specs = specs()
+
+        if isinstance(specs, ModelSpec):
+            specs = [specs]
+
+        register(*specs)
+
+
+def get_model_spec(name) -> ModelSpec:
+    load_plugins()
+
+    if name not in MODELS:
+        raise Exception(f"wrong model: {name}")
+
+    return MODELS[name]
+
+
+def available_models():
+    load_plugins()
+    return list(MODELS.keys())
+
+
+def models_of(agent_class):
+    load_plugins()
+    backend = f"{agent_class.__module__}:{agent_class.__name__}"
+    return [name for name, spec in MODELS.items() if spec.backend == backend]
+
+
+def load_agent_class(name):
+    """
+    Import the module of the agent for `name` and return the agent class.
+    """
+
+    module, class_name = get_model_spec(name).backend.split(":")
+    return getattr(importlib.import_module(module), class_name)
+
+
+register(*[
+    ModelSpec(
+        name=f"blender.{size}",
+        backend="openchat.agents.blender:BlenderGenerationAgent",
+        checkpoint=f"zoo:blender/blender_{checkpoint}/model",
+        default_maxlen=128,
+        suffix="\n",
+        capabilities=(SEQ2SEQ, CONVAI2),
+        batch_size=batch_size,
+    ) for size, checkpoint, batch_size in [
+        ("small", "90M", 32),
+        ("medium", "400Mdistill", 16),
+        ("large", "1Bdistill", 8),
+        ("xlarge", "3B", 4),
+        ("xxlarge", "9B", 1),
+    ]
+])
+
+register(*[
+    ModelSpec(
+        name=f"dialogpt.{size}",
+        backend="openchat.agents.dialogpt:DialoGPTAgent",
+        checkpoint=f"microsoft/DialoGPT-{size}",
+        default_maxlen=48,
+        suffix="<|endoftext|>",
+        capabilities=(DECODER,),
+        batch_size=batch_size,
+    ) for size, batch_size in [
+        ("small", 32),
+        ("medium", 16),
+        ("large", 8),
+    ]
+])
+
+register(*[
+    ModelSpec(
+        name=f"gptneo.{size}",
+        backend="openchat.agents.gptneo:GPTNeoAgent",
+        checkpoint=f"EleutherAI/gpt-neo-{checkpoint}",
+        default_maxlen=256,
+        suffix=" ",
+        capabilities=(DECODER, PROMPT),
+        batch_size=batch_size,
+    ) for size, checkpoint, batch_size in [
+        ("small", "125M", 16),
+        ("medium", "350M", 8),
+        ("large", "1.3B", 4),
+        ("xlarge", "2.7B", 2),
+    ]
+])
+
+register(*[
+    ModelSpec(
+        name=f"dodecathlon.{task}",
+        backend="openchat.agents.dodecathlon:DodecathlonAgent",
+        checkpoint=f"zoo:dodecadialogue/{checkpoint}/model",
+        default_maxlen=128,
+        suffix="\n",
+        capabilities=(SEQ2SEQ,) + capabilities,
+        batch_size=8,
+    ) for task, checkpoint, capabilities in [
+        ("all_tasks_mt", "all_tasks_mt", ()),
+        ("convai2", "convai2_ft", (CONVAI2,)),
+        ("wizard_of_wikipedia", "wizard_of_wikipedia_ft", (WIZARD_OF_WIKIPEDIA,)),
+        ("empathetic_dialogues", "empathetic_dialogues_ft", ()),
+        ("eli5", "eli5_ft", ()),
+        ("reddit", "reddit_ft", ()),
+        ("twitter", "twitter_ft", ()),
+        ("ubuntu", "ubuntu_ft", ()),
+        ("image_chat", "image_chat_ft", ()),
+        ("cornell_movie", "cornell_movie_ft", ()),
+        ("light_dialog", "light_dialog_ft", ()),
+        ("daily_dialog", "daily_dialog_ft", ()),
+    ]
+])
+
+register(*[
+    ModelSpec(
+        name=f"reddit.{size}",
+        backend="openchat.agents.reddit:RedditAgent",
+        checkpoint=f"zoo:blender/reddit_{checkpoint}/model",
+        default_maxlen=128,
+        suffix="\n",
+        capabilities=(SEQ2SEQ,),
+        batch_size=batch_size,
+    ) for size, checkpoint, batch_size in [
+        ("xlarge", "3B", 4),
+        ("xxlarge", "9B", 1),
+    ]
+])
+
+register(
+    ModelSpec(
+        name="safety.sensitive",
+        backend="openchat.agents.safety:SensitiveAgent",
+        checkpoint="zoo:sensitive_topics_classifier/model",
+        default_maxlen=128,
+        suffix="",
+        capabilities=(ENCODER, SINGLE_TURN),
+        batch_size=64,
+    ),
+    ModelSpec(
+        name="safety.offensive",
+        backend="openchat.agents.safety:OffensiveAgent",
+        checkpoint="zoo:dialogue_safety/single_turn/model",
+        default_maxlen=128,
+        suffix="",
+        capabilities=(ENCODER, SINGLE_TURN),
+        batch_size=64,
+    ),
+)
+
+register(*[
+    ModelSpec(
+        name=f"unlikelihood.{task}",
+        backend="openchat.agents.unlikelihood:UnlikelihoodAgent",
+        checkpoint=f"zoo:dialogue_unlikelihood/{checkpoint}/model",
+        default_maxlen=128,
+        suffix="\n",
+        capabilities=(SEQ2SEQ,) + capabilities,
+        batch_size=8,
+    ) for task, checkpoint, capabilities in [
+        ("wizard_of_wikipedia.context_and_label", "rep_wiki_ctxt_and_label", (WIZARD_OF_WIKIPEDIA,)),
+        ("wizard_of_wikipedia.context", "rep_wiki_ctxt", (WIZARD_OF_WIKIPEDIA,)),
+        ("wizard_of_wikipedia.label", "rep_label_ctxt", (WIZARD_OF_WIKIPEDIA,)),
+        ("convai2.context_and_label", "rep_convai2_ctxt_and_label", (CONVAI2,)),
+        ("convai2.context", "rep_convai2_ctxt", (CONVAI2,)),
+        ("convai2.label", "rep_convai2_label", (CONVAI2,)),
+        ("convai2.vocab.alpha.1e-0", "vocab_alpha1e0", (CONVAI2,)),
+        ("convai2.vocab.alpha.1e-1", "vocab_alpha1e1", (CONVAI2,)),
+        ("convai2.vocab.alpha.1e-2", "vocab_alpha1e2", (CONVAI2,)),
+        ("convai2.vocab.alpha.1e-3", "vocab_alpha1e3", (CONVAI2,)),
+        ("eli5.context_and_label", "rep_eli5_ctxt_and_label", ()),
+        ("eli5.context", "rep_eli5_ctxt", ()),
+        ("eli5.label", "rep_eli5_label", ()),
+    ]
+])
+
+register(
+    ModelSpec(
+        name="wizard_of_wikipedia.end2end_generator",
+        backend="openchat.agents.wow:WizardOfWikipediaGenerationAgent",
+        checkpoint="zoo:wizard_of_wikipedia/end2end_generator/model",
+        default_maxlen=128,
+        suffix="\n",
+        capabilities=(SEQ2SEQ, WIZARD_OF_WIKIPEDIA),
+        batch_size=8,
+    ),
+)
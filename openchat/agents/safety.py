@@ -1,26 +1,38 @@
 from parlai.agents.transformer.transformer import TransformerClassifierAgent
 from parlai.core.build_data import modelzoo_path
 from parlai.utils.safety import OffensiveStringMatcher
-from parlai.core.agents import add_datapath_and_model_args, create_agent_from_opt_file, create_agent
+from parlai.core.agents import add_datapath_and_model_args, create_agent
+from openchat.utils import create_agent_from_opt_file
+from openchat.utils.string_utils import PhraseMatcher, trie_phrases
+from openchat.utils.trace_utils import span
 from openchat.base import ParlaiClassificationAgent, EncoderLM, SingleTurn
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class OffensiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
 
     def __init__(self, model, device, maxlen):
+        model = self.check_agent(model)
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
+
         super(OffensiveAgent, self).__init__(
             device=device,
             maxlen=maxlen,
-            model=None,
+            model=self._create_safety_model(
+                spec.checkpoint,
+                device=device,
+            ),
             suffix="",
             name=model,
         )
-        self.string_matcher = OffensiveStringMatcher()
-        self.agent = self._create_safety_model(
-            "zoo:dialogue_safety/single_turn/model",
-            device=device,
-        )
-        self.model = self.agent.model
+        self.string_matcher = self._create_string_matcher()
+        self.agent = self.model
+
+    @staticmethod
+    def _create_string_matcher():
+        # same phrases and matching rules as parlai's matcher, with a faster check of batches.
+        return PhraseMatcher(trie_phrases(OffensiveStringMatcher().offensive_trie))
 
     def _create_safety_model(self, custom_model_file, device):
         from parlai.core.params import ParlaiParser
@@ -41,56 +53,80 @@ class OffensiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
         elif "cuda" in device:
             safety_opt["override"]["gpu"] = 0
 
-        return create_agent(safety_opt, requireModelExists=True)
+        # downloads the zoo model if needed, then loads it as the other agents do (with the flat file if it exists)
+        safety_opt["model_file"] = modelzoo_path(safety_opt["datapath"], safety_opt["model_file"])
+        agent = create_agent_from_opt_file(safety_opt)
+
+        if agent is None:
+            agent = create_agent(safety_opt, requireModelExists=True)
+
+        return agent
 
     def contains_offensive_language(self, text):
         """
-        Returns the probability that a message is safe according to the classifier.
+        Returns the label of a message according to the classifier.
         """
-        act = {'text': text, 'episode_done': True}
-        self.agent.observe(act)
-        response = self.agent.act()['text']
-        pred_class, prob = [x.split(': ')[-1] for x in response.split('\n')]
-        pred_not_ok = self.labels()[0 if pred_class == "__ok__" else 1]
-        return pred_not_ok
+
+        return self.score_batch([text])["labels"][0]
 
     def labels(self):
         return ["non-offensive", "offensive"]
 
+    def class_labels(self):
+        # the classifier has classes `__ok__` and `__notok__`.
+        non_offensive, offensive = self.labels()
+
+        return [
+            non_offensive if class_name == "__ok__" else offensive
+            for class_name in self.model.class_list
+        ]
+
     def predict(self, text, method="both", **kwargs):
+        return self.predict_batch([text], method=method)[0]
+
+    def predict_batch(self, texts, method="both", **kwargs):
+        """
+        Classify texts with the string matcher and/or one classifier forward pass.
+        with method `both`, only texts passing the string matcher are classified.
+        """
+
         assert method in ["both", "string-match", "bert"], \
             "param method must be one of ['both', 'string-match', 'bert']"
 
-        if method == "string-match":
-            return {
-                "input":
-                    text,
-                "output":
-                    "offensive"
-                    if text in self.string_matcher else "non-offensive",
-            }
-
-        if method == "bert":
-            return {
-                "input": text,
-                "output": self.contains_offensive_language(text),
-            }
-
-        if method == "both":
-            if text in self.string_matcher:
-                return {
-                    "input": text,
-                    "output": "offensive",
-                }
-
-            return {
-                "input": text,
-                "output": self.contains_offensive_language(text),
-            }
+        outputs = [{
+            "input": text,
+            "output": None,
+            "probability": None,
+        } for text in texts]
+
+        if method in ["string-match", "both"]:
+            with span("safety.string_match", model=self.name):
+                matches = self.string_matcher.contains_batch(texts)
+
+            for output, match in zip(outputs, matches):
+                if match:
+                    output["output"] = "offensive"
+                    output["probability"] = 1.0
+                elif method == "string-match":
+                    output["output"] = "non-offensive"
+                    output["probability"] = 1.0
+
+        remains = [output for output in outputs if output["output"] is None]
+        scores = self.score_batch([output["input"] for output in remains])
+
+        for output, label, probability in zip(
+                remains,
+                scores["labels"],
+                scores["probabilities"],
+        ):
+            output["output"] = label
+            output["probability"] = probability
+
+        return outputs
 
     @staticmethod
     def available_models():
-        return ['safety.offensive']
+        return models_of(OffensiveAgent)
 
     @staticmethod
     def default_maxlen():
@@ -100,8 +136,12 @@ class OffensiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
 class SensitiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
 
     def __init__(self, model, device, maxlen):
+        model = self.check_agent(model)
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
+
         option = self.set_options(
-            name="zoo:sensitive_topics_classifier/model",
+            name=spec.checkpoint,
             device=device,
         )
 
@@ -125,7 +165,7 @@ class SensitiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
 
     @staticmethod
     def available_models():
-        return ['safety.sensitive']
+        return models_of(SensitiveAgent)
 
     @staticmethod
     def default_maxlen():
@@ -137,7 +177,7 @@ class SensitiveAgent(ParlaiClassificationAgent, EncoderLM, SingleTurn):
         add_datapath_and_model_args(option)
         datapath = option.get("datapath")
         option['model_file'] = modelzoo_path(datapath, name)
-        option = {
+        option["override"] = {
             "no_cuda": False if "cuda" in device else True,
         }
 
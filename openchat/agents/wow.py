@@ -1,34 +1,34 @@
-from parlai.core.agents import create_agent_from_model_file, add_datapath_and_model_args
+from parlai.core.agents import add_datapath_and_model_args
 from parlai.core.build_data import modelzoo_path
+from openchat.utils import create_agent_from_opt_file
 
 from openchat.base import WizardOfWikipediaAgent, Seq2SeqLM
+from openchat.agents.registry import get_model_spec, models_of
 
 
 class WizardOfWikipediaGenerationAgent(WizardOfWikipediaAgent, Seq2SeqLM):
 
     def __init__(self, model, device, maxlen=-1):
         model = self.check_agent(model)
-        maxlen = maxlen if maxlen > 0 else self.default_maxlen()
+        spec = get_model_spec(model)
+        maxlen = maxlen if maxlen > 0 else spec.default_maxlen
 
-        if "end2end_generator" in model:
-            name = "end2end_generator"
-        else:
-            raise Exception("wrong model")
+        option = self.set_options(
+            name=spec.checkpoint,
+            device=device,
+        )
 
         super().__init__(
             name=model,
-            suffix="\n",
+            suffix=spec.suffix,
             device=device,
             maxlen=maxlen,
-            model=create_agent_from_model_file(
-                f"zoo:wizard_of_wikipedia/{name}/model"),
+            model=create_agent_from_opt_file(option),
         )
 
     @staticmethod
     def available_models():
-        return [
-            "wizard_of_wikipedia.end2end_generator",
-        ]
+        return models_of(WizardOfWikipediaGenerationAgent)
 
     @staticmethod
     def default_maxlen():
@@ -1,21 +1,48 @@
-from openchat.base.agents.base import BaseAgent, EncoderLM, DecoderLM, Seq2SeqLM, SingleTurn
-from openchat.base.agents.huggingface import HuggingfaceAgent
-from openchat.base.agents.parlai import ParlaiAgent, ParlaiGenerationAgent, ParlaiClassificationAgent
-from openchat.base.agents.convai2 import ConvAI2Agent
-from openchat.base.agents.wow import WizardOfWikipediaAgent
-from openchat.base.agents.prompt import PromptAgent
+import importlib
+
+# agents are imported on first access, because their modules import
+# heavy backends (torch, transformers, parlai) at module level.
+_modules = {
+    "BaseAgent": "openchat.base.agents.base",
+    "EncoderLM": "openchat.base.agents.base",
+    "DecoderLM": "openchat.base.agents.base",
+    "Seq2SeqLM": "openchat.base.agents.base",
+    "SingleTurn": "openchat.base.agents.base",
+    "HuggingfaceAgent": "openchat.base.agents.huggingface",
+    "ParlaiAgent": "openchat.base.agents.parlai",
+    "ParlaiGenerationAgent": "openchat.base.agents.parlai",
+    "ParlaiClassificationAgent": "openchat.base.agents.parlai",
+    "ConvAI2Agent": "openchat.base.agents.convai2",
+    "WizardOfWikipediaAgent": "openchat.base.agents.wow",
+    "PromptAgent": "openchat.base.agents.prompt",
+    "SafetyFilter": "openchat.base.agents.safety",
+    "add_safety_filter": "openchat.base.agents.safety",
+    "ContinuousBatchingEngine": "openchat.base.agents.continuous",
+}
 
 __all__ = [
-    BaseAgent,
-    HuggingfaceAgent,
-    ParlaiAgent,
-    ParlaiGenerationAgent,
-    ParlaiClassificationAgent,
-    ConvAI2Agent,
-    WizardOfWikipediaAgent,
-    PromptAgent,
-    EncoderLM,
-    DecoderLM,
-    Seq2SeqLM,
-    SingleTurn,
+    "BaseAgent",
+    "HuggingfaceAgent",
+    "ParlaiAgent",
+    "ParlaiGenerationAgent",
+    "ParlaiClassificationAgent",
+    "ConvAI2Agent",
+    "WizardOfWikipediaAgent",
+    "PromptAgent",
+    "SafetyFilter",
+    "add_safety_filter",
+    "ContinuousBatchingEngine",
+    "EncoderLM",
+    "DecoderLM",
+    "Seq2SeqLM",
+    "SingleTurn",
 ]
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_modules[name]), name)
+    globals()[name] = value
+    return value
@@ -1,9 +1,5 @@
-import parlai.utils.logging as logging
-
 from abc import ABC, abstractmethod
-from typing import Dict
-
-logging.disable()
+from typing import Dict, List
 
 
 # marker interface
@@ -49,6 +45,9 @@ class BaseAgent(ABC):
     def predict(self, text: str, **kwargs) -> Dict[str, str]:
         raise NotImplemented
 
+    def predict_batch(self, texts: List[str], **kwargs) -> List[Dict[str, str]]:
+        return [self.predict(text, **kwargs) for text in texts]
+
     @staticmethod
     @abstractmethod
     def default_maxlen():
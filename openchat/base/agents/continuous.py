@@ -0,0 +1,311 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+import torch
+
+from openchat.utils.trace_utils import span
+from openchat.utils.generation_utils import (
+    concat_past,
+    legacy_past,
+    make_logits_processor,
+    pad_past,
+    select_next_tokens,
+    select_past,
+)
+
+
+class Sequence(object):
+
+    def __init__(
+        self,
+        input_ids,
+        method,
+        top_k,
+        top_p,
+        no_repeat_ngram_size,
+        max_new_tokens,
+        stop_sequences,
+        stop_token_ids,
+    ):
+        self.input_ids = input_ids
+        self.method = method
+        self.max_new_tokens = max_new_tokens
+        self.stop_sequences = stop_sequences
+        self.stop_token_ids = stop_token_ids
+        self.generated = []
+        self.future = Future()
+        self.logits_processor = make_logits_processor(
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            repetition_penalty=2.0,
+        )
+
+    def choose(self, logits, eos_token_id):
+        """
+        Select the next token from the logits of the last position.
+
+        Returns:
+            (bool): whether the sequence is finished
+        """
+
+        scores = self.logits_processor(self.input_ids, logits)
+        next_id = select_next_tokens(scores, self.method)
+
+        if next_id.item() == eos_token_id:
+            return True
+
+        self.input_ids = torch.cat([self.input_ids, next_id[:, None]], dim=-1)
+        self.generated.append(next_id.item())
+
+        if len(self.generated) >= self.max_new_tokens or next_id.item() in self.stop_token_ids:
+            return True
+
+        for ids in self.stop_sequences:
+            if tuple(self.generated[-len(ids):]) == ids:
+                return True
+
+        return False
+
+
+class ContinuousBatchingEngine(object):
+
+    def __init__(self, model, eos_token_id, device, max_batch_size=16, name=None):
+        """
+        Iteration level batching of a decoder only model.
+        sequences join the running batch as soon as a slot is free and leave it
+        as soon as they are finished, instead of waiting for the longest sequence of a static batch.
+        key/values of the running batch are kept left padded to the longest sequence,
+        padding is dropped when the longest sequences leave.
+
+        Args:
+            model (PreTrainedModel): decoder only model
+            eos_token_id (int): id of the end of text token
+            device (str): device of the model
+            max_batch_size (int): maximum number of running sequences
+            name (str): model name for spans
+        """
+
+        self.model = model
+        self.eos_token_id = eos_token_id
+        self.device = device
+        self.max_batch_size = max_batch_size
+        self.name = name
+        self.waiting = queue.Queue()
+        self.running = []
+        self.past = None
+        self.attention_mask = None
+        self.thread = None
+        self.num_steps = 0
+        self.num_sequences = 0
+        self.num_tokens = 0
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        if self.thread is not None:
+            self.waiting.put(None)
+            self.thread.join()
+            self.thread = None
+
+    def submit(
+        self,
+        input_ids,
+        method="top_k",
+        top_k=20,
+        top_p=None,
+        no_repeat_ngram_size=4,
+        max_new_tokens=64,
+        stop_sequences=(),
+        stop_token_ids=(),
+    ):
+        """
+        Queue a sequence for generation.
+
+        Args:
+            input_ids (List[int]): token ids of the input
+            method (str): one of ["greedy", "top_k", "nucleus"]
+            max_new_tokens (int): maximum number of generated tokens
+            stop_sequences (List[Tuple[int]]): token ids which finish the sequence when generated
+            stop_token_ids (Set[int]): tokens which finish the sequence when generated
+
+        Returns:
+            (Future): generated token ids without the end of text token
+        """
+
+        assert method in ["greedy", "top_k", "nucleus"], \
+            "param `method` must be one of ['greedy', 'top_k', 'nucleus']"
+
+        sequence = Sequence(
+            input_ids=torch.tensor([input_ids], device=self.device),
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            max_new_tokens=max_new_tokens,
+            stop_sequences=list(stop_sequences),
+            stop_token_ids=set(stop_token_ids),
+        )
+
+        self.waiting.put(sequence)
+        return sequence.future
+
+    def run(self):
+        while True:
+            if not self.admit():
+                break
+
+            if len(self.running) > 0:
+                try:
+                    self.step()
+                except Exception as e:
+                    self.fail(e)
+
+        self.fail(Exception("continuous batching engine is stopped"), waiting=True)
+
+    def admit(self):
+        """
+        Prefill waiting sequences into free slots, blocking only if nothing is running.
+
+        Returns:
+            (bool): False if the engine is stopped
+        """
+
+        while len(self.running) < self.max_batch_size:
+            try:
+                sequence = self.waiting.get(block=len(self.running) == 0)
+            except queue.Empty:
+                break
+
+            if sequence is None:
+                return False
+
+            if not sequence.future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                self.prefill(sequence)
+            except Exception as e:
+                sequence.future.set_exception(e)
+
+        return True
+
+    @torch.no_grad()
+    def prefill(self, sequence):
+        with span("hf.prefill", model=self.name):
+            outputs = self.model(input_ids=sequence.input_ids, use_cache=True)
+
+        self.num_sequences += 1
+
+        if sequence.choose(outputs.logits[:, -1, :], self.eos_token_id):
+            sequence.future.set_result(sequence.generated)
+            return
+
+        self.add(sequence, legacy_past(outputs.past_key_values))
+
+    def add(self, sequence, past):
+        length = sequence.input_ids.size(-1) - 1
+        mask = torch.ones(1, length, dtype=torch.long, device=self.device)
+
+        if self.past is None:
+            self.past, self.attention_mask = past, mask
+        else:
+            max_length = max(length, self.attention_mask.size(-1))
+            self.past = concat_past([
+                pad_past(self.past, max_length),
+                pad_past(past, max_length),
+            ])
+            self.attention_mask = torch.cat([
+                self.pad_mask(self.attention_mask, max_length),
+                self.pad_mask(mask, max_length),
+            ])
+
+        self.running.append(sequence)
+
+    @staticmethod
+    def pad_mask(mask, length):
+        if mask.size(-1) >= length:
+            return mask
+
+        return torch.cat([mask.new_zeros(mask.size(0), length - mask.size(-1)), mask], dim=-1)
+
+    @torch.no_grad()
+    def step(self):
+        """
+        Feed the last token of every running sequence in one forward pass.
+        """
+
+        next_ids = torch.tensor([[s.generated[-1]] for s in self.running], device=self.device)
+        # positions of left padded rows start after their padding
+        position_ids = self.attention_mask.sum(dim=-1, keepdim=True)
+        attention_mask = torch.cat([self.attention_mask, torch.ones_like(next_ids)], dim=-1)
+
+        with span("hf.step", model=self.name):
+            outputs = self.model(
+                input_ids=next_ids,
+                past_key_values=self.past,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=True,
+            )
+
+        self.past = legacy_past(outputs.past_key_values)
+        self.attention_mask = attention_mask
+        self.num_steps += 1
+        self.num_tokens += len(self.running)
+        finished = []
+
+        for i, sequence in enumerate(self.running):
+            if sequence.choose(outputs.logits[i:i + 1, -1, :], self.eos_token_id):
+                finished.append(i)
+
+        if len(finished) > 0:
+            self.remove(finished)
+
+    def remove(self, finished):
+        for i in finished:
+            self.running[i].future.set_result(self.running[i].generated)
+
+        keep = [i for i in range(len(self.running)) if i not in finished]
+        self.running = [self.running[i] for i in keep]
+
+        if len(keep) == 0:
+            self.past, self.attention_mask = None, None
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        mask = self.attention_mask.index_select(0, index)
+        # positions which are padding in every remaining row
+        start = int((mask.size(-1) - mask.sum(dim=-1)).min())
+        self.past = select_past(self.past, index, start)
+        self.attention_mask = mask[:, start:]
+
+    def fail(self, exception, waiting=False):
+        for sequence in self.running:
+            sequence.future.set_exception(exception)
+
+        self.running, self.past, self.attention_mask = [], None, None
+
+        while waiting:
+            try:
+                sequence = self.waiting.get(block=False)
+            except queue.Empty:
+                break
+
+            if sequence is not None and sequence.future.set_running_or_notify_cancel():
+                sequence.future.set_exception(exception)
+
+    def stats(self):
+        return {
+            "running": len(self.running),
+            "waiting": self.waiting.qsize(),
+            "sequences": self.num_sequences,
+            "steps": self.num_steps,
+            "tokens": self.num_tokens,
+            "mean_batch_size": self.num_tokens / self.num_steps if self.num_steps else None,
+        }
@@ -1,11 +1,27 @@
 import torch
 
-from typing import Dict
+from typing import Dict, List
 from openchat.base import BaseAgent, DecoderLM
+from openchat.utils.cache_utils import LRUCache
+from openchat.utils.trace_utils import span
+from openchat.base.agents.continuous import ContinuousBatchingEngine
+from openchat.utils.generation_utils import (
+    common_prefix_length,
+    make_length_fn,
+    make_logits_processor,
+    repetition_penalty_kwargs,
+    select_next_tokens,
+    slice_past,
+    speculative_greedy,
+)
 
 
 class HuggingfaceAgent(BaseAgent):
 
+    session_cache = None
+    engine = None
+    draft = None
+
     @torch.no_grad()
     def predict(
         self,
@@ -16,6 +32,7 @@ class HuggingfaceAgent(BaseAgent):
         top_p: float = None,
         no_repeat_ngram_size: int = 4,
         length_penalty: int = 0.65,
+        user_id: str = None,
     ) -> Dict[str, str]:
         """
         Generate utterance.
@@ -26,47 +43,568 @@ class HuggingfaceAgent(BaseAgent):
             top_k (int): k value for top-k sampling
             top_p (float): probability for nuclear sampling
             no_repeat_ngram_size (int): no repeat n-gram size
+            user_id (str): session id for reusing key/values of the previous turn
 
         Returns:
             (Dict[str, str]): user input and generated utterance
         """
 
+        if self.use_session_cache(user_id, method) and not self.use_speculative_decoding(method):
+            with span("hf.generate_with_session", model=self.name):
+                output_string = self.generate_with_session(
+                    text=text,
+                    user_id=user_id,
+                    max_length=self.maxlen * 2,
+                    method=method,
+                    top_k=top_k,
+                    top_p=top_p,
+                    no_repeat_ngram_size=no_repeat_ngram_size,
+                )
+
+            return {"input": text, "output": output_string}
+
+        return self.predict_batch(
+            texts=[text],
+            method=method,
+            num_beams=num_beams,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            length_penalty=length_penalty,
+        )[0]
+
+    @torch.no_grad()
+    def predict_batch(
+        self,
+        texts: List[str],
+        method: str = "top_k",
+        num_beams: int = 5,
+        top_k: int = 20,
+        top_p: float = None,
+        no_repeat_ngram_size: int = 4,
+        length_penalty: int = 0.65,
+    ) -> List[Dict[str, str]]:
+        """
+        Generate utterances for several inputs with one `generate` call.
+
+        Args:
+            texts (List[str]): input sentences
+            num_beams (int): size of beam search
+            top_k (int): k value for top-k sampling
+            top_p (float): probability for nuclear sampling
+            no_repeat_ngram_size (int): no repeat n-gram size
+
+        Returns:
+            (List[Dict[str, str]]): user input and generated utterance for each text
+        """
+
         method = method.lower()
         assert method in ["greedy", "beam", "top_k", "nucleus"], \
             "param `method` must be one of ['greedy', 'beam', 'top_k', 'nucleus']"
 
-        if method == "greedy":
+        if self.decodes_one_sequence(method):
             num_beams = 1
 
-        input_ids = self.tokenizer(
+        if self.use_speculative_decoding(method):
+            with span("hf.speculative", model=self.name):
+                return [{
+                    "input": text,
+                    "output": self.tokenizer.decode(
+                        list(self.speculative_tokens(text, no_repeat_ngram_size=no_repeat_ngram_size)),
+                        skip_special_tokens=True,
+                    ),
+                } for text in texts]
+
+        if self.use_continuous_batching(method):
+            futures = [self.submit(
+                text,
+                method=method,
+                top_k=top_k,
+                top_p=top_p,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+            ) for text in texts]
+
+            return [{
+                "input": text,
+                "output": self.tokenizer.decode(future.result(), skip_special_tokens=True),
+            } for text, future in zip(texts, futures)]
+
+        with span("hf.tokenize", model=self.name):
+            inputs = self.tokenize_batch(texts)
+            input_ids = inputs["input_ids"].to(self.device)
+            attention_mask = inputs["attention_mask"].to(self.device)
+
+        max_length = self.maxlen * 2
+        length_fn = None
+        penalty_kwargs = {"repetition_penalty": 2.0}
+        input_lengths = inputs["attention_mask"].sum(dim=-1).tolist()
+
+        if isinstance(self, DecoderLM) and min(input_lengths) < input_ids.shape[-1]:
+            # padded rows keep the repetition penalty and the length limit of their own input,
+            # as if they were generated alone.
+            penalty_kwargs = repetition_penalty_kwargs(2.0, attention_mask)
+            max_new_tokens = [max_length - length for length in input_lengths]
+            max_length = input_ids.shape[-1] + max(max_new_tokens)
+            length_fn = make_length_fn(
+                max_new_tokens=max_new_tokens,
+                eos_token_id=self.tokenizer.eos_token_id,
+                vocab_size=self.model.config.vocab_size,
+                prompt_length=input_ids.shape[-1],
+                device=self.device,
+            )
+
+        with span("hf.generate", model=self.name):
+            output_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                num_beams=num_beams,
+                do_sample=method in ["top_k", "nucleus"],
+                top_k=top_k if method == "top_k" else 0,
+                top_p=top_p if method == "nucleus" else None,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                pad_token_id=self.tokenizer.eos_token_id,
+                max_length=max_length,
+                length_penalty=length_penalty,
+                use_cache=True,
+                prefix_allowed_tokens_fn=length_fn,
+                **penalty_kwargs,
+            )
+
+        with span("hf.decode", model=self.name):
+            return [{
+                "input": text,
+                "output": self.decode_output(output_ids[i], input_ids.shape[-1]),
+            } for i, text in enumerate(texts)]
+
+    def tokenize_batch(self, texts: List[str]):
+        """
+        Tokenize texts into one left padded batch.
+        decoder only models continue from the last position of each row,
+        so the prompts must be aligned to the right.
+        """
+
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+
+        if isinstance(self, DecoderLM):
+            self.tokenizer.padding_side = "left"
+
+        return self.tokenizer(
+            texts,
+            return_tensors="pt",
+            padding=True,
+            truncation=True,
+        )
+
+    def decode_output(self, output_ids, prompt_length):
+        if isinstance(self, DecoderLM):
+            # decoder only model
+            output_ids = output_ids[prompt_length:]
+
+        return self.tokenizer.decode(
+            output_ids,
+            skip_special_tokens=True,
+        )
+
+    def enable_continuous_batching(self, max_batch_size=16):
+        """
+        Generate greedy, top-k and nucleus requests with a continuous batching engine.
+        requests of concurrent callers (e.g. batches of the webserver) share the running batch,
+        and short replies leave it as soon as they are finished.
+
+        Args:
+            max_batch_size (int): maximum number of running sequences
+        """
+
+        assert isinstance(self, DecoderLM), \
+            "continuous batching is only available for decoder only models"
+
+        self.disable_continuous_batching()
+        self.engine = ContinuousBatchingEngine(
+            model=self.model,
+            eos_token_id=self.tokenizer.eos_token_id,
+            device=self.device,
+            max_batch_size=max_batch_size,
+            name=self.name,
+        )
+        self.engine.start()
+
+    def disable_continuous_batching(self):
+        if self.engine is not None:
+            self.engine.stop()
+            self.engine = None
+
+    def use_continuous_batching(self, method):
+        return self.engine is not None and self.decodes_one_sequence(method)
+
+    def submit(
+        self,
+        text,
+        method="top_k",
+        top_k=20,
+        top_p=None,
+        no_repeat_ngram_size=4,
+        max_new_tokens=None,
+        stop_sequences=(),
+        stop_token_ids=(),
+    ):
+        """
+        Queue a text to the continuous batching engine.
+
+        Args:
+            text (str): input sentence
+            max_new_tokens (int): maximum number of generated tokens,
+                up to `maxlen * 2` tokens of input and output if it is not given
+            stop_sequences (List[Tuple[int]]): token ids which end generation
+            stop_token_ids (Set[int]): tokens which end generation
+
+        Returns:
+            (Future): generated token ids
+        """
+
+        input_ids = list(self.tokenizer(text, truncation=True)["input_ids"])
+
+        if max_new_tokens is None:
+            max_new_tokens = max(self.maxlen * 2 - len(input_ids), 1)
+
+        return self.engine.submit(
+            input_ids,
+            method=method.lower(),
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            max_new_tokens=max_new_tokens,
+            stop_sequences=stop_sequences,
+            stop_token_ids=stop_token_ids,
+        )
+
+    def set_draft(self, draft, num_draft_tokens=4):
+        """
+        Generate greedy outputs with speculative decoding.
+        the draft model proposes `num_draft_tokens` tokens and this model verifies them in one forward pass,
+        so outputs are the same as greedy decoding of this model.
+
+        Args:
+            draft (HuggingfaceAgent): smaller decoder only model with the same tokenizer (e.g. gptneo.small)
+            num_draft_tokens (int): number of tokens proposed at once
+        """
+
+        assert isinstance(self, DecoderLM) and isinstance(draft, DecoderLM), \
+            "speculative decoding is only available for decoder only models"
+        assert draft.tokenizer.get_vocab() == self.tokenizer.get_vocab(), \
+            "param `draft` must have the same tokenizer as the model"
+
+        self.draft = draft
+        self.num_draft_tokens = num_draft_tokens
+        self.speculative_stats = {"rounds": 0, "drafted": 0, "accepted": 0}
+
+    def clear_draft(self):
+        self.draft = None
+
+    def use_speculative_decoding(self, method):
+        return self.draft is not None and method.lower() == "greedy" and self.decodes_one_sequence(method)
+
+    def speculative_tokens(self, text, max_new_tokens=None, no_repeat_ngram_size=4):
+        """
+        Generate greedy tokens of the text with the draft model.
+
+        Args:
+            text (str): input sentence
+            max_new_tokens (int): maximum number of generated tokens,
+                up to `maxlen * 2` tokens of input and output if it is not given
+
+        Yields:
+            (int): generated token id
+        """
+
+        input_ids = list(self.tokenizer(text, truncation=True)["input_ids"])
+
+        if max_new_tokens is None:
+            max_new_tokens = max(self.maxlen * 2 - len(input_ids), 1)
+
+        return speculative_greedy(
+            model=self.model,
+            draft_model=self.draft.model,
+            input_ids=input_ids,
+            max_new_tokens=max_new_tokens,
+            eos_token_id=self.tokenizer.eos_token_id,
+            logits_processor=make_logits_processor(
+                method="greedy",
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                repetition_penalty=2.0,
+            ),
+            num_draft_tokens=self.num_draft_tokens,
+            stats=self.speculative_stats,
+            device=self.device,
+        )
+
+    def speculative_decoding_stats(self):
+        stats = dict(self.speculative_stats)
+        stats["acceptance_rate"] = stats["accepted"] / stats["drafted"] if stats["drafted"] else None
+        stats["tokens_per_round"] = \
+            (stats["accepted"] + stats["rounds"]) / stats["rounds"] if stats["rounds"] else None
+        return stats
+
+    def decodes_one_sequence(self, method):
+        """
+        Whether `generate` decodes a single sequence token by token with the method,
+        as the cached, streaming and continuous batching paths do.
+        only those methods use the other paths, so outputs don't depend on which path is taken.
+        """
+
+        # top-k and nucleus sample one sequence, as the continuous batching engine does.
+        return method.lower() != "beam"
+
+    def enable_session_cache(self, max_sessions=128):
+        """
+        Keep `past_key_values` per user id, so the next turn feeds only the new tokens.
+        only decoder only models with a method of `decodes_one_sequence` use the cache.
+
+        Args:
+            max_sessions (int): number of sessions to keep, least recently used are evicted
+        """
+
+        assert isinstance(self, DecoderLM), \
+            "session cache is only available for decoder only models"
+
+        self.session_cache = LRUCache(max_sessions)
+
+    def disable_session_cache(self):
+        self.session_cache = None
+
+    def clear_session_cache(self, user_id):
+        if self.session_cache is not None:
+            self.session_cache.pop(user_id)
+
+    def use_session_cache(self, user_id, method):
+        return self.session_cache is not None and \
+               user_id is not None and \
+               self.decodes_one_sequence(method)
+
+    def generate_with_session(
+        self,
+        text,
+        user_id,
+        max_length=None,
+        max_new_tokens=None,
+        method="top_k",
+        top_k=20,
+        top_p=None,
+        no_repeat_ngram_size=4,
+    ):
+        """
+        Generate with the key/values cached at the previous turn of `user_id`.
+
+        Args:
+            text (str): input sentence
+            user_id (str): session id
+            max_length (int): maximum length of input and generated tokens
+            max_new_tokens (int): maximum number of generated tokens
+
+        Returns:
+            (str): generated utterance
+        """
+
+        token_ids = list(self.stream_tokens(
             text=text,
+            user_id=user_id,
+            max_length=max_length,
+            max_new_tokens=max_new_tokens,
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+        ))
+
+        return self.tokenizer.decode(token_ids, skip_special_tokens=True)
+
+    @torch.no_grad()
+    def stream_tokens(
+        self,
+        text,
+        user_id=None,
+        max_length=None,
+        max_new_tokens=None,
+        method="top_k",
+        top_k=20,
+        top_p=None,
+        no_repeat_ngram_size=4,
+    ):
+        """
+        Generate token ids one by one with greedy, top-k or nucleus decoding.
+        if the session cache is enabled, the key/values cached at the previous turn of `user_id`
+        are reused: only the tokens after the longest common prefix with the cached ids are fed,
+        so when the history window slides the whole input is computed again.
+        the key/values are cached again when the generator finishes or is closed.
+
+        Args:
+            text (str): input sentence
+            user_id (str): session id
+            max_length (int): maximum length of input and generated tokens
+            max_new_tokens (int): maximum number of generated tokens
+
+        Yields:
+            (int): generated token id, the end of text token is not yielded
+        """
+
+        method = method.lower()
+        input_ids = self.tokenizer(
+            text,
             return_tensors="pt",
+            truncation=True,
         )["input_ids"].to(self.device)
 
-        output_ids = self.model.generate(
-            input_ids=input_ids,
-            num_beams=num_beams,
-            top_k=top_k if method == "top_k" else None,
-            top_p=top_p if method == "nucleus" else None,
+        use_session_cache = self.use_session_cache(user_id, method)
+        past, num_cached = None, 0
+        cached = self.session_cache.get(user_id) if use_session_cache else None
+
+        if cached is not None:
+            cached_ids, cached_past = cached
+            # at least one token must be fed to get logits of the next token.
+            num_cached = min(
+                common_prefix_length(cached_ids, input_ids[0].tolist()),
+                input_ids.size(-1) - 1,
+            )
+
+            if num_cached > 0:
+                past = slice_past(cached_past, num_cached)
+
+        outputs = self.model(
+            input_ids=input_ids[:, num_cached:],
+            past_key_values=past,
+            use_cache=True,
+        )
+
+        if max_new_tokens is not None:
+            max_length = input_ids.size(-1) + max_new_tokens
+        elif max_length is None:
+            max_length = self.maxlen * 2
+
+        num_cached = input_ids.size(-1)
+        generated_ids = input_ids
+        logits_processor = make_logits_processor(
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
             no_repeat_ngram_size=no_repeat_ngram_size,
-            pad_token_id=self.tokenizer.eos_token_id,
-            max_length=self.maxlen * 2,
-            length_penalty=length_penalty,
             repetition_penalty=2.0,
-            use_cache=True,
         )
 
-        if isinstance(self, DecoderLM):
-            # decoder only model
-            output_string = self.tokenizer.decode(
-                output_ids[:, input_ids.shape[-1]:][0],
-                skip_special_tokens=True,
-            )
-        else:
-            # sequence to sequence model
-            output_string = self.tokenizer.decode(
-                output_ids[0],
-                skip_special_tokens=True,
-            )
+        try:
+            while generated_ids.size(-1) < max_length:
+                scores = logits_processor(generated_ids, outputs.logits[:, -1, :])
+                next_ids = select_next_tokens(scores, method)
+                generated_ids = torch.cat([generated_ids, next_ids[:, None]], dim=-1)
+
+                if next_ids.item() == self.tokenizer.eos_token_id:
+                    break
+
+                yield next_ids.item()
+
+                outputs = self.model(
+                    input_ids=next_ids[:, None],
+                    past_key_values=outputs.past_key_values,
+                    use_cache=True,
+                )
+                num_cached += 1
+        finally:
+            if use_session_cache:
+                self.session_cache.put(
+                    user_id,
+                    (generated_ids[0, :num_cached].tolist(), outputs.past_key_values),
+                )
+
+    def predict_stream(
+        self,
+        text: str,
+        method: str = "top_k",
+        top_k: int = 20,
+        top_p: float = None,
+        no_repeat_ngram_size: int = 4,
+        user_id: str = None,
+        max_new_tokens: int = None,
+        stop_strings: List[str] = (),
+    ):
+        """
+        Generate utterance and yield decoded text as tokens are produced.
+        generation stops at the end of text token or at the first stop string.
+        beam search can't stream, so it yields the whole output of `predict` at once.
+
+        Args:
+            text (str): input sentence
+            top_k (int): k value for top-k sampling
+            top_p (float): probability for nuclear sampling
+            no_repeat_ngram_size (int): no repeat n-gram size
+            user_id (str): session id for reusing key/values of the previous turn
+            max_new_tokens (int): maximum number of generated tokens
+            stop_strings (List[str]): strings ending the utterance, they are not yielded
+
+        Yields:
+            (str): chunk of generated utterance
+        """
+
+        if not self.decodes_one_sequence(method) or not isinstance(self, DecoderLM):
+            yield self.predict(
+                text,
+                method=method,
+                top_k=top_k,
+                top_p=top_p,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                user_id=user_id,
+            )["output"]
+            return
+
+        tokens = self.stream_tokens(
+            text=text,
+            user_id=user_id,
+            max_new_tokens=max_new_tokens,
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+        )
+
+        yield from self.stream_text(tokens, stop_strings)
+
+    def stream_text(self, tokens, stop_strings=()):
+        """
+        Decode streamed token ids into text chunks.
+        text which can still change (an incomplete character or the beginning
+        of a stop string) is held back until the next token.
+        """
+
+        token_ids, emitted, text = [], 0, ""
+
+        try:
+            for token_id in tokens:
+                token_ids.append(token_id)
+                text = self.tokenizer.decode(
+                    token_ids,
+                    skip_special_tokens=True,
+                    clean_up_tokenization_spaces=False,
+                )
+
+                stops = [text.find(s, emitted) for s in stop_strings if s in text[emitted:]]
+
+                if len(stops) > 0:
+                    # closing the generator stops decoding right away.
+                    if min(stops) > emitted:
+                        yield text[emitted:min(stops)]
+                    return
+
+                end = len(text.rstrip("\ufffd"))
+
+                for stop in stop_strings:
+                    for k in range(len(stop) - 1, 0, -1):
+                        if text[:end].endswith(stop[:k]):
+                            end -= k
+                            break
+
+                if end > emitted:
+                    yield text[emitted:end]
+                    emitted = end
 
-        return {"input": text, "output": output_string}
+            if len(text) > emitted:
+                yield text[emitted:]
+        finally:
+            tokens.close()
@@ -2,9 +2,14 @@ from abc import abstractmethod
 from typing import Dict, List, Union
 
 import torch
+import parlai.utils.logging as logging
 from parlai.core.message import Message
+from parlai.core.dict import TokenizationMode
 
 from openchat.base import BaseAgent
+from openchat.utils.trace_utils import span
+
+logging.disable()
 
 
 class ParlaiAgent(BaseAgent):
@@ -32,6 +37,31 @@ class ParlaiAgent(BaseAgent):
         elif "cuda" in device:
             self.model.opt["gpu"] = 0
 
+        self._concatenates_token_ids = None
+
+    def concatenates_token_ids(self):
+        """
+        Whether the ids of texts tokenized one by one equal the ids of the joined text.
+        byte-level BPE dictionaries (e.g. blender 400M+) add a prefix space to every text,
+        so the token ids cached by the environment must not be used as `text_vec`.
+        """
+
+        if self._concatenates_token_ids is None:
+            texts = [
+                "hello there" + self.suffix + "how are you?" + self.suffix,
+                "i'm fine, thanks." + self.suffix,
+                "what do you do for fun?",
+            ]
+
+            tokens = []
+            for text in texts:
+                tokens += self.model.dict.txt2vec(text)
+
+            self._concatenates_token_ids = \
+                tokens == self.model.dict.txt2vec("".join(texts))
+
+        return self._concatenates_token_ids
+
     def tokenizer(self, message: Union[str, List[str]], padding=False):
         if isinstance(message, str):
             return {"input_ids": self.model.dict.txt2vec(message)}
@@ -59,18 +89,91 @@ class ParlaiClassificationAgent(ParlaiAgent):
     def labels(self):
         raise NotImplemented
 
+    def class_labels(self):
+        """
+        Labels of the classifier outputs in order of the output indices.
+        """
+
+        return self.labels()
+
     def predict(self, text: str, **kwargs):
-        message = self.tokenizer(text)
-        batch = self.model.batchify([message])
+        return self.predict_batch([text], **kwargs)[0]
 
-        output = self.model.score(batch)[0].tolist()
-        argmax = max(range(len(output)), key=lambda i: output[i])
+    def predict_batch(self, texts: List[str], **kwargs) -> List[Dict[str, str]]:
+        scores = self.score_batch(texts)
 
-        return {
+        return [{
             "input": text,
-            "output": self.labels()[argmax],
+            "output": label,
+            "probability": probability,
+        } for text, label, probability in zip(
+            texts,
+            scores["labels"],
+            scores["probabilities"],
+        )]
+
+    @torch.no_grad()
+    def score_batch(self, texts: List[str]):
+        """
+        Classify texts with one forward pass.
+
+        Args:
+            texts (List[str]): texts to classify
+
+        Returns:
+            (Dict[str, List]): "labels" and "probabilities" of the most probable class
+                of each text and "scores", probabilities of every class (N x num_classes).
+        """
+
+        if len(texts) == 0:
+            return {"labels": [], "probabilities": [], "scores": []}
+
+        with span("parlai.batchify", model=self.name):
+            messages = [self.make_message(text) for text in texts]
+
+            if "cuda" in self.device:
+                batch = self.model.batchify(messages).to(self.model.opt["gpu"])
+            else:
+                batch = self.model.batchify(messages)
+
+        with span("parlai.classify", model=self.name):
+            self.model.model.eval()
+            scores = torch.softmax(self.model.score(batch).float(), dim=-1)
+            probabilities, indices = scores.max(dim=-1)
+        class_labels = self.class_labels()
+
+        return {
+            "labels": [class_labels[i] for i in indices.tolist()],
+            "probabilities": probabilities.tolist(),
+            "scores": scores.tolist(),
         }
 
+    def make_message(self, text):
+        """
+        Vectorize the text as `observe()` of the parlai agent does,
+        so classifiers get their start/end tokens and truncation.
+        the history is a new one, so the agent's own history isn't changed.
+        """
+
+        message = Message({"text": text, "episode_done": True})
+        history = self.model.build_history()
+        set_tokenization_mode = getattr(self.model.dict, "set_tokenization_mode", None)
+
+        if set_tokenization_mode is not None:
+            set_tokenization_mode(TokenizationMode.TEST_TIME_TEXT)
+
+        history.update_history(message)
+
+        if set_tokenization_mode is not None:
+            set_tokenization_mode(TokenizationMode.TEST_TIME_LABEL)
+
+        return self.model.vectorize(
+            message,
+            history,
+            text_truncate=self.model.text_truncate,
+            label_truncate=self.model.label_truncate,
+        )
+
 
 class ParlaiGenerationAgent(ParlaiAgent):
 
@@ -84,7 +187,31 @@ class ParlaiGenerationAgent(ParlaiAgent):
         top_p=None,
         no_repeat_ngram_size=4,
         length_penalty: int = 0.65,
+        text_vec=None,
     ) -> Dict[str, str]:
+        return self.predict_batch(
+            texts=[text],
+            text_vecs=[text_vec] if text_vec is not None else None,
+            method=method,
+            num_beams=num_beams,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            length_penalty=length_penalty,
+        )[0]
+
+    @torch.no_grad()
+    def predict_batch(
+        self,
+        texts,
+        method="top_k",
+        num_beams=5,
+        top_k=20,
+        top_p=None,
+        no_repeat_ngram_size=4,
+        length_penalty: int = 0.65,
+        text_vecs=None,
+    ) -> List[Dict[str, str]]:
         assert method in ["greedy", "beam", "top_k", "nucleus"], \
             "param `method` must be one of ['greedy', 'beam'', 'top_k', 'nucleus']"
 
@@ -96,27 +223,43 @@ class ParlaiGenerationAgent(ParlaiAgent):
         self.model.opt["beam-context-block-ngram"] = no_repeat_ngram_size
         self.model.opt["beam_length_penalty"] = length_penalty
 
+        if text_vecs is None:
+            text_vecs = [None] * len(texts)
+
+        with span("parlai.batchify", model=self.name):
+            messages = [
+                self.make_message(text, vector)
+                for text, vector in zip(texts, text_vecs)
+            ]
+
+            if "cuda" in self.device:
+                batch = self.model.batchify(messages).to(self.model.opt["gpu"])
+            else:
+                batch = self.model.batchify(messages)
+
+        with span("parlai.generate", model=self.name):
+            # every message has `text_vec`, so batchify keeps the input order.
+            beam_preds_scores = self.model._generate(
+                batch=batch,
+                beam_size=num_beams,
+                max_ts=self.maxlen,
+            )[0]
+
+        with span("parlai.decode", model=self.name):
+            return [{
+                "input": text,
+                "output": self.model._v2t(preds[0].tolist()),
+            } for text, preds in zip(texts, beam_preds_scores)]
+
+    def make_message(self, text, vector=None):
         message = Message({
             "text": text,
             "full_text": text,
         })
 
-        vector = self.tokenizer(text)["input_ids"]
+        if vector is None:
+            vector = self.tokenizer(text)["input_ids"]
+
         message["text_vec"] = vector
         message["full_text_vec"] = vector
-
-        if "cuda" in self.device:
-            batch = self.model.batchify([message]).to(self.model.opt["gpu"])
-        else:
-            batch = self.model.batchify([message])
-
-        tokens = self.model._generate(
-            batch=batch,
-            beam_size=num_beams,
-            max_ts=self.maxlen,
-        )[0][0][0]
-
-        return {
-            "input": text,
-            "output": self.model._v2t(tokens.tolist()),
-        }
+        return message
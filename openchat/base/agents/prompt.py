@@ -1,6 +1,14 @@
 import torch
 
 from openchat.base import HuggingfaceAgent
+from openchat.utils.generation_utils import (
+    count_generated_tokens,
+    make_stop_fn,
+    newline_token_ids,
+    repetition_penalty_kwargs,
+    stop_token_ids,
+)
+from openchat.utils.trace_utils import span
 
 
 class PromptAgent(HuggingfaceAgent):
@@ -27,31 +35,230 @@ class PromptAgent(HuggingfaceAgent):
         length_penalty=0.7,
         diverse_penalty=1.5,
         no_repeat_ngram_size=4,
+        user_id=None,
     ):
 
-        input_ids = self.tokenizer(
-            text,
-            return_tensors="pt",
-            truncation=True,
-        )["input_ids"]
+        if self.use_session_cache(user_id, method) and not self.use_speculative_decoding(method):
+            # streaming stops at the first turn escape, instead of generating tokens to cut.
+            with span("hf.generate_with_session", model=self.name):
+                generated_text = "".join(self.predict_stream(
+                    text=text,
+                    person_1=person_1,
+                    person_2=person_2,
+                    method=method,
+                    top_k=top_k,
+                    top_p=top_p,
+                    no_repeat_ngram_size=no_repeat_ngram_size,
+                    user_id=user_id,
+                ))
 
-        output_ids = self.model.generate(
-            input_ids=input_ids.to(self.device),
+            return {
+                "input": text,
+                "output": generated_text.strip(),
+            }
+
+        return self.predict_batch(
+            texts=[text],
+            person_1=person_1,
+            person_2=person_2,
+            method=method,
+            top_k=top_k,
+            top_p=top_p,
             num_beams=num_beams,
             num_beam_groups=num_beam_groups,
             length_penalty=length_penalty,
-            repetition_penalty=2.0,
-            top_k=top_k if method == "top_k" else None,
-            top_p=top_p if method == "nucleus" else None,
-            no_repeat_ngram_size=no_repeat_ngram_size,
             diverse_penalty=diverse_penalty,
-            use_cache=True,
-            early_stopping=True,
-            pad_token_id=self.tokenizer.eos_token_id,
-            max_length=input_ids.size()[-1] + self.maxlen // 2,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+        )[0]
+
+    @torch.no_grad()
+    def predict_batch(
+        self,
+        texts,
+        person_1: str,
+        person_2: str,
+        method: str = "top_k",
+        top_k: int = 20,
+        top_p: float = None,
+        num_beams: int = 6,
+        num_beam_groups=2,
+        length_penalty=0.7,
+        diverse_penalty=1.5,
+        no_repeat_ngram_size=4,
+    ):
+
+        method = method.lower()
+        stop_sequences = stop_token_ids(self.tokenizer, self.turn_escapes(person_1, person_2))
+
+        if self.decodes_one_sequence(method):
+            num_beams, num_beam_groups = 1, 1
+
+        if self.use_speculative_decoding(method):
+            newline_ids = newline_token_ids(self.tokenizer)
+            outputs = []
+
+            for text in texts:
+                generated = []
+
+                with span("hf.speculative", model=self.name):
+                    for token in self.speculative_tokens(
+                        text,
+                        max_new_tokens=self.maxlen // 2,
+                        no_repeat_ngram_size=no_repeat_ngram_size,
+                    ):
+                        generated.append(token)
+
+                        if token in newline_ids or \
+                                any(tuple(generated[-len(ids):]) == ids for ids in stop_sequences):
+                            break
+
+                outputs.append(self.make_output(
+                    text,
+                    self.tokenizer.decode(generated, skip_special_tokens=True).strip(),
+                    len(generated),
+                    person_1,
+                    person_2,
+                ))
+
+            return outputs
+
+        if self.use_continuous_batching(method):
+            futures = [self.submit(
+                text,
+                method=method,
+                top_k=top_k,
+                top_p=top_p,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                max_new_tokens=self.maxlen // 2,
+                stop_sequences=stop_sequences,
+                stop_token_ids=newline_token_ids(self.tokenizer),
+            ) for text in texts]
+
+            return [self.make_output(
+                text,
+                self.tokenizer.decode(future.result(), skip_special_tokens=True).strip(),
+                len(future.result()),
+                person_1,
+                person_2,
+            ) for text, future in zip(texts, futures)]
+
+        with span("hf.tokenize", model=self.name):
+            inputs = self.tokenize_batch(texts)
+            input_ids = inputs["input_ids"]
+
+        # all inputs are left padded to the same length, so generated tokens start there.
+        prompt_length = input_ids.size()[-1]
+        eos_token_id = self.tokenizer.eos_token_id
+
+        stop_fn = make_stop_fn(
+            stop_ids=stop_sequences,
+            newline_ids=newline_token_ids(self.tokenizer),
+            eos_token_id=eos_token_id,
+            vocab_size=self.model.config.vocab_size,
+            prompt_length=prompt_length,
+            device=self.device,
         )
 
-        turn_escapes = [
+        with span("hf.generate", model=self.name):
+            output_ids = self.model.generate(
+                input_ids=input_ids.to(self.device),
+                attention_mask=inputs["attention_mask"].to(self.device),
+                num_beams=num_beams,
+                num_beam_groups=num_beam_groups,
+                length_penalty=length_penalty,
+                do_sample=method in ["top_k", "nucleus"],
+                top_k=top_k if method == "top_k" else 0,
+                top_p=top_p if method == "nucleus" else None,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                diversity_penalty=diverse_penalty if num_beam_groups > 1 else 0.0,
+                use_cache=True,
+                early_stopping=True,
+                pad_token_id=eos_token_id,
+                max_length=prompt_length + self.maxlen // 2,
+                prefix_allowed_tokens_fn=stop_fn,
+                **repetition_penalty_kwargs(2.0, inputs["attention_mask"].to(self.device)),
+            )
+
+        generated_tokens = count_generated_tokens(output_ids, prompt_length, eos_token_id)
+        outputs = []
+
+        with span("hf.decode", model=self.name):
+            for i, text in enumerate(texts):
+                generated_text = self.decode_output(
+                    output_ids[i],
+                    prompt_length,
+                ).strip()
+
+                outputs.append(self.make_output(
+                    text,
+                    generated_text,
+                    generated_tokens[i],
+                    person_1,
+                    person_2,
+                ))
+
+        return outputs
+
+    def make_output(self, text, generated_text, generated_tokens, person_1, person_2):
+        output = self.cut_turn(generated_text, person_1, person_2)
+
+        return {
+            "input": text,
+            "output": output,
+            "generated_tokens": generated_tokens,
+            "kept_tokens": len(self.tokenizer(output)["input_ids"]) if output else 0,
+        }
+
+    def predict_stream(
+        self,
+        text,
+        person_1: str,
+        person_2: str,
+        method: str = "top_k",
+        top_k: int = 20,
+        top_p: float = None,
+        no_repeat_ngram_size=4,
+        user_id=None,
+    ):
+        """
+        Yield the utterance of `person_2` as tokens are produced.
+        generation stops at a newline or when the next speaker starts talking.
+        """
+
+        if not self.decodes_one_sequence(method):
+            yield self.predict(
+                text,
+                person_1=person_1,
+                person_2=person_2,
+                method=method,
+                top_k=top_k,
+                top_p=top_p,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+            )["output"]
+            return
+
+        started = False
+
+        for chunk in super().predict_stream(
+                text=text,
+                method=method,
+                top_k=top_k,
+                top_p=top_p,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                user_id=user_id,
+                max_new_tokens=self.maxlen // 2,
+                stop_strings=self.turn_escapes(person_1, person_2) + ["\n"],
+        ):
+            if not started:
+                chunk = chunk.lstrip()
+                started = len(chunk) > 0
+
+            if len(chunk) > 0:
+                yield chunk
+
+    @staticmethod
+    def turn_escapes(person_1, person_2):
+        return [
             f"{person_1}:",
             f"{person_2}:",
             f"{person_1.lower()}:",
@@ -60,15 +267,8 @@ class PromptAgent(HuggingfaceAgent):
             f"{person_2.upper()}:",
         ]
 
-        generated_text = self.tokenizer.decode(
-            output_ids[:, input_ids.shape[-1]:][0],
-            skip_special_tokens=True,
-        ).strip()
-
-        for escape in turn_escapes:
+    def cut_turn(self, generated_text, person_1, person_2):
+        for escape in self.turn_escapes(person_1, person_2):
             generated_text = generated_text.replace(escape, "\n")
 
-        return {
-            "input": text,
-            "output": generated_text.split("\n")[0].strip(),
-        }
+        return generated_text.split("\n")[0].strip()
@@ -0,0 +1,162 @@
+import inspect
+import time
+from typing import Dict, List
+
+from openchat.utils.trace_utils import span
+
+FALLBACK_RESPONSE = "Hey do you want to talk about something else?"
+
+
+class SafetyFilter(object):
+    """
+    Mixin screening outputs of a generation agent with a safety agent.
+    `num_candidates` outputs are generated for each input by one batched generate,
+    all of them are screened by one batched safety pass and the safest one is returned.
+    greedy and beam search would give the same candidate `num_candidates` times,
+    so they generate only one candidate, which is returned if it is safe.
+    """
+
+    safety_agent = None
+    num_candidates = 4
+    fallback = FALLBACK_RESPONSE
+    safety_stats = None
+
+    def predict(self, text: str, **kwargs) -> Dict[str, str]:
+        kwargs.pop("user_id", None)
+        text_vec = kwargs.pop("text_vec", None)
+
+        if text_vec is not None:
+            kwargs["text_vecs"] = [text_vec]
+
+        return self.predict_batch([text], **kwargs)[0]
+
+    def predict_stream(self, text: str, **kwargs):
+        # candidates are screened as a whole, so nothing can be shown before that.
+        kwargs.pop("max_new_tokens", None)
+        kwargs.pop("stop_strings", None)
+        yield self.predict(text, **kwargs)["output"]
+
+    def candidates_per_input(self, method=None):
+        if method is None:
+            parameter = inspect.signature(super().predict_batch).parameters.get("method")
+            method = parameter.default if parameter is not None else None
+
+        if method is not None and method.lower() in ["top_k", "nucleus"]:
+            return self.num_candidates
+
+        return 1
+
+    def predict_batch(self, texts: List[str], **kwargs) -> List[Dict[str, str]]:
+        n = self.candidates_per_input(kwargs.get("method"))
+        timings = {}
+
+        if kwargs.get("text_vecs") is not None:
+            kwargs["text_vecs"] = [v for v in kwargs["text_vecs"] for _ in range(n)]
+
+        start = time.perf_counter()
+        with span("safety.generate", model=self.name):
+            candidates = super().predict_batch([t for t in texts for _ in range(n)], **kwargs)
+            candidates = [c["output"] for c in candidates]
+        timings["generate"] = time.perf_counter() - start
+
+        with span("safety.screen", model=self.name):
+            scores = self.screen(list(set(candidates)), timings)
+        outputs = []
+
+        for i, text in enumerate(texts):
+            group = candidates[i * n:(i + 1) * n]
+            safe = [c for c in group if scores[c] is not None]
+
+            if len(safe) > 0:
+                output = max(safe, key=lambda c: scores[c])
+            else:
+                output = self.fallback
+                self.safety_stats["fallbacks"] += 1
+
+            self.safety_stats["rejected"] += len(group) - len(safe)
+            outputs.append({
+                "input": text,
+                "output": output,
+                "timings": timings,
+            })
+
+        for stage, seconds in timings.items():
+            self.safety_stats[stage] += seconds
+
+        self.safety_stats["calls"] += 1
+        return outputs
+
+    def screen(self, candidates, timings):
+        """
+        Score candidates with the string matcher first and the classifier on the survivors.
+
+        Returns:
+            (Dict[str, float]): probability of the safe label, None for unsafe candidates
+        """
+
+        scores = {candidate: None for candidate in candidates}
+        string_matcher = getattr(self.safety_agent, "string_matcher", None)
+
+        start = time.perf_counter()
+        if string_matcher is not None:
+            candidates = [c for c in candidates if c not in string_matcher]
+        timings["string_match"] = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = self.safety_agent.score_batch(candidates)
+        safe_label = self.safety_agent.labels()[0]
+
+        for candidate, label, probability in zip(
+                candidates,
+                results["labels"],
+                results["probabilities"],
+        ):
+            if label == safe_label:
+                scores[candidate] = probability
+
+        timings["classify"] = time.perf_counter() - start
+        return scores
+
+
+def add_safety_filter(
+    agent,
+    safety_agent,
+    num_candidates=4,
+    fallback=FALLBACK_RESPONSE,
+):
+    """
+    Screen outputs of the agent with the safety agent.
+
+    Args:
+        agent (BaseAgent): generation agent
+        safety_agent (ParlaiClassificationAgent): safety agent, the first of its labels is the safe one
+        num_candidates (int): number of candidates generated for each input
+        fallback (str): output when every candidate is unsafe
+
+    Returns:
+        (BaseAgent): the agent with the safety filter, sharing the attributes (e.g. model) of the agent
+    """
+
+    if not isinstance(agent, SafetyFilter):
+        # `__class__` assignment fails for subclasses of ABC, so a new instance shares the attributes.
+        filtered = object.__new__(type(
+            agent.__class__.__name__,
+            (SafetyFilter, agent.__class__),
+            dict(),
+        ))
+        filtered.__dict__.update(agent.__dict__)
+        agent = filtered
+
+    agent.safety_agent = safety_agent
+    agent.num_candidates = num_candidates
+    agent.fallback = fallback
+    agent.safety_stats = {
+        "calls": 0,
+        "rejected": 0,
+        "fallbacks": 0,
+        "generate": 0.0,
+        "string_match": 0.0,
+        "classify": 0.0,
+    }
+
+    return agent
@@ -1,28 +1,52 @@
 import json
 import os
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from random import choice
-from typing import Dict
+from typing import Dict, List
 from parlai.core.agents import create_agent, add_datapath_and_model_args
 from parlai.core.message import Message
 from parlai.core.params import ParlaiParser
 from parlai.tasks.wizard_of_wikipedia.build import build
 from projects.wizard_of_wikipedia.knowledge_retriever.knowledge_retriever import KnowledgeRetrieverAgent
 from openchat.base import ParlaiGenerationAgent
+from openchat.utils.cache_utils import LRUCache
+from openchat.utils.string_utils import TopicIndex
+from openchat.utils.trace_utils import span
 
 
-def load_topics():
-    opt = {}
-    add_datapath_and_model_args(opt)
-    build(opt)
-
-    topics_path = os.path.join(
-        opt['datapath'],
-        'wizard_of_wikipedia',
-        'topic_splits.json',
-    )
+_topic_index = None
+_topic_index_lock = threading.Lock()
+
+
+def load_topic_index():
+    """
+    Load the topic index shared by every agent.
+    the index is built in memory only once per process.
+    """
+
+    global _topic_index
+
+    with _topic_index_lock:
+        if _topic_index is not None:
+            return _topic_index
 
-    return sorted(json.load(open(topics_path, 'rb'))["train"])
+        opt = {}
+        add_datapath_and_model_args(opt)
+        topics_path = os.path.join(opt['datapath'], 'wizard_of_wikipedia', 'topic_splits.json')
+
+        if not os.path.exists(topics_path):
+            build(opt)
+
+        with open(topics_path, 'rb') as f:
+            _topic_index = TopicIndex(json.load(f)["train"])
+
+        return _topic_index
+
+
+def load_topics():
+    return list(load_topic_index().topics)
 
 
 def create_retriever():
@@ -36,6 +60,83 @@ def create_retriever():
     return create_agent(knowledge_opt)
 
 
+def normalize_text(text):
+    return " ".join(text.lower().split())
+
+
+class KnowledgeCache(object):
+
+    def __init__(self, maxsize=4096, path=None):
+        """
+        Cache of retrieved knowledge keyed by (topic, normalized text).
+
+        Args:
+            maxsize (int): maximum number of entries in memory
+            path (str): path of sqlite database to keep entries on disk, memory only if None
+        """
+
+        self.memory = LRUCache(maxsize=maxsize)
+        self.path = path
+        self.connection = None
+        self.lock = threading.Lock()
+        self.disk_hits = 0
+
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False)
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS knowledge "
+                "(topic TEXT, text TEXT, knowledge TEXT, PRIMARY KEY (topic, text))"
+            )
+            self.connection.commit()
+
+    def get(self, topic, text):
+        key = (topic, normalize_text(text))
+
+        with self.lock:
+            knowledge = self.memory.get(key)
+
+            if knowledge is None and self.connection is not None:
+                row = self.connection.execute(
+                    "SELECT knowledge FROM knowledge WHERE topic = ? AND text = ?",
+                    key,
+                ).fetchone()
+
+                if row is not None:
+                    knowledge = row[0]
+                    self.disk_hits += 1
+                    self.memory.put(key, knowledge)
+
+        return knowledge
+
+    def put(self, topic, text, knowledge):
+        key = (topic, normalize_text(text))
+
+        with self.lock:
+            self.memory.put(key, knowledge)
+
+            if self.connection is not None:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO knowledge VALUES (?, ?, ?)",
+                    key + (knowledge,),
+                )
+                self.connection.commit()
+
+    def stats(self):
+        with self.lock:
+            stats = self.memory.stats()
+
+        stats["disk_hits"] = self.disk_hits
+        # memory misses found on disk are hits of the whole cache
+        stats["misses"] -= self.disk_hits
+        stats["hits"] += self.disk_hits
+        return stats
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
 class WizardOfWikipediaAgent(ParlaiGenerationAgent):
 
     def __init__(
@@ -59,38 +160,169 @@ class WizardOfWikipediaAgent(ParlaiGenerationAgent):
     def build_wizard_of_wikipedia(self):
         self.TOKEN_KNOWLEDGE = '__knowledge__'
         self.TOKEN_END_KNOWLEDGE = '__endknowledge__'
-        self.topic_list = load_topics()
+        self.topic_index = load_topic_index()
+        # immutable and shared by every agent
+        self.topic_list = self.topic_index.topics
         self.knowledge_retriever = create_retriever()
         self.chosen_topic = None
+        self.knowledge_cache = KnowledgeCache()
+        self.passage_cache = LRUCache(maxsize=256)
+        self.cache_topic_passages()
+        # the retriever is not thread safe, so retrievals run one by one in this thread.
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=1)
+
+    def cache_topic_passages(self):
+        """
+        Keep passages of chosen topics, so switching back to a topic doesn't retrieve them again.
+        """
+
+        retriever = self.knowledge_retriever
+
+        if not hasattr(retriever, "get_chosen_topic_passages"):
+            return
+
+        get_chosen_topic_passages = retriever.get_chosen_topic_passages
+
+        def get_cached_topic_passages(chosen_topic):
+            passages = self.passage_cache.get(chosen_topic)
+
+            if passages is None:
+                passages = get_chosen_topic_passages(chosen_topic)
+                self.passage_cache.put(chosen_topic, passages)
+
+            return passages
+
+        retriever.get_chosen_topic_passages = get_cached_topic_passages
+
+    def set_knowledge_cache(self, maxsize=4096, path=None):
+        """
+        Replace the knowledge cache.
+
+        Args:
+            maxsize (int): maximum number of entries in memory
+            path (str): path of sqlite database to keep entries on disk
+        """
+
+        self.knowledge_cache.close()
+        self.knowledge_cache = KnowledgeCache(maxsize=maxsize, path=path)
+
+    def after_fork(self):
+        """
+        Threads and sqlite connections don't survive `fork`,
+        so forked worker processes recreate the retrieval thread and the knowledge cache.
+        """
+
+        self.retrieval_executor = ThreadPoolExecutor(max_workers=1)
+        self.knowledge_cache = KnowledgeCache(
+            maxsize=self.knowledge_cache.memory.maxsize,
+            path=self.knowledge_cache.path,
+        )
+
+    def knowledge_cache_stats(self):
+        return {
+            "knowledge": self.knowledge_cache.stats(),
+            "passages": self.passage_cache.stats(),
+        }
 
     def available_topics(self):
-        return self.topic_list
+        return list(self.topic_index.topics)
+
+    def suggest_topics(self, text, n=4):
+        return self.topic_index.suggest(text, n)
 
     def set_topic(self, topic):
         if topic.lower() == "random":
-            self.chosen_topic = choice(self.topic_list)
+            self.chosen_topic = self.topic_index.choice()
 
         else:
-            assert topic in self.topic_list, \
-                f"Wrong topic: {topic}, You can check available topic using `available_topics()`"
+            assert topic in self.topic_index, \
+                f"Wrong topic: {topic}, You can check available topic using `available_topics()`. " \
+                f"Similar topics: {self.suggest_topics(topic)}"
             self.chosen_topic = topic
 
     def clear_topic(self):
         self.chosen_topic = None
 
-    def retrieve_knowledge(self, text):
+    def retrieve_knowledge(self, text, topic=None):
+        """
+        Retrieve knowledge about the text and prepend it to the text.
+
+        Args:
+            text (str): user message
+            topic (str): topic of the dialogue, the chosen topic if None
+        """
+
+        return self.retrieve_knowledge_batch([text], [topic])[0]
+
+    def retrieve_knowledge_batch(self, texts, topics=None):
+        """
+        Retrieve knowledge for messages of several sessions.
+        the retriever runs once for each (topic, text) which isn't cached.
+        """
+
+        if topics is None:
+            topics = [None] * len(texts)
+
+        topics = [topic or self.chosen_topic for topic in topics]
+        retrieved = {}
+
+        for text, topic in zip(texts, topics):
+            key = (topic, normalize_text(text))
+
+            if key in retrieved:
+                continue
+
+            knowledge = self.knowledge_cache.get(topic, text)
+
+            if knowledge is None:
+                with span("wow.retrieve_knowledge", model=self.name):
+                    knowledge = self.run_retriever(text, topic)
+
+                self.knowledge_cache.put(topic, text, knowledge)
+
+            retrieved[key] = knowledge
+
+        return [
+            self.TOKEN_KNOWLEDGE + retrieved[(topic, normalize_text(text))] +
+            self.TOKEN_END_KNOWLEDGE + self.suffix + text
+            for text, topic in zip(texts, topics)
+        ]
+
+    def retrieve_knowledge_async(self, text, topic=None):
+        """
+        Start retrieval in the background, so the caller can prepare the model input meanwhile.
+
+        Returns:
+            (concurrent.futures.Future): future of `retrieve_knowledge(text, topic)`
+        """
+
+        return self.retrieval_executor.submit(
+            self.retrieve_knowledge,
+            text,
+            topic or self.chosen_topic,
+        )
+
+    def retrieve_knowledge_batch_async(self, texts, topics=None):
+        if topics is None:
+            topics = [None] * len(texts)
+
+        return self.retrieval_executor.submit(
+            self.retrieve_knowledge_batch,
+            texts,
+            [topic or self.chosen_topic for topic in topics],
+        )
+
+    def run_retriever(self, text, topic):
         message = Message({
             "id": "local_human",
-            "text": self.chosen_topic + self.suffix + text,
-            "chosen_topic": self.chosen_topic,
+            "text": topic + self.suffix + text,
+            "chosen_topic": topic,
             "episode_done": False,
             "label_candidates": None,
         })
 
         self.knowledge_retriever.observe(message)
-        knowledge = self.knowledge_retriever.act()["checked_sentence"]
-        knowledge = self.TOKEN_KNOWLEDGE + knowledge + self.TOKEN_END_KNOWLEDGE
-        return knowledge + self.suffix + text
+        return self.knowledge_retriever.act()["checked_sentence"]
 
     def predict(
         self,
@@ -101,19 +333,43 @@ class WizardOfWikipediaAgent(ParlaiGenerationAgent):
         top_p=None,
         no_repeat_ngram_size=4,
         length_penalty=0.65,
+        text_vec=None,
     ) -> Dict[str, str]:
+        return self.predict_batch(
+            texts=[text],
+            text_vecs=[text_vec] if text_vec is not None else None,
+            method=method,
+            num_beams=num_beams,
+            top_k=top_k,
+            top_p=top_p,
+            no_repeat_ngram_size=no_repeat_ngram_size,
+            length_penalty=length_penalty,
+        )[0]
+
+    def predict_batch(
+        self,
+        texts,
+        method="beam",
+        num_beams=5,
+        top_k=None,
+        top_p=None,
+        no_repeat_ngram_size=4,
+        length_penalty=0.65,
+        text_vecs=None,
+    ) -> List[Dict[str, str]]:
         if not self.chosen_topic:
             raise Exception(
                 "topic isn't selected. "
                 "please call `set_topic(topic: str)` to select topic for wizard of wikipedia task"
             )
 
-        return super().predict(
-            text=text,
+        return super().predict_batch(
+            texts=texts,
             method=method,
             num_beams=num_beams,
             top_k=top_k,
             top_p=top_p,
             no_repeat_ngram_size=no_repeat_ngram_size,
             length_penalty=length_penalty,
+            text_vecs=text_vecs,
         )
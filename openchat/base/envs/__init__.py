@@ -1 +1,13 @@
-from openchat.base.envs.base import BaseEnvironment
\ No newline at end of file
+from openchat.base.envs.base import BaseEnvironment
+from openchat.base.envs.session import (
+    BaseSessionStore,
+    MemorySessionStore,
+    SQLiteSessionStore,
+)
+
+__all__ = [
+    BaseEnvironment,
+    BaseSessionStore,
+    MemorySessionStore,
+    SQLiteSessionStore,
+]
@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 from openchat.base import BaseAgent, DecoderLM
+from openchat.base.envs.session import BaseSessionStore, MemorySessionStore
+from openchat.utils.trace_utils import span
 
 
 @dataclass
@@ -19,8 +21,21 @@ class Command:
 
 class BaseEnvironment(ABC):
 
-    def __init__(self):
-        self.histories = {}
+    def __init__(self, session_store: BaseSessionStore = None):
+        if session_store is None:
+            session_store = MemorySessionStore()
+
+        self.histories = session_store
+
+    def history(self, user_id):
+        history = self.histories.get(user_id)
+
+        if history is None:
+            # new user, or the session was evicted from the session store.
+            self.clear_histories(user_id)
+            history = self.histories[user_id]
+
+        return history
 
     def clear_histories(self, user_id):
         self.histories[user_id] = {
@@ -28,53 +43,121 @@ class BaseEnvironment(ABC):
             "bot_message": [],
             "model_input": "",
             "prefix": [],
-            "chosen_topic": ""
+            "chosen_topic": "",
+            "turn_tokens": [],
+            "prefix_text": "",
+            "prefix_tokens": [],
+            "model_input_ids": [],
         }
 
     def add_user_message(self, user_id, text):
-        self.histories[user_id]["user_message"].append(text)
+        self.history(user_id)["user_message"].append(text)
+        self.histories.save(user_id)
 
-    def add_bot_message(self, user_id, text):
-        self.histories[user_id]["bot_message"].append(text)
+    def add_bot_message(self, user_id, text, agent=None):
+        self.history(user_id)["bot_message"].append(text)
 
-    def make_model_input(self, user_id, user_input, agent):
-        prefix = self.histories[user_id]["prefix"]
+        if agent is not None:
+            self.cache_turn_tokens(user_id, agent)
+
+        self.histories.save(user_id)
+
+    def cache_turn_tokens(self, user_id, agent):
+        """
+        Tokenize the (user, bot) turns which are not tokenized yet.
+        each turn is tokenized only once, and `make_model_input`
+        truncates histories by summing the cached lengths.
+        """
+
+        history = self.history(user_id)
+        turn_tokens = history["turn_tokens"]
+        num_turns = min(
+            len(history["user_message"]),
+            len(history["bot_message"]),
+        )
+
+        for u, m in zip(
+                history["user_message"][len(turn_tokens):num_turns],
+                history["bot_message"][len(turn_tokens):num_turns],
+        ):
+            turn = u + agent.suffix + m + agent.suffix
+            turn_tokens.append(list(agent.tokenizer(turn)["input_ids"]))
+
+        return turn_tokens
+
+    def prepare_model_input(self, user_id, agent):
+        """
+        Tokenize the prefix and the turns of the history which are not tokenized yet.
+        this doesn't need the current user input, so it can run while the input is prepared
+        (e.g. while knowledge is retrieved).
+        """
+
+        history = self.history(user_id)
+        prefix = history["prefix"]
 
         if len(prefix) > 0:
             prefix = agent.suffix.join(prefix) + agent.suffix
         else:
             prefix = ""
 
+        if history["prefix_text"] != prefix:
+            # prefix (persona, prompt) was changed after the last turn.
+            history["prefix_text"] = prefix
+            history["prefix_tokens"] = list(
+                agent.tokenizer(prefix)["input_ids"]) if prefix else []
+
+        return self.cache_turn_tokens(user_id, agent)
+
+    def make_model_input(self, user_id, user_input, agent):
+        with span("env.make_model_input", model=agent.name):
+            return self._make_model_input(user_id, user_input, agent)
+
+    def _make_model_input(self, user_id, user_input, agent):
+        history = self.history(user_id)
+        turn_tokens = self.prepare_model_input(user_id, agent)
+        prefix = history["prefix_text"]
+
         if isinstance(agent, DecoderLM):
             user_input += agent.suffix
 
-        current_tokens = agent.tokenizer(prefix + user_input)["input_ids"]
-        histories_for_current_turn = []
-        num_history_tokens = len(current_tokens)
+        user_tokens = list(agent.tokenizer(user_input)["input_ids"])
 
-        for u, m in zip(
-                reversed(self.histories[user_id]["user_message"]),
-                reversed(self.histories[user_id]["bot_message"]),
-        ):
+        histories_for_current_turn = []
+        tokens_for_current_turn = []
+        num_history_tokens = len(history["prefix_tokens"]) + len(user_tokens)
 
-            history = u + agent.suffix + m + agent.suffix
-            tokens = agent.tokenizer(history)["input_ids"]
+        for i in reversed(range(len(turn_tokens))):
+            num_history_tokens += len(turn_tokens[i])
 
-            num_history_tokens += len(tokens)
             if num_history_tokens < agent.maxlen:
-                histories_for_current_turn.append(history)
+                histories_for_current_turn.append(
+                    history["user_message"][i] + agent.suffix +
+                    history["bot_message"][i] + agent.suffix)
+                tokens_for_current_turn.append(turn_tokens[i])
             else:
                 break
 
+        model_input_ids = list(history["prefix_tokens"])
+        for tokens in reversed(tokens_for_current_turn):
+            model_input_ids += tokens
+        model_input_ids += user_tokens
+
         histories_for_current_turn = list(reversed(histories_for_current_turn))
-        return prefix + "".join(histories_for_current_turn) + user_input
+        model_input = prefix + "".join(histories_for_current_turn) + user_input
+
+        history["model_input"] = model_input
+        history["model_input_ids"] = model_input_ids
+        self.histories.save(user_id)
+        return model_input
 
     def is_empty(self, user_id):
-        return len(self.histories[user_id]["user_message"]) == 0 and \
-               len(self.histories[user_id]["bot_message"]) == 0 and \
-               len(self.histories[user_id]["model_input"]) == 0 and \
-               len(self.histories[user_id]["prefix"]) == 0 and \
-               len(self.histories[user_id]["chosen_topic"]) == 0
+        history = self.history(user_id)
+
+        return len(history["user_message"]) == 0 and \
+               len(history["bot_message"]) == 0 and \
+               len(history["model_input"]) == 0 and \
+               len(history["prefix"]) == 0 and \
+               len(history["chosen_topic"]) == 0
 
     @abstractmethod
     def start(self, agent: BaseAgent):
@@ -0,0 +1,165 @@
+import time
+
+
+class BatchScheduler(object):
+
+    def __init__(
+        self,
+        max_batch_size=16,
+        max_batch_tokens=0,
+        max_wait=0.01,
+        bucket_width=16,
+        min_padding_efficiency=0.75,
+    ):
+        """
+        Queue of requests which forms batches of similar input lengths.
+        a batch is formed when its oldest request has waited `max_wait` seconds
+        or when a length bucket has enough requests to fill a batch.
+        requests are added to the batch in order of length distance,
+        as long as the batch stays in the token budget and the padding efficiency.
+
+        Args:
+            max_batch_size (int): maximum number of requests in one batch
+            max_batch_tokens (int): maximum padded tokens (batch size * longest input) in one batch,
+                unlimited if `max_batch_tokens <= 0`
+            max_wait (float): seconds a request waits for other requests of similar length
+            bucket_width (int): number of tokens in a length bucket
+            min_padding_efficiency (float): minimum ratio of real tokens to padded tokens
+                to add a request of a different length to the batch
+        """
+
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.max_wait = max_wait
+        self.bucket_width = bucket_width
+        self.min_padding_efficiency = min_padding_efficiency
+        # (request, num_tokens) in arrival order
+        self.entries = []
+        self.num_batches = 0
+        self.num_requests = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, request, num_tokens):
+        """
+        Args:
+            request: request with `user_id` and `arrived` (time.monotonic) attributes
+            num_tokens (int): length of the model input of the request
+        """
+
+        self.entries.append((request, max(num_tokens, 1)))
+
+    def bucket(self, num_tokens):
+        return num_tokens // self.bucket_width
+
+    def eligible(self, busy=()):
+        # a user can be in a batch only once, and only with the oldest message,
+        # because the next message needs the reply of the previous one.
+        users, eligible = set(busy), []
+
+        for entry in self.entries:
+            if entry[0].user_id not in users:
+                users.add(entry[0].user_id)
+                eligible.append(entry)
+
+        return eligible
+
+    def fits(self, lengths):
+        padded = len(lengths) * max(lengths)
+
+        if len(lengths) > self.max_batch_size:
+            return False
+
+        if 0 < self.max_batch_tokens < padded:
+            return False
+
+        return sum(lengths) / padded >= self.min_padding_efficiency
+
+    def is_full(self, lengths):
+        return len(lengths) >= self.max_batch_size or \
+            0 < self.max_batch_tokens <= len(lengths) * max(lengths)
+
+    def time_until_ready(self, now=None, busy=()):
+        """
+        Args:
+            busy (Set[str]): users whose previous message is still being generated
+
+        Returns:
+            (float): seconds until the oldest request must be scheduled, None if no request can be
+        """
+
+        eligible = self.eligible(busy)
+
+        if len(eligible) == 0:
+            return None
+
+        now = time.monotonic() if now is None else now
+        return max(eligible[0][0].arrived + self.max_wait - now, 0.0)
+
+    def next_batch(self, now=None, busy=()):
+        """
+        Form a batch if the oldest request waited enough or a length bucket is full.
+
+        Args:
+            busy (Set[str]): users whose previous message is still being generated
+
+        Returns:
+            (List): requests of the batch, empty if no batch is ready
+        """
+
+        eligible = self.eligible(busy)
+
+        if len(eligible) == 0:
+            return []
+
+        anchor = None
+
+        if self.time_until_ready(now, busy) <= 0:
+            anchor = eligible[0]
+        else:
+            buckets = {}
+
+            for entry in eligible:
+                buckets.setdefault(self.bucket(entry[1]), []).append(entry)
+
+            for entries in buckets.values():
+                if self.is_full([n for _, n in entries]):
+                    anchor = entries[0]
+                    break
+
+        if anchor is None:
+            return []
+
+        batch = [anchor]
+        lengths = [anchor[1]]
+        candidates = sorted(
+            [entry for entry in eligible if entry is not anchor],
+            key=lambda entry: abs(self.bucket(entry[1]) - self.bucket(anchor[1])),
+        )
+
+        for entry in candidates:
+            if len(batch) >= self.max_batch_size:
+                break
+
+            if self.fits(lengths + [entry[1]]):
+                batch.append(entry)
+                lengths.append(entry[1])
+
+        self.entries = [entry for entry in self.entries if all(entry is not b for b in batch)]
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        self.real_tokens += sum(lengths)
+        self.padded_tokens += len(lengths) * max(lengths)
+        return [request for request, _ in batch]
+
+    def stats(self):
+        return {
+            "queue_depth": len(self.entries),
+            "batches": self.num_batches,
+            "requests": self.num_requests,
+            "mean_batch_size": self.num_requests / self.num_batches if self.num_batches else None,
+            "padding_efficiency": self.real_tokens / self.padded_tokens if self.padded_tokens else None,
+        }
@@ -0,0 +1,222 @@
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+
+from openchat.utils.cache_utils import LRUCache
+
+
+class BaseSessionStore(ABC):
+    """
+    Storage of dialogue histories keyed by user id.
+    environments modify the returned histories in place and call `save(user_id)` after that.
+    """
+
+    @abstractmethod
+    def get(self, user_id, default=None):
+        raise NotImplemented
+
+    @abstractmethod
+    def set(self, user_id, history):
+        raise NotImplemented
+
+    @abstractmethod
+    def delete(self, user_id):
+        raise NotImplemented
+
+    @abstractmethod
+    def __contains__(self, user_id):
+        raise NotImplemented
+
+    @abstractmethod
+    def __len__(self):
+        raise NotImplemented
+
+    def save(self, user_id):
+        pass
+
+    def flush(self):
+        pass
+
+    def __getitem__(self, user_id):
+        history = self.get(user_id)
+
+        if history is None:
+            raise KeyError(user_id)
+
+        return history
+
+    def __setitem__(self, user_id, history):
+        self.set(user_id, history)
+
+    def __delitem__(self, user_id):
+        self.delete(user_id)
+
+
+class MemorySessionStore(BaseSessionStore):
+
+    def __init__(self, max_sessions=0, max_bytes=0, ttl=0):
+        """
+        In-memory session store with LRU eviction.
+
+        Args:
+            max_sessions (int): maximum number of sessions, unlimited if `max_sessions <= 0`
+            max_bytes (int): maximum estimated size of sessions, unlimited if `max_bytes <= 0`
+            ttl (float): seconds to keep idle sessions, forever if `ttl <= 0`
+        """
+
+        self.cache = LRUCache(
+            maxsize=max_sessions,
+            max_bytes=max_bytes,
+            ttl=ttl,
+        )
+        self.lock = threading.RLock()
+
+    def get(self, user_id, default=None):
+        with self.lock:
+            return self.cache.get(user_id, default)
+
+    def set(self, user_id, history):
+        with self.lock:
+            self.cache.put(user_id, history)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.cache.pop(user_id)
+
+    def save(self, user_id):
+        with self.lock:
+            if user_id in self.cache:
+                self.cache.resize(user_id)
+
+    def stats(self):
+        with self.lock:
+            return self.cache.stats()
+
+    def __contains__(self, user_id):
+        with self.lock:
+            self.cache.expire()
+            return user_id in self.cache
+
+    def __len__(self):
+        with self.lock:
+            self.cache.expire()
+            return len(self.cache)
+
+
+class SQLiteSessionStore(BaseSessionStore):
+
+    def __init__(self, path, max_sessions=1024, max_bytes=0, ttl=0):
+        """
+        On-disk session store. recently used sessions are kept in memory,
+        and written to the database when they are evicted or flushed.
+
+        Args:
+            path (str): path of sqlite database file
+            max_sessions (int): maximum number of sessions in memory
+            max_bytes (int): maximum estimated size of sessions in memory
+            ttl (float): seconds to keep idle sessions in the database, forever if `ttl <= 0`
+        """
+
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id TEXT PRIMARY KEY, "
+            "history TEXT NOT NULL, "
+            "accessed REAL NOT NULL)")
+        self.connection.commit()
+
+        self.cache = LRUCache(
+            maxsize=max_sessions,
+            max_bytes=max_bytes,
+            on_evict=self.write,
+        )
+
+    def get(self, user_id, default=None):
+        with self.lock:
+            if user_id in self.cache:
+                return self.cache.get(user_id)
+
+            row = self.connection.execute(
+                "SELECT history, accessed FROM sessions WHERE user_id = ?",
+                (str(user_id),),
+            ).fetchone()
+
+            if row is None:
+                return default
+
+            if self.is_expired(row[1]):
+                self.delete(user_id)
+                return default
+
+            history = json.loads(row[0])
+            self.cache.put(user_id, history)
+            return history
+
+    def set(self, user_id, history):
+        with self.lock:
+            self.cache.put(user_id, history)
+
+    def delete(self, user_id):
+        with self.lock:
+            self.cache.pop(user_id)
+            self.connection.execute(
+                "DELETE FROM sessions WHERE user_id = ?",
+                (str(user_id),),
+            )
+            self.connection.commit()
+
+    def save(self, user_id):
+        with self.lock:
+            if user_id in self.cache:
+                self.cache.resize(user_id)
+
+    def write(self, user_id, history):
+        with self.lock:
+            accessed = self.cache.accessed.get(user_id, time.time())
+            self.connection.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?)",
+                (str(user_id), json.dumps(history), accessed),
+            )
+            self.connection.commit()
+
+    def flush(self):
+        with self.lock:
+            for user_id in self.cache.keys():
+                self.write(user_id, self.cache.entries[user_id])
+
+    def expire(self):
+        if self.ttl <= 0:
+            return
+
+        with self.lock:
+            self.connection.execute(
+                "DELETE FROM sessions WHERE accessed < ?",
+                (time.time() - self.ttl,),
+            )
+            self.connection.commit()
+
+    def is_expired(self, accessed):
+        return self.ttl > 0 and accessed < time.time() - self.ttl
+
+    def close(self):
+        with self.lock:
+            self.flush()
+            self.connection.close()
+
+    def stats(self):
+        with self.lock:
+            return self.cache.stats()
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        with self.lock:
+            self.flush()
+            self.expire()
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM sessions").fetchone()[0]
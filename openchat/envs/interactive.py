@@ -1,4 +1,3 @@
-import random
 import sys
 import torch
 import gc
@@ -8,10 +7,13 @@ from openchat.base import (
     BaseAgent,
     ConvAI2Agent,
     WizardOfWikipediaAgent,
+    ParlaiGenerationAgent,
+    HuggingfaceAgent,
     SingleTurn,
     PromptAgent,
 )
 
+from openchat.utils.trace_utils import span
 from openchat.utils.terminal_utils import (
     cprint,
     cinput,
@@ -27,9 +29,12 @@ class InteractiveEnvironment(BaseEnvironment):
         bot_color=Colors.YELLOW,
         special_color=Colors.BLUE,
         system_color=Colors.CYAN,
+        session_store=None,
+        stream=False,
     ):
-        super().__init__()
+        super().__init__(session_store=session_store)
         self.user_id = "dummy_value"
+        self.stream = stream
         self.user_color = user_color
         self.bot_color = bot_color
         self.special_color = special_color
@@ -47,7 +52,9 @@ class InteractiveEnvironment(BaseEnvironment):
         gc.enable()
 
         while True:
-            torch.cuda.empty_cache()
+            with span("env.cleanup", model=agent.name):
+                torch.cuda.empty_cache()
+
             if self.is_empty(self.user_id):
                 pre_dialog_output = self.pre_dialog_for_special_tasks(agent)
 
@@ -72,10 +79,18 @@ class InteractiveEnvironment(BaseEnvironment):
                     color=self.system_color,
                 )
                 self.clear_histories(self.user_id)
+
+                if isinstance(agent, HuggingfaceAgent):
+                    agent.clear_session_cache(self.user_id)
                 continue
 
             if isinstance(agent, WizardOfWikipediaAgent):
-                user_message = agent.retrieve_knowledge(user_message)
+                # tokenize the history while knowledge is retrieved
+                knowledge = agent.retrieve_knowledge_async(user_message)
+                self.prepare_model_input(self.user_id, agent)
+
+                with span("env.wait_knowledge", model=agent.name):
+                    user_message = knowledge.result()
 
             if isinstance(agent, PromptAgent):
                 user_message = f"{user_name}: {user_message} {bot_name}:"
@@ -91,23 +106,77 @@ class InteractiveEnvironment(BaseEnvironment):
 
             self.add_user_message(self.user_id, user_message)
 
-            if isinstance(agent, PromptAgent):
+            if self.stream and isinstance(agent, HuggingfaceAgent):
+                if isinstance(agent, PromptAgent):
+                    chunks = agent.predict_stream(
+                        model_input,
+                        person_1=user_name,
+                        person_2=bot_name,
+                        user_id=self.user_id,
+                    )
+                else:
+                    chunks = agent.predict_stream(
+                        model_input,
+                        user_id=self.user_id,
+                    )
+
+                bot_message = self.print_stream(agent, chunks)
+
+            elif isinstance(agent, PromptAgent):
                 bot_message = agent.predict(
                     model_input,
                     person_1=user_name,
                     person_2=bot_name,
+                    user_id=self.user_id,
+                )["output"]
+
+            elif isinstance(agent, ParlaiGenerationAgent):
+                # reuse the token ids cached by `make_model_input`
+                # if the dictionary tokenizes the joined text the same way.
+                if agent.concatenates_token_ids():
+                    text_vec = self.histories[self.user_id]["model_input_ids"]
+                else:
+                    text_vec = None
+
+                bot_message = agent.predict(
+                    model_input,
+                    text_vec=text_vec,
+                )["output"]
+
+            elif isinstance(agent, HuggingfaceAgent):
+                bot_message = agent.predict(
+                    model_input,
+                    user_id=self.user_id,
                 )["output"]
 
             else:
                 bot_message = agent.predict(model_input)["output"]
 
-            cprint(
-                f"[{agent.name.upper()}]: {bot_message}",
-                color=self.bot_color,
-            )
+            if not (self.stream and isinstance(agent, HuggingfaceAgent)):
+                cprint(
+                    f"[{agent.name.upper()}]: {bot_message}",
+                    color=self.bot_color,
+                )
+
+            if isinstance(agent, WizardOfWikipediaAgent):
+                # the turn is tokenized during the next retrieval
+                self.add_bot_message(self.user_id, bot_message)
+            else:
+                self.add_bot_message(self.user_id, bot_message, agent)
 
-            self.add_bot_message(self.user_id, bot_message)
-            gc.collect()
+            with span("env.cleanup", model=agent.name):
+                gc.collect()
+
+    def print_stream(self, agent, chunks):
+        cprint(f"[{agent.name.upper()}]: ", color=self.bot_color, end="", flush=True)
+        bot_message = ""
+
+        for chunk in chunks:
+            cprint(chunk, color=self.bot_color, end="", flush=True)
+            bot_message += chunk
+
+        print()
+        return bot_message.strip()
 
     def pre_dialog_for_special_tasks(self, agent):
         if isinstance(agent, ConvAI2Agent):
@@ -208,17 +277,13 @@ class InteractiveEnvironment(BaseEnvironment):
             )
 
             if _topic == ".topic":
-                random_list = agent.topic_list
-                random.shuffle(random_list)
-                random_list = random_list[:4]
-
                 _topic = cprint(
-                    f"[TOPIC]: {random_list}\n",
+                    f"[TOPIC]: {agent.topic_index.sample(4)}\n",
                     color=self.special_color,
                 )
 
             else:
-                if _topic in agent.topic_list:
+                if _topic in agent.topic_index:
                     cprint(
                         f"[TOPIC]: Topic setting complete.\n",
                         color=self.special_color,
@@ -227,6 +292,7 @@ class InteractiveEnvironment(BaseEnvironment):
                     break
                 else:
                     _topic = cprint(
-                        f"[TOPIC]: Wrong topic: {_topic}. Please enter validate topic.\n",
+                        f"[TOPIC]: Wrong topic: {_topic}. Please enter validate topic.\n"
+                        f"[TOPIC]: Similar topics: {agent.suggest_topics(_topic)}\n",
                         color=self.special_color,
                     )
@@ -0,0 +1,652 @@
+import asyncio
+import json
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+from openchat.agents.registry import get_model_spec
+from openchat.utils.trace_utils import span, enabled_sinks, HistogramSink
+from openchat.base.envs.base import BaseEnvironment
+from openchat.base.envs.scheduler import BatchScheduler
+from openchat.base import (
+    BaseAgent,
+    ConvAI2Agent,
+    WizardOfWikipediaAgent,
+    ParlaiGenerationAgent,
+    SingleTurn,
+    PromptAgent,
+    SafetyFilter,
+)
+
+REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+@dataclass
+class ChatRequest:
+    user_id: str
+    message: str
+    data: dict
+    future: asyncio.Future
+    arrived: float = field(default_factory=time.monotonic)
+    knowledge: Future = None
+    # user message as it is added to the history, after the reply is generated
+    user_message: str = None
+
+
+class WebServerEnvironment(BaseEnvironment):
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=8080,
+        batch_window=0.01,
+        max_batch_size=None,
+        max_batch_tokens=0,
+        bucket_width=16,
+        min_padding_efficiency=0.75,
+        max_inflight_batches=4,
+        max_latency_samples=10000,
+        generation_options=None,
+        session_store=None,
+    ):
+        """
+        HTTP server environment. queued requests are bucketed by input length,
+        and requests of similar lengths arriving within `batch_window`
+        are generated by one `predict_batch` call.
+
+        endpoints:
+            POST /chat: {"user_id": str, "message": str} -> {"user_id", "input", "output"}
+                optional fields are "persona" (List[str]) for ConvAI2 models,
+                "topic" (str) for Wizard of Wikipedia models and
+                "user_name", "bot_name", "story" (str) for prompt models.
+            POST /reset: {"user_id": str} -> clear histories of the user
+            GET /stats: queue depth, number of batches, p50/p99 latency, padding efficiency
+                and hit/miss counters of the knowledge cache for Wizard of Wikipedia models
+            GET /metrics: span histograms in prometheus text format, if a `HistogramSink` is enabled
+
+        Args:
+            host (str): host to bind
+            port (int): port to bind
+            batch_window (float): seconds a request waits for more requests of similar length
+            max_batch_size (int): maximum number of requests in one batch,
+                the recommended batch size of the model if it is not given
+            max_batch_tokens (int): maximum padded tokens (batch size * longest input) in one batch,
+                unlimited if `max_batch_tokens <= 0`
+            bucket_width (int): number of tokens in a length bucket
+            min_padding_efficiency (float): minimum ratio of real tokens to padded tokens in a batch
+            max_inflight_batches (int): number of batches generated at the same time,
+                if continuous batching of the agent is enabled
+            max_latency_samples (int): number of recent latencies used for percentiles
+            generation_options (dict): keyword arguments for `predict_batch`
+            session_store (BaseSessionStore): storage of dialogue histories
+        """
+
+        super().__init__(session_store=session_store)
+        self.host = host
+        self.port = port
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.bucket_width = bucket_width
+        self.min_padding_efficiency = min_padding_efficiency
+        self.generation_options = generation_options or {}
+        self.latencies = deque(maxlen=max_latency_samples)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.pending = self.make_scheduler()
+        self.arrived = None
+        self.agent = None
+        self.max_inflight_batches = max_inflight_batches
+        self.inflight = None
+        self.predict_executor = None
+        self.busy_users = set()
+        # model calls run one batch at a time out of the event loop
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def start(self, agent: BaseAgent):
+        print(f"[SYSTEM]: serving [{agent.name.upper()}] on http://{self.host}:{self.port}")
+        asyncio.run(self.serve(agent))
+
+    async def serve(self, agent: BaseAgent):
+        self.agent = agent
+
+        if self.max_batch_size is None:
+            self.max_batch_size = self.recommended_batch_size(agent)
+        self.pending.max_batch_size = self.max_batch_size
+        self.arrived = asyncio.Event()
+
+        if getattr(agent, "engine", None) is not None and not isinstance(agent, SafetyFilter):
+            # batches are generated concurrently by the continuous batching engine
+            self.inflight = asyncio.Semaphore(self.max_inflight_batches)
+            self.predict_executor = ThreadPoolExecutor(max_workers=self.max_inflight_batches)
+
+        server = await asyncio.start_server(
+            self.handle_connection,
+            host=self.host,
+            port=self.port,
+        )
+
+        batcher = asyncio.ensure_future(self.run_batches())
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request = await self.read_request(reader)
+
+                if request is None:
+                    break
+
+                method, path, headers, body = request
+                status, response = await self.route(method, path, body)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self.write_response(writer, status, response, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader):
+        request_line = await reader.readline()
+
+        if not request_line:
+            return None
+
+        method, path, _ = request_line.decode("latin-1").split(" ", 2)
+        headers = {}
+
+        while True:
+            line = await reader.readline()
+
+            if line in (b"\r\n", b"\n", b""):
+                break
+
+            key, value = line.decode("latin-1").split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+
+        length = int(headers.get("content-length", 0))
+        body = await reader.readexactly(length) if length > 0 else b""
+        return method.upper(), path.split("?")[0], headers, body
+
+    @staticmethod
+    async def write_response(writer, status, response, keep_alive):
+        if isinstance(response, str):
+            body = response.encode("utf-8")
+            content_type = "text/plain; version=0.0.4"
+        else:
+            body = json.dumps(response).encode("utf-8")
+            content_type = "application/json"
+
+        header = (
+            f"HTTP/1.1 {status} {REASONS[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+
+        writer.write(header.encode("latin-1") + body)
+        await writer.drain()
+
+    async def route(self, method, path, body):
+        if path == "/stats":
+            if method != "GET":
+                return 405, {"error": "method not allowed"}
+            return 200, self.stats()
+
+        if path == "/metrics":
+            if method != "GET":
+                return 405, {"error": "method not allowed"}
+            return 200, self.metrics()
+
+        if path not in ["/chat", "/reset"]:
+            return 404, {"error": f"not found: {path}"}
+
+        if method != "POST":
+            return 405, {"error": "method not allowed"}
+
+        try:
+            data = json.loads(body.decode("utf-8"))
+            user_id = str(data["user_id"])
+        except (ValueError, KeyError, TypeError):
+            return 400, {"error": "body must be json with `user_id`"}
+
+        loop = asyncio.get_event_loop()
+
+        if path == "/reset":
+            await loop.run_in_executor(self.executor, self.reset, user_id)
+            return 200, {"user_id": user_id}
+
+        if not isinstance(data.get("message"), str):
+            return 400, {"error": "body must be json with `message`"}
+
+        request = ChatRequest(
+            user_id=user_id,
+            message=data["message"],
+            data=data,
+            future=loop.create_future(),
+        )
+
+        if isinstance(self.agent, WizardOfWikipediaAgent):
+            # retrieval runs while the request waits for its batch
+            request.knowledge = self.start_retrieval(user_id, data)
+
+        self.enqueue(request)
+
+        try:
+            output = await request.future
+        except (AssertionError, KeyError) as e:
+            return 400, {"error": str(e)}
+        except Exception as e:
+            return 500, {"error": str(e)}
+
+        self.num_requests += 1
+        self.latencies.append(time.monotonic() - request.arrived)
+        return 200, {"user_id": user_id, "input": data["message"], "output": output}
+
+    def enqueue(self, request):
+        self.pending.add(request, self.estimate_tokens(request))
+        self.arrived.set()
+
+    def estimate_tokens(self, request):
+        """
+        Length of the model input of the request, from the token counts
+        of the history cached by `make_model_input`. only the message is tokenized.
+        """
+
+        agent = self.agent
+        num_tokens = len(agent.tokenizer(request.message)["input_ids"])
+        history = self.histories.get(request.user_id)
+
+        if history is not None and not isinstance(agent, SingleTurn):
+            num_tokens += len(history["prefix_tokens"])
+            num_tokens += sum(len(tokens) for tokens in history["turn_tokens"])
+
+        return min(num_tokens, agent.maxlen) if agent.maxlen > 0 else num_tokens
+
+    def make_scheduler(self):
+        return BatchScheduler(
+            max_batch_size=self.max_batch_size or 16,
+            max_batch_tokens=self.max_batch_tokens,
+            max_wait=self.batch_window,
+            bucket_width=self.bucket_width,
+            min_padding_efficiency=self.min_padding_efficiency,
+        )
+
+    async def run_batches(self):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            if self.inflight is not None:
+                await self.inflight.acquire()
+                batch = await self.collect_batch(self.pending, self.arrived)
+                asyncio.ensure_future(self.run_continuous_batch(batch))
+                continue
+
+            batch = await self.collect_batch(self.pending, self.arrived)
+
+            try:
+                outputs = await loop.run_in_executor(
+                    self.executor,
+                    self.process_batch,
+                    batch,
+                )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                for request, output in zip(batch, outputs):
+                    if isinstance(output, Exception):
+                        request.future.set_exception(output)
+                    else:
+                        request.future.set_result(output)
+
+            self.num_batches += 1
+
+    async def run_continuous_batch(self, batch):
+        """
+        Generate a batch while the next batches are collected and generated.
+        sessions are prepared and updated one batch at a time in `executor`,
+        and generation runs in `predict_executor`, so batches join the running batch of the engine.
+        """
+
+        loop = asyncio.get_event_loop()
+        users = {request.user_id for request in batch}
+        self.busy_users.update(users)
+
+        try:
+            results = await loop.run_in_executor(self.executor, self.prepare_batch, batch)
+            prepared = [i for i, result in enumerate(results) if not isinstance(result, Exception)]
+            requests = [batch[i] for i in prepared]
+
+            outputs = await loop.run_in_executor(
+                self.predict_executor,
+                self.predict_batch,
+                requests,
+                [results[i] for i in prepared],
+            )
+
+            await loop.run_in_executor(self.executor, self.add_bot_messages, requests, outputs)
+
+            for i, output in zip(prepared, outputs):
+                results[i] = output
+        except Exception as e:
+            results = [e] * len(batch)
+        finally:
+            self.busy_users.difference_update(users)
+            self.inflight.release()
+            # deferred messages of these users can be scheduled now
+            self.arrived.set()
+
+        for request, output in zip(batch, results):
+            if isinstance(output, Exception):
+                request.future.set_exception(output)
+            else:
+                request.future.set_result(output)
+
+        self.num_batches += 1
+
+    async def collect_batch(self, pending, arrived):
+        """
+        Wait until the scheduler forms a batch of requests with similar input lengths.
+        """
+
+        while True:
+            batch = pending.next_batch(busy=self.busy_users)
+
+            if len(batch) > 0:
+                return batch
+
+            arrived.clear()
+
+            try:
+                await asyncio.wait_for(arrived.wait(), pending.time_until_ready(busy=self.busy_users))
+            except asyncio.TimeoutError:
+                pass
+
+    def process_batch(self, batch):
+        with span("webserver.batch", model=self.agent.name):
+            return self._process_batch(batch)
+
+    def _process_batch(self, batch):
+        results = self.prepare_batch(batch)
+        prepared = [i for i, result in enumerate(results) if not isinstance(result, Exception)]
+
+        for i, output in zip(prepared, self.generate(
+                [batch[i] for i in prepared],
+                [results[i] for i in prepared],
+        )):
+            results[i] = output
+
+        return results
+
+    def prepare_batch(self, batch):
+        """
+        Returns:
+            (List): model input of each request, or the exception if the request is wrong
+        """
+
+        results = [None] * len(batch)
+        prepared = []
+
+        for i, request in enumerate(batch):
+            try:
+                self.prepare_session(request.user_id, request.data)
+                prepared.append(i)
+            except (AssertionError, KeyError) as e:
+                results[i] = e
+
+        for i, model_input in zip(prepared, self.make_model_inputs([batch[i] for i in prepared])):
+            results[i] = model_input
+
+        return results
+
+    def generate(self, batch, model_inputs):
+        outputs = self.predict_batch(batch, model_inputs)
+        self.add_bot_messages(batch, outputs)
+        return outputs
+
+    def make_model_inputs(self, batch):
+        agent = self.agent
+        model_inputs = []
+
+        if isinstance(agent, WizardOfWikipediaAgent):
+            knowledge = self.retrieve_knowledge(batch)
+
+        for i, request in enumerate(batch):
+            user_message = request.message
+            history = self.history(request.user_id)
+
+            if isinstance(agent, WizardOfWikipediaAgent):
+                agent.chosen_topic = history["chosen_topic"]
+                user_message = knowledge[i]
+
+            if isinstance(agent, PromptAgent):
+                user_message = f"{history['user_name']}: {user_message} {history['bot_name']}:"
+
+            if isinstance(agent, SingleTurn):
+                model_input = user_message
+            else:
+                model_input = self.make_model_input(
+                    request.user_id,
+                    user_message,
+                    agent,
+                )
+
+            request.user_message = user_message
+            model_inputs.append(model_input)
+
+        return model_inputs
+
+    def predict_batch(self, batch, model_inputs):
+        agent = self.agent
+        outputs = [None] * len(batch)
+
+        for indices, options in self.group_by_options(batch):
+            texts = [model_inputs[i] for i in indices]
+
+            if isinstance(agent, ParlaiGenerationAgent) and \
+                    agent.concatenates_token_ids():
+                options["text_vecs"] = [
+                    self.history(batch[i].user_id)["model_input_ids"]
+                    for i in indices
+                ]
+
+            for i, output in zip(
+                    indices,
+                    agent.predict_batch(texts, **options),
+            ):
+                outputs[i] = output["output"]
+
+        return outputs
+
+    def add_bot_messages(self, batch, outputs):
+        """
+        Add the turns of generated replies. user messages are added with their replies,
+        so a failed generation leaves no user message without a reply in the history.
+        """
+
+        for request, output in zip(batch, outputs):
+            # saved with the bot message
+            self.history(request.user_id)["user_message"].append(request.user_message)
+
+            if isinstance(self.agent, WizardOfWikipediaAgent):
+                # the turn is tokenized during the next retrieval
+                self.add_bot_message(request.user_id, output)
+            else:
+                self.add_bot_message(request.user_id, output, self.agent)
+
+    def start_retrieval(self, user_id, data):
+        """
+        Start knowledge retrieval when a request arrives, if its topic is already known.
+        """
+
+        topic = data.get("topic")
+
+        if topic is None:
+            history = self.histories.get(user_id)
+            topic = history["chosen_topic"] if history is not None else None
+
+        if not topic or topic not in self.agent.topic_index:
+            return None
+
+        return self.agent.retrieve_knowledge_async(data["message"], topic)
+
+    def retrieve_knowledge(self, batch):
+        """
+        Retrieve knowledge of the requests whose retrieval didn't start on arrival
+        in one background call, and tokenize their histories meanwhile.
+        """
+
+        agent = self.agent
+        topics = [self.history(r.user_id)["chosen_topic"] for r in batch]
+        missing = [i for i, r in enumerate(batch) if r.knowledge is None]
+        knowledge = [None] * len(batch)
+        future = None
+
+        if len(missing) > 0:
+            future = agent.retrieve_knowledge_batch_async(
+                [batch[i].message for i in missing],
+                [topics[i] for i in missing],
+            )
+
+        for request in batch:
+            self.prepare_model_input(request.user_id, agent)
+
+        if future is not None:
+            for i, output in zip(missing, future.result()):
+                knowledge[i] = output
+
+        for i, request in enumerate(batch):
+            if request.knowledge is not None:
+                try:
+                    knowledge[i] = request.knowledge.result()
+                except Exception:
+                    knowledge[i] = agent.retrieve_knowledge_async(
+                        request.message,
+                        topics[i],
+                    ).result()
+
+        return knowledge
+
+    def group_by_options(self, batch):
+        """
+        Group requests which can be generated by the same `predict_batch` call.
+        """
+
+        groups = {}
+
+        for i, request in enumerate(batch):
+            options = dict(self.generation_options)
+
+            if isinstance(self.agent, PromptAgent):
+                history = self.history(request.user_id)
+                options["person_1"] = history["user_name"]
+                options["person_2"] = history["bot_name"]
+
+            key = tuple(sorted(options.items(), key=lambda x: x[0]))
+            groups.setdefault(key, ([], options))[0].append(i)
+
+        return list(groups.values())
+
+    def prepare_session(self, user_id, data):
+        agent = self.agent
+        history = self.history(user_id)
+
+        if isinstance(agent, ConvAI2Agent) and "persona" in data:
+            agent.clear_persona(self.histories, user_id)
+
+            for persona in data["persona"]:
+                agent.add_persona(self.histories, user_id, persona)
+
+        if isinstance(agent, WizardOfWikipediaAgent):
+            if "topic" in data:
+                agent.set_topic(data["topic"])
+                history["chosen_topic"] = agent.chosen_topic
+
+            assert len(history["chosen_topic"]) > 0, \
+                "field `topic` is required for the first message"
+
+        if isinstance(agent, PromptAgent):
+            if "story" in data:
+                user_name = data["user_name"]
+                bot_name = data["bot_name"]
+                story = data["story"]
+                story += f" {user_name} and {bot_name} start talking. "
+                story += f"{user_name}: Hello {bot_name}. "
+                story += f"{bot_name}: Hi {user_name}. "
+
+                history["user_name"] = user_name
+                history["bot_name"] = bot_name
+                agent.add_prompt(self.histories, user_id, story)
+
+            assert "user_name" in history, \
+                "fields `user_name`, `bot_name` and `story` are required for the first message"
+
+        self.histories.save(user_id)
+
+    @staticmethod
+    def recommended_batch_size(agent):
+        try:
+            return get_model_spec(agent.name).batch_size
+        except Exception:
+            return 16
+
+    def reset(self, user_id):
+        self.clear_histories(user_id)
+
+        if hasattr(self.agent, "clear_session_cache"):
+            self.agent.clear_session_cache(user_id)
+
+    @staticmethod
+    def metrics():
+        return "".join(
+            sink.prometheus() for sink in enabled_sinks()
+            if isinstance(sink, HistogramSink)
+        )
+
+    def stats(self):
+        latencies = sorted(self.latencies)
+
+        def percentile(p):
+            if len(latencies) == 0:
+                return None
+            return latencies[min(len(latencies) - 1, int(len(latencies) * p))]
+
+        stats = {
+            "queue_depth": len(self.pending),
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "latency": {
+                "p50": percentile(0.50),
+                "p99": percentile(0.99),
+            },
+            "scheduler": self.pending.stats(),
+        }
+
+        if isinstance(self.agent, WizardOfWikipediaAgent):
+            stats["knowledge_cache"] = self.agent.knowledge_cache_stats()
+
+        if getattr(self.agent, "engine", None) is not None:
+            stats["engine"] = self.agent.engine.stats()
+
+        for sink in enabled_sinks():
+            if isinstance(sink, HistogramSink):
+                stats["spans"] = sink.stats()
+
+        return stats
@@ -0,0 +1,321 @@
+import asyncio
+import gc
+import multiprocessing
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from openchat.base.envs.session import MemorySessionStore
+from openchat.envs.webserver import ChatRequest, WebServerEnvironment
+from openchat.utils.cache_utils import LRUCache
+from openchat.base import BaseAgent, SingleTurn, WizardOfWikipediaAgent
+
+
+def available_cores():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+
+    return list(range(os.cpu_count() or 1))
+
+
+def split_cores(num_workers=None, cores_per_worker=4):
+    """
+    Split the cores of this process into disjoint core sets, one for each worker.
+
+    Returns:
+        (List[List[int]]): core set of each worker
+    """
+
+    cores = available_cores()
+
+    if num_workers is None:
+        num_workers = max(1, len(cores) // cores_per_worker)
+
+    cores_per_worker = max(1, len(cores) // num_workers)
+
+    return [
+        # more workers than cores share the cores round robin
+        cores[(i * cores_per_worker) % len(cores):][:cores_per_worker]
+        for i in range(num_workers)
+    ]
+
+
+def shard(user_id, num_workers):
+    # crc32 is stable across processes, unlike `hash` of strings
+    return zlib.crc32(user_id.encode("utf-8")) % num_workers
+
+
+def run_worker(index, connection, agent, cores, generation_options, session_store_factory):
+    """
+    Main loop of a worker process. the worker owns the sessions of its shard,
+    so only requests and replies go through the pipe.
+    """
+
+    import torch
+
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+
+    torch.set_num_threads(len(cores))
+
+    if isinstance(agent, WizardOfWikipediaAgent):
+        agent.after_fork()
+
+    if getattr(agent, "engine", None) is not None:
+        # the engine thread of the parent doesn't exist in the worker
+        max_batch_size = agent.engine.max_batch_size
+        agent.engine = None
+        agent.enable_continuous_batching(max_batch_size)
+
+    # stores are created in the worker, because connections (e.g. sqlite) don't survive `fork`
+    env = WebServerEnvironment(
+        generation_options=generation_options,
+        session_store=session_store_factory(index) if session_store_factory else MemorySessionStore(),
+    )
+    env.agent = agent
+
+    while True:
+        try:
+            command, payload = connection.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        try:
+            if command == "process":
+                batch = [
+                    ChatRequest(user_id=user_id, message=message, data=data, future=None)
+                    for user_id, message, data in payload
+                ]
+                results = env.process_batch(batch)
+                env.num_batches += 1
+                # lengths of model inputs let the dispatcher bucket the next requests of the users
+                lengths = [
+                    len(env.histories.get(request.user_id, {}).get("model_input_ids", []))
+                    for request in batch
+                ]
+                result = results, lengths, {
+                    "sessions": len(env.histories),
+                    "batches": env.num_batches,
+                }
+            elif command == "reset":
+                result = env.reset(payload)
+            elif command == "stop":
+                connection.send(("ok", None))
+                break
+            else:
+                raise Exception(f"wrong command: {command}")
+        except Exception as e:
+            connection.send(("error", e))
+        else:
+            connection.send(("ok", result))
+
+    connection.close()
+
+
+class Worker(object):
+
+    def __init__(self, index, cores, scheduler):
+        self.index = index
+        self.cores = cores
+        self.process = None
+        self.connection = None
+        # one call at a time on the pipe, so batches and resets don't interleave
+        self.lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pending = scheduler
+        self.arrived = None
+        self.stats = {"sessions": 0, "batches": 0}
+
+    def start(self, agent, generation_options, session_store_factory=None):
+        context = multiprocessing.get_context("fork")
+        self.connection, child = context.Pipe()
+        self.process = context.Process(
+            target=run_worker,
+            args=(self.index, child, agent, self.cores, generation_options, session_store_factory),
+            daemon=True,
+        )
+        self.process.start()
+        child.close()
+
+    def call(self, command, payload=None):
+        with self.lock:
+            self.connection.send((command, payload))
+            status, result = self.connection.recv()
+
+        if status == "error":
+            raise result
+
+        return result
+
+    def stop(self, timeout=5.0):
+        if self.process is None:
+            return
+
+        try:
+            self.call("stop")
+        except (EOFError, OSError):
+            pass
+
+        self.process.join(timeout)
+
+        if self.process.is_alive():
+            self.process.terminate()
+
+        self.connection.close()
+        self.process = None
+
+
+class WorkerPoolEnvironment(WebServerEnvironment):
+
+    def __init__(
+        self,
+        num_workers=None,
+        cores_per_worker=4,
+        session_store_factory=None,
+        max_sessions=100000,
+        **kwargs,
+    ):
+        """
+        HTTP server environment which shards sessions across worker processes by user id.
+        every worker owns the sessions of its shard (shared-nothing), pins torch intra-op threads
+        to its own core set and generates its batches independently of other workers.
+        the model is loaded once before the workers are forked, so they share the weights copy-on-write.
+
+        endpoints are the same as `WebServerEnvironment`, and GET /stats shows queue depth,
+        number of sessions and batches of every worker.
+
+        Args:
+            num_workers (int): number of worker processes, `#cores // cores_per_worker` if it is not given
+            cores_per_worker (int): number of cores for each worker if `num_workers` is not given
+            session_store_factory (callable): function of worker index returning the session store
+                of the worker, `MemorySessionStore` if it is not given
+            max_sessions (int): number of users whose input lengths are kept for length bucketing
+            kwargs: arguments of `WebServerEnvironment`
+        """
+
+        super().__init__(**kwargs)
+        self.session_store_factory = session_store_factory
+        self.workers = [
+            Worker(index, cores, self.make_scheduler()) for index, cores
+            in enumerate(split_cores(num_workers, cores_per_worker))
+        ]
+        # length of the last model input of each user, sessions themselves stay in workers
+        self.input_lengths = LRUCache(maxsize=max_sessions)
+
+    def start(self, agent: BaseAgent):
+        self.start_workers(agent)
+
+        try:
+            print(
+                f"[SYSTEM]: serving [{agent.name.upper()}] on http://{self.host}:{self.port} "
+                f"with {len(self.workers)} workers"
+            )
+            asyncio.run(self.serve(agent))
+        finally:
+            self.stop_workers()
+
+    def start_workers(self, agent):
+        # objects loaded so far are never collected, so workers don't copy their pages.
+        if hasattr(gc, "freeze"):
+            gc.collect()
+            gc.freeze()
+
+        for worker in self.workers:
+            worker.start(agent, self.generation_options, self.session_store_factory)
+
+    def stop_workers(self):
+        for worker in self.workers:
+            worker.stop()
+
+    async def serve(self, agent: BaseAgent):
+        if self.max_batch_size is None:
+            self.max_batch_size = self.recommended_batch_size(agent)
+
+        for worker in self.workers:
+            worker.arrived = asyncio.Event()
+            worker.pending.max_batch_size = self.max_batch_size
+
+        await super().serve(agent)
+
+    def worker_of(self, user_id):
+        return self.workers[shard(user_id, len(self.workers))]
+
+    def enqueue(self, request):
+        worker = self.worker_of(request.user_id)
+        worker.pending.add(request, self.estimate_tokens(request))
+        worker.arrived.set()
+
+    def estimate_tokens(self, request):
+        agent = self.agent
+        num_tokens = len(agent.tokenizer(request.message)["input_ids"])
+
+        if not isinstance(agent, SingleTurn):
+            num_tokens += self.input_lengths.get(request.user_id, 0)
+
+        return min(num_tokens, agent.maxlen) if agent.maxlen > 0 else num_tokens
+
+    def start_retrieval(self, user_id, data):
+        # knowledge is retrieved by the worker which owns the session
+        return None
+
+    async def run_batches(self):
+        await asyncio.gather(*[
+            self.run_worker_batches(worker)
+            for worker in self.workers
+        ])
+
+    async def run_worker_batches(self, worker):
+        loop = asyncio.get_event_loop()
+
+        while True:
+            batch = await self.collect_batch(worker.pending, worker.arrived)
+
+            try:
+                outputs, lengths, worker.stats = await loop.run_in_executor(
+                    worker.executor,
+                    worker.call,
+                    "process",
+                    [(r.user_id, r.message, r.data) for r in batch],
+                )
+            except Exception as e:
+                for request in batch:
+                    request.future.set_exception(e)
+            else:
+                for request, length in zip(batch, lengths):
+                    self.input_lengths.put(request.user_id, length)
+
+                for request, output in zip(batch, outputs):
+                    if isinstance(output, Exception):
+                        request.future.set_exception(output)
+                    else:
+                        request.future.set_result(output)
+
+            self.num_batches += 1
+
+    def reset(self, user_id):
+        self.worker_of(user_id).call("reset", user_id)
+
+    def stats(self):
+        stats = super().stats()
+        stats["queue_depth"] = sum(len(w.pending) for w in self.workers)
+        stats.pop("knowledge_cache", None)
+        real_tokens = sum(w.pending.real_tokens for w in self.workers)
+        padded_tokens = sum(w.pending.padded_tokens for w in self.workers)
+        stats["scheduler"] = {
+            "queue_depth": stats["queue_depth"],
+            "batches": sum(w.pending.num_batches for w in self.workers),
+            "requests": sum(w.pending.num_requests for w in self.workers),
+            "padding_efficiency": real_tokens / padded_tokens if padded_tokens else None,
+        }
+        stats["workers"] = [
+            {
+                "pid": w.process.pid if w.process is not None else None,
+                "cores": w.cores,
+                "queue_depth": len(w.pending),
+                "padding_efficiency": w.pending.stats()["padding_efficiency"],
+                **w.stats,
+            }
+            for w in self.workers
+        ]
+        return stats
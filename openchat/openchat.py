@@ -1,12 +1,5 @@
-from openchat.agents.blender import BlenderGenerationAgent
-from openchat.agents.dialogpt import DialoGPTAgent
-from openchat.agents.dodecathlon import DodecathlonAgent
-from openchat.agents.gptneo import GPTNeoAgent
-from openchat.agents.safety import OffensiveAgent, SensitiveAgent
-from openchat.agents.reddit import RedditAgent
-from openchat.agents.unlikelihood import UnlikelihoodAgent
-from openchat.agents.wow import WizardOfWikipediaGenerationAgent
-from openchat.envs.interactive import InteractiveEnvironment
+from openchat.agents import registry
+from openchat.agents.pool import get_pool
 from openchat.utils.terminal_utils import draw_openchat
 
 
@@ -18,6 +11,14 @@ class OpenChat(object):
         device,
         maxlen=-1,
         environment="interactive",
+        session_cache=False,
+        continuous_batching=False,
+        session_store=None,
+        environment_options=None,
+        safety=None,
+        safety_options=None,
+        precision="fp32",
+        draft=None,
     ):
         draw_openchat()
         self.agent = self.check_agent(model)
@@ -25,10 +26,43 @@ class OpenChat(object):
             name=self.agent,
             device=device,
             maxlen=maxlen,
+            precision=precision,
         )
 
+        if session_cache:
+            self.agent.enable_session_cache()
+
+        if continuous_batching:
+            assert hasattr(self.agent, "enable_continuous_batching"), \
+                "continuous batching is only available for huggingface decoder models"
+
+            self.agent.enable_continuous_batching(
+                max_batch_size=registry.get_model_spec(self.agent.name).batch_size,
+            )
+
+        if draft is not None:
+            self.agent = self.add_draft(
+                agent=self.agent,
+                name=self.check_agent(draft),
+                device=device,
+                precision=precision,
+            )
+
+        if safety is not None:
+            self.agent = self.add_safety_filter(
+                agent=self.agent,
+                name=self.check_agent(safety),
+                device=device,
+                options=safety_options,
+                precision=precision,
+            )
+
         self.environment = self.check_environment(environment)
-        self.environment = self.create_environment_by_name(environment)
+        self.environment = self.create_environment_by_name(
+            name=self.environment,
+            session_store=session_store,
+            options=environment_options,
+        )
         self.environment.start(self.agent)
 
     def check_agent(self, model) -> str:
@@ -49,13 +83,18 @@ class OpenChat(object):
 
         return env
 
-    def create_environment_by_name(self, name):
+    def create_environment_by_name(self, name, session_store=None, options=None):
+        options = options or {}
+
         if name == "interactive":
-            return InteractiveEnvironment()
-        elif name == "interactive_web":
-            return InteractiveWebEnvironment()
+            from openchat.envs.interactive import InteractiveEnvironment
+            return InteractiveEnvironment(session_store=session_store, **options)
         elif name == "webserver":
-            raise NotImplemented
+            from openchat.envs.webserver import WebServerEnvironment
+            return WebServerEnvironment(session_store=session_store, **options)
+        elif name == "workers":
+            from openchat.envs.workers import WorkerPoolEnvironment
+            return WorkerPoolEnvironment(**options)
         elif name == "facebook":
             raise NotImplemented
         elif name == "kakaotalk":
@@ -63,59 +102,38 @@ class OpenChat(object):
         elif name == "whatsapp":
             raise NotImplemented
 
-    def create_agent_by_name(self, name, device, maxlen):
-        agent_name = name.split(".")[0]
-
-        if agent_name == "blender":
-            return BlenderGenerationAgent(name, device, maxlen)
-        elif agent_name == "gptneo":
-            return GPTNeoAgent(name, device, maxlen)
-        elif agent_name == "dialogpt":
-            return DialoGPTAgent(name, device, maxlen)
-        elif agent_name == "dodecathlon":
-            return DodecathlonAgent(name, device, maxlen)
-        elif agent_name == "reddit":
-            return RedditAgent(name, device, maxlen)
-        elif agent_name == "unlikelihood":
-            return UnlikelihoodAgent(name, device, maxlen)
-        elif agent_name == "wizard_of_wikipedia":
-            return WizardOfWikipediaGenerationAgent(name, device, maxlen)
-        elif agent_name == "safety":
-            if name.split(".")[1] == "offensive":
-                return OffensiveAgent(name, device, maxlen)
-            elif name.split(".")[1] == "sensitive":
-                return SensitiveAgent(name, device, maxlen)
-            else:
-                return Exception("wrong model")
-        else:
-            return Exception("wrong model")
+    def create_agent_by_name(self, name, device, maxlen, precision="fp32"):
+        # only the backend of the selected model is imported,
+        # and weights already loaded in this process are reused.
+        return get_pool().acquire(name, device, maxlen, precision)
 
-    @staticmethod
-    def available_models():
-        agents = [
-            BlenderGenerationAgent,
-            DialoGPTAgent,
-            GPTNeoAgent,
-            DodecathlonAgent,
-            RedditAgent,
-            SensitiveAgent,
-            OffensiveAgent,
-            UnlikelihoodAgent,
-            WizardOfWikipediaGenerationAgent,
-        ]
+    def add_draft(self, agent, name, device, precision="fp32"):
+        spec, draft_spec = registry.get_model_spec(agent.name), registry.get_model_spec(name)
+
+        assert spec.has(registry.DECODER) and draft_spec.has(registry.DECODER), \
+            "speculative decoding is only available for huggingface decoder models"
+        assert draft_spec.family == spec.family and name != agent.name, \
+            f"param `draft` must be another model of [{spec.family.upper()}] family"
+
+        agent.set_draft(self.create_agent_by_name(name, device, -1, precision))
+        return agent
 
-        available_models = []
+    def add_safety_filter(self, agent, name, device, options=None, precision="fp32"):
+        from openchat.base.agents.safety import add_safety_filter
 
-        for agent in agents:
-            available_models += agent.available_models()
+        safety_agent = self.create_agent_by_name(name, device, -1, precision)
+        return add_safety_filter(agent, safety_agent, **(options or {}))
 
-        return available_models
+    @staticmethod
+    def available_models():
+        return registry.available_models()
 
     @staticmethod
     def available_environments():
         return [
             "interactive",
-            # "webserver",
+            "webserver",
+            "workers",
             # "facebook",
             # "kakaotalk",
             # "flask",
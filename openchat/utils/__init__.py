@@ -1,6 +1,23 @@
-from openchat.utils.class_utils import inherit, create_agent_from_opt_file_and_model_class
+import importlib
+
+# `class_utils` imports parlai, so it is imported on first access.
+_modules = {
+    "inherit": "openchat.utils.class_utils",
+    "create_agent_from_opt_file": "openchat.utils.class_utils",
+    "create_agent_from_opt_file_and_model_class": "openchat.utils.class_utils",
+}
 
 __all__ = [
-    inherit,
-    create_agent_from_opt_file_and_model_class,
+    "inherit",
+    "create_agent_from_opt_file",
+    "create_agent_from_opt_file_and_model_class",
 ]
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    value = getattr(importlib.import_module(_modules[name]), name)
+    globals()[name] = value
+    return value
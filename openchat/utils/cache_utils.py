@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+from collections import OrderedDict
+
+# files built once and reused by later runs (e.g. quantized checkpoints)
+CACHE_DIR = os.environ.get(
+    "OPENCHAT_CACHE",
+    os.path.join(os.path.expanduser("~"), ".cache", "openchat"),
+)
+
+
+def estimate_size(obj):
+    """
+    Roughly estimate the memory size of json like objects in bytes.
+    """
+
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(
+            estimate_size(k) + estimate_size(v) for k, v in obj.items())
+
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(estimate_size(v) for v in obj)
+
+    return sys.getsizeof(obj)
+
+
+class LRUCache(object):
+
+    def __init__(
+        self,
+        maxsize=128,
+        max_bytes=0,
+        ttl=0,
+        sizeof=estimate_size,
+        on_evict=None,
+    ):
+        """
+        Least recently used cache.
+
+        Args:
+            maxsize (int): maximum number of entries, unlimited if `maxsize <= 0`
+            max_bytes (int): maximum estimated size of entries, unlimited if `max_bytes <= 0`
+            ttl (float): seconds after the last access to expire entries, never if `ttl <= 0`
+            sizeof (callable): function to estimate size of a value
+            on_evict (callable): called with (key, value) when an entry is evicted or expired
+        """
+
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.accessed = {}
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        self.expire()
+
+        if key not in self.entries:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self.touch(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.touch(key)
+        self.resize(key)
+
+    def touch(self, key):
+        self.entries.move_to_end(key)
+        self.accessed[key] = time.time()
+
+    def resize(self, key):
+        """
+        Estimate size of the entry again. call this after modifying the value in place.
+        """
+
+        if self.max_bytes > 0 and key in self.entries:
+            size = self.sizeof(self.entries[key])
+            self.num_bytes += size - self.sizes.get(key, 0)
+            self.sizes[key] = size
+
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        while len(self.entries) > 0 and (
+                0 < self.maxsize < len(self.entries) or
+                0 < self.max_bytes < self.num_bytes):
+            key = next(iter(self.entries))
+
+            if key == keep:
+                # never evict the entry which is being used now
+                break
+
+            self.remove(key)
+            self.evictions += 1
+
+    def expire(self):
+        if self.ttl <= 0:
+            return
+
+        deadline = time.time() - self.ttl
+
+        while len(self.entries) > 0:
+            key = next(iter(self.entries))
+
+            if self.accessed[key] > deadline:
+                break
+
+            self.remove(key)
+            self.evictions += 1
+
+    def remove(self, key):
+        if self.on_evict is not None:
+            self.on_evict(key, self.entries[key])
+
+        self.pop(key)
+
+    def pop(self, key, default=None):
+        self.accessed.pop(key, None)
+        self.num_bytes -= self.sizes.pop(key, 0)
+        return self.entries.pop(key, default)
+
+    def clear(self):
+        self.entries.clear()
+        self.sizes.clear()
+        self.accessed.clear()
+        self.num_bytes = 0
+
+    def stats(self):
+        return {
+            "size": len(self.entries),
+            "bytes": self.num_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def keys(self):
+        return list(self.entries.keys())
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def __len__(self):
+        return len(self.entries)
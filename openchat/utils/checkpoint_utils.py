@@ -0,0 +1,260 @@
+import argparse
+import json
+import mmap
+import os
+import struct
+import threading
+from contextlib import contextmanager
+from functools import wraps
+
+import torch
+
+MMAP_SUFFIX = ".mmap"
+ALIGNMENT = 64
+
+# `torch.nn.init` functions used by modules to initialize their weights
+INIT_FUNCTIONS = [
+    "uniform_",
+    "normal_",
+    "trunc_normal_",
+    "constant_",
+    "ones_",
+    "zeros_",
+    "xavier_uniform_",
+    "xavier_normal_",
+    "kaiming_uniform_",
+    "kaiming_normal_",
+    "orthogonal_",
+]
+
+# threads building a model inside `skip_init_weights`
+_skip_init = threading.local()
+_skip_init_lock = threading.Lock()
+_skip_init_state = {"users": 0, "originals": {}}
+
+
+def mmap_checkpoint_path(model_file):
+    return model_file + MMAP_SUFFIX
+
+
+def save_mmap_checkpoint(state_dict, path):
+    """
+    Save a state dict as a flat file which can be memory mapped.
+    the file is an 8 byte header length, a json header {name: {dtype, shape, offset}}
+    and raw tensor bytes aligned to 64 bytes.
+
+    Args:
+        state_dict (Dict[str, torch.Tensor]): tensors to save
+        path (str): path of the flat file
+    """
+
+    header, tensors, offset = {}, [], 0
+
+    for name, tensor in state_dict.items():
+        tensor = tensor.detach().cpu().contiguous()
+        num_bytes = tensor.numel() * tensor.element_size()
+        offset = (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+        header[name] = {
+            "dtype": str(tensor.dtype).replace("torch.", ""),
+            "shape": list(tensor.shape),
+            "offset": offset,
+        }
+
+        tensors.append((offset, tensor))
+        offset += num_bytes
+
+    header = json.dumps(header).encode("utf-8")
+    # tensor offsets are relative to the aligned start of the data section
+    start = (8 + len(header) + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+    header += b" " * (start - 8 - len(header))
+
+    with open(path + ".tmp", "wb") as f:
+        f.write(struct.pack("<Q", len(header)))
+        f.write(header)
+
+        for offset, tensor in tensors:
+            f.seek(start + offset)
+
+            if tensor.numel() > 0:
+                f.write(tensor.reshape(-1).view(torch.uint8).numpy().tobytes())
+
+    os.replace(path + ".tmp", path)
+
+
+def load_mmap_checkpoint(path):
+    """
+    Memory map a flat file saved by `save_mmap_checkpoint`.
+    tensors share pages with the page cache until they are written.
+
+    Args:
+        path (str): path of the flat file
+
+    Returns:
+        (Dict[str, torch.Tensor]): state dict
+    """
+
+    with open(path, "rb") as f:
+        length = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(length).decode("utf-8"))
+        # copy-on-write mapping, so in-place updates never reach the file
+        buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    start = 8 + length
+    state_dict = {}
+
+    for name, info in header.items():
+        dtype = getattr(torch, info["dtype"])
+        numel = 1
+
+        for size in info["shape"]:
+            numel *= size
+
+        if numel == 0:
+            tensor = torch.empty(info["shape"], dtype=dtype)
+        else:
+            tensor = torch.frombuffer(
+                buffer,
+                dtype=dtype,
+                count=numel,
+                offset=start + info["offset"],
+            ).view(info["shape"])
+
+        state_dict[name] = tensor
+
+    return state_dict
+
+
+def assign_state_dict(module, state_dict):
+    """
+    Replace parameters and buffers of the module with tensors of the state dict
+    instead of copying them into the memory allocated by the module.
+
+    Returns:
+        (bool): False if the state dict doesn't match the module, then nothing is changed.
+    """
+
+    tensors = dict(module.named_parameters())
+    tensors.update(dict(module.named_buffers()))
+
+    for name, tensor in tensors.items():
+        if name not in state_dict or state_dict[name].shape != tensor.shape:
+            return False
+
+    for name, tensor in tensors.items():
+        # `to()` returns the tensor itself if the dtype and device are the same,
+        # so a flat file of the dtype of the module is used without a copy.
+        tensor.data = state_dict[name].to(device=tensor.device, dtype=tensor.dtype)
+
+    return True
+
+
+def _skippable(function):
+    @wraps(function)
+    def init(tensor, *args, **kwargs):
+        if getattr(_skip_init, "depth", 0) > 0:
+            return tensor
+
+        return function(tensor, *args, **kwargs)
+
+    return init
+
+
+@contextmanager
+def skip_init_weights():
+    """
+    Skip random initialization of weights which will be replaced by a checkpoint.
+    `torch.nn.init` functions skip it only in the calling thread,
+    so models built by other threads at the same time are initialized as usual.
+    """
+
+    with _skip_init_lock:
+        if _skip_init_state["users"] == 0:
+            for name in INIT_FUNCTIONS:
+                if hasattr(torch.nn.init, name):
+                    function = getattr(torch.nn.init, name)
+                    _skip_init_state["originals"][name] = function
+                    setattr(torch.nn.init, name, _skippable(function))
+
+        _skip_init_state["users"] += 1
+
+    _skip_init.depth = getattr(_skip_init, "depth", 0) + 1
+
+    try:
+        yield
+    finally:
+        _skip_init.depth -= 1
+
+        with _skip_init_lock:
+            _skip_init_state["users"] -= 1
+
+            if _skip_init_state["users"] == 0:
+                for name, function in _skip_init_state["originals"].items():
+                    setattr(torch.nn.init, name, function)
+
+                _skip_init_state["originals"].clear()
+
+
+def convert_checkpoint(model_file, dtype=torch.float32):
+    """
+    Convert a parlai checkpoint to a flat file next to it.
+    agents load the flat file instead of the checkpoint once it exists.
+    zoo checkpoints are saved in fp16, but parlai models run in fp32 on cpu,
+    so weights are saved in the dtype of the model and loading doesn't copy them.
+
+    Args:
+        model_file (str): path of the parlai checkpoint
+        dtype (torch.dtype): dtype of the floating point weights of the model
+
+    Returns:
+        (str): path of the flat file
+    """
+
+    states = torch.load(model_file, map_location="cpu")
+    state_dict = {
+        name: tensor.to(dtype) if tensor.is_floating_point() else tensor
+        for name, tensor in states["model"].items()
+    }
+
+    path = mmap_checkpoint_path(model_file)
+    save_mmap_checkpoint(state_dict, path)
+    return path
+
+
+def main():
+    from parlai.core.agents import add_datapath_and_model_args
+    from parlai.core.build_data import modelzoo_path
+    from openchat.agents.registry import get_model_spec
+
+    parser = argparse.ArgumentParser(
+        description="convert parlai checkpoints to memory mappable flat files.")
+    parser.add_argument(
+        "models",
+        nargs="+",
+        help="model names (e.g. blender.xlarge) or paths of checkpoints",
+    )
+    parser.add_argument(
+        "--dtype",
+        default="float32",
+        choices=["float32", "float16", "bfloat16"],
+        help="dtype the models run in (float16 with `--fp16` on gpu)",
+    )
+    args = parser.parse_args()
+
+    for model in args.models:
+        if os.path.exists(model):
+            model_file = model
+        else:
+            option = {}
+            add_datapath_and_model_args(option)
+            model_file = modelzoo_path(
+                option.get("datapath"),
+                get_model_spec(model).checkpoint,
+            )
+
+        path = convert_checkpoint(model_file, dtype=getattr(torch, args.dtype))
+        print(f"[SYSTEM]: {model} -> {path}")
+
+
+if __name__ == '__main__':
+    main()
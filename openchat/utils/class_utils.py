@@ -1,14 +1,62 @@
 import logging
+import os
 from parlai.core.agents import NOCOPY_ARGS, compare_init_model_opts
+from parlai.core.loader import load_agent_module
 from parlai.core.opt import Opt
 from parlai.utils.io import PathManager
 from parlai.utils.misc import warn_once
+from openchat.utils.checkpoint_utils import (
+    mmap_checkpoint_path,
+    load_mmap_checkpoint,
+    assign_state_dict,
+    skip_init_weights,
+)
+
+_mmap_classes = {}
 
 
 def inherit(obj, superclasses):
     obj.__class__ = type(obj.__class__.__name__, superclasses, dict())
 
 
+def mmap_model_class(model_class):
+    """
+    Make a subclass of the parlai agent which loads weights from a memory mapped flat file.
+    """
+
+    if model_class not in _mmap_classes:
+        def load(self, path):
+            flat_file = mmap_checkpoint_path(path)
+
+            if not os.path.exists(flat_file):
+                return model_class.load(self, path)
+
+            state_dict = load_mmap_checkpoint(flat_file)
+
+            if not assign_state_dict(self.model, state_dict):
+                self.load_state_dict(state_dict)
+
+            return {}
+
+        _mmap_classes[model_class] = type(
+            model_class.__name__,
+            (model_class,),
+            {"load": load},
+        )
+
+    return _mmap_classes[model_class]
+
+
+def create_agent_from_opt_file(opt):
+    optfile = opt['model_file'] + '.opt'
+
+    if not PathManager.exists(optfile):
+        return None
+
+    model_class = load_agent_module(Opt.load(optfile)['model'])
+    return create_agent_from_opt_file_and_model_class(opt, model_class)
+
+
 def create_agent_from_opt_file_and_model_class(opt, model_class):
     model_file = opt['model_file']
     optfile = model_file + '.opt'
@@ -66,4 +114,11 @@ def create_agent_from_opt_file_and_model_class(opt, model_class):
     # if we want to load weights from --init-model, compare opts with
     # loaded ones
     compare_init_model_opts(opt, opt_from_file)
+
+    if PathManager.exists(mmap_checkpoint_path(model_file)):
+        # weights are replaced by the memory mapped checkpoint,
+        # so random initialization is skipped.
+        with skip_init_weights():
+            return mmap_model_class(model_class)(opt_from_file)
+
     return model_class(opt_from_file)
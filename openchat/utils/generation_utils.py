@@ -0,0 +1,346 @@
+from functools import lru_cache
+
+import torch
+
+from transformers import (
+    LogitsProcessorList,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+)
+
+
+def slice_past(past, length):
+    """
+    Cut cached key/values to the first `length` positions.
+    every cached tensor keeps sequence positions in dimension -2.
+    """
+
+    if isinstance(past, torch.Tensor):
+        return past[..., :length, :]
+
+    return tuple(slice_past(p, length) for p in past)
+
+
+def common_prefix_length(a, b):
+    length = 0
+
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+
+    return length
+
+
+class PaddedRepetitionPenaltyLogitsProcessor(RepetitionPenaltyLogitsProcessor):
+    """
+    Repetition penalty which ignores the left padding of decoder only prompts.
+    padding is the eos token, which would be penalized in padded rows only,
+    so it is replaced by the last prompt token of the row, which is penalized anyway.
+    """
+
+    def __init__(self, penalty, attention_mask):
+        super().__init__(penalty)
+        self.padding = attention_mask == 0
+
+    def __call__(self, input_ids, scores):
+        # rows are repeated for each beam
+        padding = self.padding.repeat_interleave(input_ids.size(0) // self.padding.size(0), dim=0)
+        prompt = input_ids[:, :padding.size(-1)]
+        prompt = torch.where(padding, prompt[:, -1:], prompt)
+        input_ids = torch.cat([prompt, input_ids[:, padding.size(-1):]], dim=-1)
+        return super().__call__(input_ids, scores)
+
+
+def repetition_penalty_kwargs(penalty, attention_mask):
+    """
+    `generate` kwargs of the repetition penalty for a left padded batch of decoder only prompts.
+    """
+
+    if bool(attention_mask.all()):
+        return {"repetition_penalty": penalty}
+
+    return {
+        "logits_processor": LogitsProcessorList([
+            PaddedRepetitionPenaltyLogitsProcessor(penalty, attention_mask),
+        ]),
+    }
+
+
+def make_logits_processor(
+    method,
+    top_k=None,
+    top_p=None,
+    no_repeat_ngram_size=0,
+    repetition_penalty=1.0,
+):
+    processors = LogitsProcessorList()
+
+    if repetition_penalty is not None and repetition_penalty != 1.0:
+        processors.append(RepetitionPenaltyLogitsProcessor(repetition_penalty))
+
+    if no_repeat_ngram_size is not None and no_repeat_ngram_size > 0:
+        processors.append(NoRepeatNGramLogitsProcessor(no_repeat_ngram_size))
+
+    if method == "top_k" and top_k is not None and top_k > 0:
+        processors.append(TopKLogitsWarper(top_k))
+
+    if method == "nucleus" and top_p is not None and top_p < 1.0:
+        processors.append(TopPLogitsWarper(top_p))
+
+    return processors
+
+
+def select_next_tokens(scores, method):
+    if method == "greedy":
+        return scores.argmax(dim=-1)
+
+    probs = torch.softmax(scores, dim=-1)
+    return torch.multinomial(probs, num_samples=1).squeeze(1)
+
+
+@lru_cache(maxsize=None)
+def newline_token_ids(tokenizer):
+    """
+    Ids of every token whose text contains a newline.
+    byte level BPE merges newlines into several tokens (e.g. '\\n\\n'), so the vocab is scanned once.
+    """
+
+    return frozenset(
+        index for token, index in tokenizer.get_vocab().items()
+        if "\n" in tokenizer.convert_tokens_to_string([token])
+    )
+
+
+def stop_token_ids(tokenizer, stop_strings):
+    """
+    Token ids of the stop strings, with and without a leading space,
+    because BPE tokenizes a word differently at the start of a text.
+    """
+
+    stop_ids = set()
+
+    for stop_string in stop_strings:
+        for text in [stop_string, " " + stop_string]:
+            ids = tokenizer(text, add_special_tokens=False)["input_ids"]
+
+            if len(ids) > 0:
+                stop_ids.add(tuple(ids))
+
+    return sorted(stop_ids, key=len)
+
+
+def make_stop_fn(stop_ids, newline_ids, eos_token_id, vocab_size, prompt_length, device):
+    """
+    `prefix_allowed_tokens_fn` of `generate` which allows only the eos token
+    once a sequence ends with a stop sequence or a newline token.
+    the sequence (or beam hypothesis) is finished at the next step, while the others keep going.
+    """
+
+    all_ids = torch.arange(vocab_size, device=device)
+    eos_ids = [eos_token_id]
+    window = max([len(ids) for ids in stop_ids] + [1])
+
+    def allowed_tokens(batch_id, input_ids):
+        generated = input_ids[prompt_length:][-window:].tolist()
+
+        # finished sequences are padded with any token, forcing eos there could mask every token.
+        if len(generated) == 0 or generated[-1] == eos_token_id:
+            return all_ids
+
+        if generated[-1] in newline_ids:
+            return eos_ids
+
+        for ids in stop_ids:
+            if tuple(generated[-len(ids):]) == ids:
+                return eos_ids
+
+        return all_ids
+
+    return allowed_tokens
+
+
+def make_length_fn(max_new_tokens, eos_token_id, vocab_size, prompt_length, device):
+    """
+    `prefix_allowed_tokens_fn` of `generate` which allows only the eos token
+    once a sequence has generated `max_new_tokens[batch_id]` tokens.
+    rows of a left padded batch share one prompt length, so `max_length` can't limit each of them.
+    """
+
+    all_ids = torch.arange(vocab_size, device=device)
+    eos_ids = [eos_token_id]
+
+    def allowed_tokens(batch_id, input_ids):
+        num_generated = input_ids.size(-1) - prompt_length
+
+        # finished sequences are padded with any token, forcing eos there could mask every token.
+        if num_generated > 0 and input_ids[-1].item() == eos_token_id:
+            return all_ids
+
+        if num_generated >= max_new_tokens[batch_id]:
+            return eos_ids
+
+        return all_ids
+
+    return allowed_tokens
+
+
+def count_generated_tokens(output_ids, prompt_length, eos_token_id):
+    """
+    Number of tokens generated before the first eos token of each sequence.
+    """
+
+    generated = output_ids[:, prompt_length:]
+    is_eos = (generated == eos_token_id).long()
+    # the eos token itself is generated, padding after it is not.
+    first_eos = torch.where(
+        is_eos.any(dim=-1),
+        is_eos.argmax(dim=-1) + 1,
+        torch.full_like(is_eos[:, 0], generated.size(-1)),
+    )
+    return first_eos.tolist()
+
+
+def legacy_past(past):
+    # newer transformers return cache objects instead of tuples of key/values
+    if hasattr(past, "to_legacy_cache"):
+        return past.to_legacy_cache()
+
+    return past
+
+
+def pad_past(past, length):
+    """
+    Left pad cached key/values with zeros to `length` positions.
+    """
+
+    if isinstance(past, torch.Tensor):
+        shape = list(past.shape)
+
+        if shape[-2] >= length:
+            return past
+
+        shape[-2] = length - shape[-2]
+        return torch.cat([past.new_zeros(shape), past], dim=-2)
+
+    return tuple(pad_past(p, length) for p in past)
+
+
+def concat_past(pasts):
+    """
+    Concatenate cached key/values of several batches (of the same length) along the batch dimension.
+    """
+
+    if isinstance(pasts[0], torch.Tensor):
+        return torch.cat(pasts, dim=0)
+
+    return tuple(concat_past(ps) for ps in zip(*pasts))
+
+
+def select_past(past, index, start=0):
+    """
+    Keep rows `index` of cached key/values, and drop the positions before `start`.
+    """
+
+    if isinstance(past, torch.Tensor):
+        return past.index_select(0, index)[..., start:, :]
+
+    return tuple(select_past(p, index, start) for p in past)
+
+
+@torch.no_grad()
+def speculative_greedy(
+    model,
+    draft_model,
+    input_ids,
+    max_new_tokens,
+    eos_token_id,
+    logits_processor,
+    num_draft_tokens=4,
+    stats=None,
+    device="cpu",
+):
+    """
+    Greedy decoding where a small draft model proposes `num_draft_tokens` tokens
+    and the model verifies all of them in one forward pass.
+    the proposed tokens are kept up to the first one the model wouldn't choose,
+    and the choice of the model is taken there, so outputs are the same as greedy decoding of the model.
+
+    Args:
+        model (PreTrainedModel): decoder only model
+        draft_model (PreTrainedModel): smaller decoder only model with the same tokenizer
+        input_ids (List[int]): token ids of the input
+        max_new_tokens (int): maximum number of generated tokens
+        eos_token_id (int): id of the end of text token
+        logits_processor (LogitsProcessorList): processors applied before the argmax
+        num_draft_tokens (int): number of tokens proposed at once
+        stats (dict): counters of rounds, drafted and accepted tokens, updated in place
+
+    Yields:
+        (int): generated token id, the end of text token is not yielded
+    """
+
+    def forward(m, ids, past, num_cached):
+        outputs = m(
+            input_ids=torch.tensor([ids[num_cached:]], device=device),
+            past_key_values=past,
+            use_cache=True,
+        )
+        return outputs.logits[0], legacy_past(outputs.past_key_values)
+
+    def choose(ids, logits):
+        context = torch.tensor([ids], device=device)
+        return logits_processor(context, logits[None]).argmax(dim=-1).item()
+
+    ids = list(input_ids)
+    num_generated = 0
+    past, num_cached = None, 0
+    draft_past, draft_num_cached = None, 0
+
+    while num_generated < max_new_tokens:
+        draft = []
+
+        for _ in range(min(num_draft_tokens, max_new_tokens - num_generated)):
+            logits, draft_past = forward(draft_model, ids + draft, draft_past, draft_num_cached)
+            draft_num_cached = len(ids) + len(draft)
+            draft.append(choose(ids + draft, logits[-1]))
+
+            if draft[-1] == eos_token_id:
+                break
+
+        logits, past = forward(model, ids + draft, past, num_cached)
+        # row of the logits predicting the first new token
+        offset = len(ids) - num_cached - 1
+        accepted = []
+
+        for i in range(len(draft) + 1):
+            accepted.append(choose(ids + draft[:i], logits[offset + i]))
+
+            if i == len(draft) or accepted[-1] != draft[i] or accepted[-1] == eos_token_id:
+                break
+
+        num_matched = sum(a == d for a, d in zip(accepted, draft))
+
+        if stats is not None:
+            stats["rounds"] += 1
+            stats["drafted"] += len(draft)
+            stats["accepted"] += num_matched
+
+        # key/values of rejected tokens are dropped
+        num_cached = len(ids) + num_matched
+        past = slice_past(past, num_cached)
+        draft_num_cached = min(draft_num_cached, num_cached)
+        draft_past = slice_past(draft_past, draft_num_cached)
+
+        for token in accepted:
+            if token == eos_token_id:
+                return
+
+            ids.append(token)
+            num_generated += 1
+            yield token
+
+            if num_generated >= max_new_tokens:
+                return
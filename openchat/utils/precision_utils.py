@@ -0,0 +1,145 @@
+import os
+
+import torch
+
+from openchat.utils.cache_utils import CACHE_DIR
+
+PRECISIONS = ["fp32", "bf16", "int8"]
+
+
+def check_precision(precision, device="cpu"):
+    precision = precision.lower()
+
+    assert precision in PRECISIONS, \
+        f"param `precision` must be one of {PRECISIONS}"
+
+    assert precision != "int8" or "cuda" not in device, \
+        "dynamic int8 quantization is only available on cpu."
+
+    return precision
+
+
+def module_owners(agent):
+    """
+    Find (owner, attribute) of torch modules held by an agent.
+    huggingface agents hold the module as `model`, parlai agents as `model.model`.
+    """
+
+    owners, modules = [], []
+
+    for key, value in vars(agent).items():
+        if isinstance(value, torch.nn.Module):
+            owner, attribute = agent, key
+        elif isinstance(getattr(value, "model", None), torch.nn.Module):
+            owner, attribute = value, "model"
+        else:
+            continue
+
+        # the same module can be held by several attributes (e.g. `agent` and `model`)
+        if all(getattr(owner, attribute) is not m for m in modules):
+            owners.append((owner, attribute))
+            modules.append(getattr(owner, attribute))
+
+    return owners
+
+
+def conv1d_to_linear(module):
+    """
+    Replace GPT2 `Conv1D` layers by equivalent `nn.Linear` layers,
+    because dynamic quantization only quantizes `nn.Linear`.
+    """
+
+    for name, child in module.named_children():
+        if type(child).__name__ == "Conv1D":
+            # Conv1D keeps the weight as (in_features, out_features)
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features)
+            linear.weight.data = child.weight.data.t().contiguous()
+            linear.bias.data = child.bias.data
+            setattr(module, name, linear)
+        else:
+            conv1d_to_linear(child)
+
+    return module
+
+
+def convert_module(module, precision):
+    """
+    Convert an eval mode module to the precision.
+
+    Args:
+        module (torch.nn.Module): fp32 module
+        precision (str): one of ["fp32", "bf16", "int8"]
+
+    Returns:
+        (torch.nn.Module): converted module
+    """
+
+    if precision == "bf16":
+        return module.to(torch.bfloat16)
+
+    if precision == "int8":
+        return torch.quantization.quantize_dynamic(
+            conv1d_to_linear(module),
+            {torch.nn.Linear},
+            dtype=torch.qint8,
+        )
+
+    return module
+
+
+def quantized_checkpoint_path(name, precision, index=0, cache_dir=CACHE_DIR):
+    return os.path.join(
+        cache_dir,
+        "quantized",
+        f"{name}.{precision}.{index}.torch-{torch.__version__}.pt",
+    )
+
+
+def load_module(path):
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:
+        # torch < 1.13 has no `weights_only`
+        return torch.load(path, map_location="cpu")
+
+
+def save_module(module, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    torch.save(module, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+
+def set_precision(agent, precision, cache=True, cache_dir=CACHE_DIR):
+    """
+    Convert the weights of a loaded agent to the precision.
+    quantized modules are cached on disk, so quantization runs only once for each model.
+
+    Args:
+        agent (BaseAgent): agent with fp32 weights
+        precision (str): one of ["fp32", "bf16", "int8"]
+        cache (bool): load and save quantized modules in `cache_dir`
+        cache_dir (str): directory of the cache
+
+    Returns:
+        (BaseAgent): the agent with converted weights
+    """
+
+    precision = check_precision(precision, agent.device)
+
+    for index, (owner, attribute) in enumerate(module_owners(agent)):
+        module = getattr(owner, attribute)
+        path = quantized_checkpoint_path(agent.name, precision, index, cache_dir)
+
+        if precision == "int8" and cache and os.path.exists(path):
+            converted = load_module(path)
+        else:
+            converted = convert_module(module, precision)
+
+            if precision == "int8" and cache:
+                save_module(converted, path)
+
+        setattr(owner, attribute, converted.eval())
+
+    agent.precision = precision
+    return agent
@@ -0,0 +1,220 @@
+import bisect
+import difflib
+import random
+import re
+from typing import List, Tuple
+
+
+def split_tokenize(text):
+    """
+    Same tokenization as `DictionaryAgent.split_tokenize` of parlai,
+    which `OffensiveStringMatcher` uses for both phrases and texts.
+    """
+
+    return (
+        text.replace('.', ' . ')
+        .replace(',', ' , ')
+        .replace(';', ' ; ')
+        .replace(':', ' : ')
+        .replace('!', ' ! ')
+        .replace('?', ' ? ')
+        .split()
+    )
+
+
+# tokens of `split_tokenize`: a punctuation mark or a run of other non space characters
+SPLIT_TOKEN_PATTERN = re.compile(r"[.,;:!?]|[^\s.,;:!?]+")
+
+
+def split_tokenize_spans(text):
+    """
+    Tokens of `split_tokenize` with their (start, end) character offsets in the text.
+    """
+
+    return [(m.group(), m.start(), m.end()) for m in SPLIT_TOKEN_PATTERN.finditer(text)]
+
+
+class PhraseMatcher(object):
+
+    END = "__END__"
+
+    def __init__(self, phrases: List[str]):
+        """
+        Token trie of words and phrases with the matching rules of parlai's `OffensiveStringMatcher`:
+        texts are lowered and split into tokens, and a phrase matches a run of whole tokens.
+        texts with no token starting a phrase are rejected by one set operation,
+        so most texts never walk the trie.
+
+        Args:
+            phrases (List[str]): words or phrases to find
+        """
+
+        self.trie = {}
+        self.max_len = 1
+
+        for phrase in phrases:
+            self.add_phrase(phrase)
+
+    def add_phrase(self, phrase):
+        tokens = split_tokenize(phrase)
+
+        if len(tokens) == 0:
+            return
+
+        node = self.trie
+
+        for token in tokens:
+            node = node.setdefault(token, {})
+
+        node[self.END] = True
+        self.max_len = max(self.max_len, len(tokens))
+
+    def match_at(self, tokens, index):
+        """
+        Returns:
+            (int): end index of the shortest phrase starting at `tokens[index]`, None if there is no phrase
+        """
+
+        node = self.trie
+
+        for i in range(index, min(index + self.max_len, len(tokens))):
+            node = node.get(tokens[i])
+
+            if node is None:
+                return None
+
+            if self.END in node:
+                return i + 1
+
+        return None
+
+    def find(self, text, first_only=False) -> List[Tuple[int, int, str]]:
+        """
+        Find phrases in the text.
+
+        Args:
+            text (str): text to scan
+            first_only (bool): stop at the first match
+
+        Returns:
+            (List[Tuple[int, int, str]]): (start, end, phrase) at every token where a phrase starts,
+                start and end are character offsets of the match in the text.
+        """
+
+        if not text:
+            return []
+
+        if self.trie.keys().isdisjoint(split_tokenize(text.lower())):
+            return []
+
+        spans = split_tokenize_spans(text)
+        tokens = [token.lower() for token, _, _ in spans]
+        matches = []
+
+        for i, token in enumerate(tokens):
+            if token in self.trie:
+                end = self.match_at(tokens, i)
+
+                if end is not None:
+                    matches.append((spans[i][1], spans[end - 1][2], " ".join(tokens[i:end])))
+
+                    if first_only:
+                        break
+
+        return matches
+
+    def find_batch(self, texts: List[str]) -> List[List[Tuple[int, int, str]]]:
+        return [self.find(text) for text in texts]
+
+    def contains_batch(self, texts: List[str]) -> List[bool]:
+        return [text in self for text in texts]
+
+    def __contains__(self, text):
+        return len(self.find(text, first_only=True)) > 0
+
+
+def trie_phrases(trie, prefix=()):
+    """
+    Collect phrases of a word trie like `OffensiveStringMatcher.offensive_trie`.
+    children are dicts and any other value marks the end of a phrase.
+    """
+
+    phrases = []
+
+    for word, child in trie.items():
+        if isinstance(child, dict):
+            phrases += trie_phrases(child, prefix + (word,))
+        elif len(prefix) > 0:
+            phrases.append(" ".join(prefix))
+
+    return phrases
+
+
+class TopicIndex(object):
+
+    def __init__(self, topics: List[str]):
+        """
+        Immutable index of topics for membership checks, prefix completion and fuzzy suggestions.
+
+        Args:
+            topics (List[str]): topics
+        """
+
+        self.topics = tuple(sorted(set(topics)))
+        self.topic_set = frozenset(self.topics)
+        lowered = sorted((topic.lower(), topic) for topic in self.topics)
+        self.lowered_keys = [key for key, _ in lowered]
+        self.lowered_topics = [topic for _, topic in lowered]
+
+    def __contains__(self, topic):
+        return topic in self.topic_set
+
+    def __len__(self):
+        return len(self.topics)
+
+    def __iter__(self):
+        return iter(self.topics)
+
+    def complete(self, prefix, n=4):
+        """
+        Topics starting with the prefix, case insensitive.
+        """
+
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.lowered_keys, prefix)
+        topics = []
+
+        for i in range(start, len(self.lowered_keys)):
+            if len(topics) >= n or not self.lowered_keys[i].startswith(prefix):
+                break
+
+            topics.append(self.lowered_topics[i])
+
+        return topics
+
+    def suggest(self, text, n=4, cutoff=0.6):
+        """
+        Topics completing the text, then topics similar to the text.
+        """
+
+        topics = self.complete(text, n)
+
+        if len(topics) < n:
+            for key in difflib.get_close_matches(
+                    text.lower(),
+                    self.lowered_keys,
+                    n=n,
+                    cutoff=cutoff,
+            ):
+                topic = self.lowered_topics[bisect.bisect_left(self.lowered_keys, key)]
+
+                if topic not in topics:
+                    topics.append(topic)
+
+        return topics[:n]
+
+    def sample(self, n=4):
+        return random.sample(self.topics, min(n, len(self.topics)))
+
+    def choice(self):
+        return random.choice(self.topics)
@@ -0,0 +1,200 @@
+import json
+import threading
+import time
+from collections import deque
+
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_sinks = []
+
+
+class NullSpan(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = NullSpan()
+
+
+class Span(object):
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        seconds = time.perf_counter() - self.start
+
+        for sink in _sinks:
+            sink.record(self.name, seconds, self.labels)
+
+        return False
+
+
+def span(name, **labels):
+    """
+    Time a block of code.
+
+    Examples:
+        >>> with span("hf.generate", model="dialogpt.small"):
+        ...     model.generate(...)
+
+    Args:
+        name (str): name of the stage
+        labels: labels of the measurement (e.g. model name)
+
+    Returns:
+        context manager which does nothing if instrumentation is disabled
+    """
+
+    if len(_sinks) == 0:
+        return _null_span
+
+    return Span(name, labels)
+
+
+def enable(*sinks):
+    """
+    Send spans to the sinks. spans cost nothing until a sink is enabled.
+    """
+
+    for sink in sinks:
+        if sink not in _sinks:
+            _sinks.append(sink)
+
+
+def disable(*sinks):
+    """
+    Stop sending spans to the sinks, or to every sink if no sink is given.
+    """
+
+    for sink in sinks or list(_sinks):
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+def enabled_sinks():
+    return list(_sinks)
+
+
+class HistogramSink(object):
+
+    def __init__(self, buckets=BUCKETS, max_samples=1000):
+        """
+        In-memory histograms of span durations per (name, labels).
+
+        Args:
+            buckets (Tuple[float]): upper bounds of histogram buckets in seconds
+            max_samples (int): number of recent durations kept for percentiles
+        """
+
+        self.buckets = tuple(sorted(buckets))
+        self.max_samples = max_samples
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            if key not in self.histograms:
+                self.histograms[key] = {
+                    "counts": [0] * (len(self.buckets) + 1),
+                    "count": 0,
+                    "sum": 0.0,
+                    "samples": deque(maxlen=self.max_samples),
+                }
+
+            histogram = self.histograms[key]
+            index = 0
+
+            while index < len(self.buckets) and seconds > self.buckets[index]:
+                index += 1
+
+            histogram["counts"][index] += 1
+            histogram["count"] += 1
+            histogram["sum"] += seconds
+            histogram["samples"].append(seconds)
+
+    def stats(self):
+        """
+        Returns:
+            (Dict[str, dict]): count, total, mean, p50 and p99 seconds per span
+        """
+
+        stats = {}
+
+        with self.lock:
+            for (name, labels), histogram in self.histograms.items():
+                samples = sorted(histogram["samples"])
+                label = ",".join(f"{k}={v}" for k, v in labels)
+                stats[f"{name}{{{label}}}" if label else name] = {
+                    "count": histogram["count"],
+                    "total": histogram["sum"],
+                    "mean": histogram["sum"] / histogram["count"],
+                    "p50": samples[int(len(samples) * 0.50)],
+                    "p99": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+                }
+
+        return stats
+
+    def prometheus(self, metric="openchat_span_seconds"):
+        """
+        Render the histograms in the prometheus text exposition format.
+        """
+
+        lines = [f"# TYPE {metric} histogram"]
+
+        with self.lock:
+            for (name, labels), histogram in sorted(self.histograms.items()):
+                label = "".join(f',{k}="{v}"' for k, v in labels)
+                label = f'span="{name}"{label}'
+                cumulative = 0
+
+                for bound, count in zip(self.buckets + (float("inf"),), histogram["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+
+                lines.append(f"{metric}_sum{{{label}}} {histogram['sum']}")
+                lines.append(f"{metric}_count{{{label}}} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+class JsonLinesSink(object):
+
+    def __init__(self, path):
+        """
+        Append every span as a json line {"span", "seconds", "time", **labels}.
+
+        Args:
+            path (str): path of the file
+        """
+
+        self.file = open(path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+
+    def record(self, name, seconds, labels):
+        line = json.dumps({"span": name, "seconds": seconds, "time": time.time(), **labels})
+
+        with self.lock:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
@@ -17,8 +17,8 @@ setup(
         'torch',
         "parlai",
     ],
-    packages=find_packages(),
-    python_requires='>=3',
+    packages=find_packages(exclude=['tests', 'benchmarks']),
+    python_requires='>=3.7',
     package_data={},
     zip_safe=False,
     classifiers=[
@@ -0,0 +1,60 @@
+import importlib.util
+import os
+import tempfile
+import threading
+import unittest
+
+HAS_TORCH = importlib.util.find_spec("torch") is not None
+
+
+@unittest.skipUnless(HAS_TORCH, "requires torch")
+class CheckpointUtilsTester(unittest.TestCase):
+
+    def test_convert_to_runtime_dtype(self):
+        import torch
+        from openchat.utils.checkpoint_utils import (
+            convert_checkpoint,
+            load_mmap_checkpoint,
+            assign_state_dict,
+        )
+
+        torch.manual_seed(0)
+        module = torch.nn.Linear(8, 4)
+        # zoo checkpoints are saved in fp16
+        states = {"model": {k: v.half() for k, v in module.state_dict().items()}}
+
+        with tempfile.TemporaryDirectory() as directory:
+            model_file = os.path.join(directory, "model")
+            torch.save(states, model_file)
+            state_dict = load_mmap_checkpoint(convert_checkpoint(model_file))
+
+            self.assertEqual(state_dict["weight"].dtype, torch.float32)
+            self.assertTrue(assign_state_dict(module, state_dict))
+            # the module uses the memory mapped tensors without a copy
+            self.assertEqual(module.weight.data_ptr(), state_dict["weight"].data_ptr())
+            self.assertTrue(torch.equal(module.weight, states["model"]["weight"].float()))
+
+    def test_skip_init_only_in_calling_thread(self):
+        import torch
+        from openchat.utils.checkpoint_utils import skip_init_weights
+
+        inside, done = threading.Event(), threading.Event()
+        results = {}
+
+        def build():
+            with skip_init_weights():
+                inside.set()
+                done.wait()
+                results["skipped"] = torch.nn.init.ones_(torch.zeros(2))
+
+        thread = threading.Thread(target=build)
+        thread.start()
+        inside.wait()
+        results["initialized"] = torch.nn.init.ones_(torch.zeros(2))
+        done.set()
+        thread.join()
+
+        self.assertTrue(torch.equal(results["skipped"], torch.zeros(2)))
+        self.assertTrue(torch.equal(results["initialized"], torch.ones(2)))
+        self.assertEqual(torch.nn.init.ones_.__name__, "ones_")
+        self.assertFalse(hasattr(torch.nn.init.ones_, "__wrapped__"))
@@ -0,0 +1,312 @@
+import importlib.util
+import unittest
+
+HAS_TORCH = all(importlib.util.find_spec(m) is not None for m in ["torch", "transformers"])
+PROMPT = "User: hello there. how are you? Bot:"
+
+
+@unittest.skipUnless(HAS_TORCH, "torch and transformers are not installed")
+class GenerationTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from benchmarks.standins import create_standin_agent
+
+        torch.manual_seed(0)
+        cls.agent = create_standin_agent("dialogpt.small")
+        cls.prompt_agent = create_standin_agent("gptneo.small")
+
+    def tearDown(self):
+        for agent in [self.agent, self.prompt_agent]:
+            agent.disable_session_cache()
+
+    def predict_with_seed(self, agent, seed, **kwargs):
+        import torch
+
+        torch.manual_seed(seed)
+        return agent.predict(PROMPT, **kwargs)["output"]
+
+    def chat(self, agent, messages, **kwargs):
+        """
+        Reply to the messages of one user with and without the session cache.
+        the history keeps fixed replies, because random bytes of stand-in models don't survive decoding.
+
+        Returns:
+            (List[Tuple[str, str, int, int]]): output without and with the cache,
+                number of input tokens and number of tokens fed at the first forward pass of the cached turn
+        """
+
+        import torch
+        from openchat.base.envs.base import BaseEnvironment
+
+        class Environment(BaseEnvironment):
+
+            def start(self, agent, **kwargs):
+                pass
+
+        env, fed, turns = Environment(), [], []
+        hook = agent.model.register_forward_pre_hook(
+            lambda module, args, inputs: fed.append(inputs["input_ids"].size(-1)),
+            with_kwargs=True,
+        )
+        agent.enable_session_cache()
+
+        try:
+            for i, message in enumerate(messages):
+                model_input = env.make_model_input("user", message, agent)
+                env.add_user_message("user", message)
+
+                torch.manual_seed(i)
+                expected = agent.predict(model_input, **kwargs)["output"]
+
+                fed.clear()
+                torch.manual_seed(i)
+                output = agent.predict(model_input, user_id="user", **kwargs)["output"]
+
+                num_tokens = len(agent.tokenizer(model_input)["input_ids"])
+                turns.append((expected, output, num_tokens, fed[0]))
+                env.add_bot_message("user", f"ok {i}", agent)
+        finally:
+            hook.remove()
+            agent.disable_session_cache()
+
+        return turns
+
+    def test_session_cache_keeps_decoding(self):
+        from benchmarks.standins import create_standin_agent
+
+        messages = ["hi", "how are you?", "what do you like?", "me too", "bye"]
+        # the whole history fits in `maxlen`, so every turn reuses the key/values of the previous input.
+        agent = create_standin_agent("dialogpt.small", maxlen=128)
+
+        for agent, kwargs in [
+            (agent, {}),
+            (self.prompt_agent, {"person_1": "User", "person_2": "Bot"}),
+        ]:
+            for method in ["greedy", "top_k", "nucleus"]:
+                if not agent.decodes_one_sequence(method):
+                    # the cache isn't used, every turn computes the whole input.
+                    continue
+
+                turns = self.chat(agent, messages, method=method, top_p=0.9, **kwargs)
+
+                for expected, output, _, _ in turns:
+                    self.assertEqual(output, expected, f"{agent.name} {method}")
+
+                for previous, turn in zip(turns, turns[1:]):
+                    self.assertLessEqual(turn[3], turn[2] - previous[2], f"{agent.name} {method}")
+
+    def test_session_cache_sliding_window(self):
+        messages = ["hi", "how are you?", "what do you like?", "me too", "bye", "see you"]
+        turns = self.chat(self.agent, messages, method="greedy")
+
+        for expected, output, _, _ in turns:
+            self.assertEqual(output, expected)
+
+        # the oldest turns leave the `maxlen` window, so the whole input is computed again.
+        self.assertTrue(any(num_fed == num_tokens for _, _, num_tokens, num_fed in turns[1:]))
+        self.assertTrue(any(num_fed < num_tokens for _, _, num_tokens, num_fed in turns[1:]))
+
+    def greedy_generate(self, agent, input_ids, max_new_tokens):
+        import torch
+
+        eos_token_id = agent.tokenizer.eos_token_id
+
+        with torch.no_grad():
+            output_ids = agent.model.generate(
+                input_ids=torch.tensor([input_ids]),
+                num_beams=1,
+                do_sample=False,
+                max_new_tokens=max_new_tokens,
+                repetition_penalty=2.0,
+                no_repeat_ngram_size=4,
+                pad_token_id=eos_token_id,
+            )[0, len(input_ids):].tolist()
+
+        return output_ids[:output_ids.index(eos_token_id)] if eos_token_id in output_ids else output_ids
+
+    def test_continuous_batching(self):
+        from openchat.base import ContinuousBatchingEngine
+
+        agent = self.agent
+        prompts = ["hi", PROMPT, "User: what do you like? Bot:", "a", PROMPT * 2]
+        max_new_tokens = [5, 30, 12, 20, 8]
+        engine = ContinuousBatchingEngine(
+            model=agent.model,
+            eos_token_id=agent.tokenizer.eos_token_id,
+            device="cpu",
+            max_batch_size=3,
+        )
+        # queued before the engine starts, so sequences join and leave the running batch
+        futures = [
+            engine.submit(
+                agent.tokenizer(prompt)["input_ids"],
+                method="greedy",
+                max_new_tokens=n,
+            )
+            for prompt, n in zip(prompts, max_new_tokens)
+        ]
+        engine.start()
+
+        try:
+            outputs = [future.result(timeout=60) for future in futures]
+        finally:
+            engine.stop()
+
+        for prompt, n, output in zip(prompts, max_new_tokens, outputs):
+            self.assertEqual(output, self.greedy_generate(agent, agent.tokenizer(prompt)["input_ids"], n))
+
+        self.assertGreater(engine.stats()["mean_batch_size"], 1)
+
+    def test_speculative_greedy(self):
+        from benchmarks.standins import create_huggingface_model
+        from openchat.agents import registry
+        from openchat.utils.generation_utils import make_logits_processor, speculative_greedy
+
+        model = self.agent.model
+        draft_model = create_huggingface_model(registry.get_model_spec("dialogpt.small")).eval()
+        input_ids = self.agent.tokenizer(PROMPT)["input_ids"]
+
+        expected = self.greedy_generate(self.agent, input_ids, 40)
+
+        for num_draft_tokens in [1, 3, 5]:
+            output = list(speculative_greedy(
+                model=model,
+                draft_model=draft_model,
+                input_ids=input_ids,
+                max_new_tokens=40,
+                eos_token_id=self.agent.tokenizer.eos_token_id,
+                logits_processor=make_logits_processor(
+                    method="greedy",
+                    no_repeat_ngram_size=4,
+                    repetition_penalty=2.0,
+                ),
+                num_draft_tokens=num_draft_tokens,
+            ))
+            self.assertEqual(output, expected)
+
+    def test_draft_keeps_greedy_outputs(self):
+        from benchmarks.standins import create_standin_agent
+
+        for agent, kwargs in [
+            (self.agent, {}),
+            (self.prompt_agent, {"person_1": "User", "person_2": "Bot"}),
+        ]:
+            expected = agent.predict(PROMPT, method="greedy", **kwargs)["output"]
+            agent.set_draft(create_standin_agent(agent.name))
+
+            try:
+                output = agent.predict(PROMPT, method="greedy", **kwargs)["output"]
+            finally:
+                agent.clear_draft()
+
+            self.assertEqual(output, expected, agent.name)
+
+    def test_batch_equals_single(self):
+        # inputs of different lengths, so the shorter ones are left padded
+        texts = ["hi", PROMPT, "User: what do you like? Bot:"]
+
+        for agent, kwargs in [
+            (self.agent, {}),
+            (self.prompt_agent, {"person_1": "User", "person_2": "Bot"}),
+        ]:
+            expected = [agent.predict(text, method="greedy", **kwargs)["output"] for text in texts]
+            outputs = agent.predict_batch(texts, method="greedy", **kwargs)
+            self.assertEqual([output["output"] for output in outputs], expected, agent.name)
+
+    def test_stream_equals_predict(self):
+        import torch
+
+        for agent, kwargs in [
+            (self.agent, {}),
+            (self.prompt_agent, {"person_1": "User", "person_2": "Bot"}),
+        ]:
+            for method in ["greedy", "top_k"]:
+                expected = self.predict_with_seed(agent, 0, method=method, **kwargs)
+
+                torch.manual_seed(0)
+                chunks = list(agent.predict_stream(PROMPT, method=method, **kwargs))
+
+                self.assertEqual("".join(chunks).strip(), expected, f"{agent.name} {method}")
+
+                if agent.decodes_one_sequence(method):
+                    self.assertGreater(len(chunks), 1, f"{agent.name} {method}")
+
+    def test_stream_stops_at_stop_string(self):
+        expected = self.agent.predict(PROMPT, method="greedy")["output"]
+        stop_string = expected[6:8]
+        output = "".join(self.agent.predict_stream(PROMPT, method="greedy", stop_strings=[stop_string]))
+
+        self.assertEqual(output, expected[:expected.index(stop_string)])
+
+    def test_beam(self):
+        output = self.prompt_agent.predict(PROMPT, person_1="User", person_2="Bot", method="beam")
+        self.assertIsInstance(output["output"], str)
+
+
+@unittest.skipUnless(HAS_TORCH, "torch and transformers are not installed")
+class StopCriterionTester(unittest.TestCase):
+
+    def setUp(self):
+        from benchmarks.standins import create_byte_tokenizer
+        from openchat.base import PromptAgent
+        from openchat.utils.generation_utils import make_stop_fn, newline_token_ids, stop_token_ids
+
+        self.tokenizer = create_byte_tokenizer()
+        self.prompt = self.tokenizer("User: hi Bot:")["input_ids"]
+        self.stop_fn = make_stop_fn(
+            stop_ids=stop_token_ids(self.tokenizer, PromptAgent.turn_escapes("User", "Bot")),
+            newline_ids=newline_token_ids(self.tokenizer),
+            eos_token_id=self.tokenizer.eos_token_id,
+            vocab_size=len(self.tokenizer),
+            prompt_length=len(self.prompt),
+            device="cpu",
+        )
+
+    def allowed_tokens(self, generated_text):
+        import torch
+
+        generated = self.tokenizer(generated_text)["input_ids"]
+        return self.stop_fn(0, torch.tensor(self.prompt + generated))
+
+    def assertStops(self, generated_text):
+        self.assertEqual(list(self.allowed_tokens(generated_text)), [self.tokenizer.eos_token_id])
+
+    def assertContinues(self, generated_text):
+        self.assertEqual(len(self.allowed_tokens(generated_text)), len(self.tokenizer))
+
+    def test_stop_on_newline(self):
+        self.assertStops(" fine\n")
+        self.assertContinues(" fine")
+
+    def test_stop_on_turn_escape(self):
+        for escape in [" User:", " USER:", " user:", " Bot:"]:
+            self.assertStops(" fine thanks." + escape)
+
+        self.assertContinues(" fine thanks. User")
+        # turn escapes in the prompt don't stop generation
+        self.assertContinues("")
+
+    def test_finished_sequence(self):
+        # finished rows of a batch are padded with eos, every token is allowed there.
+        self.assertContinues(" fine\n" + self.tokenizer.eos_token * 4)
+
+    def test_sampling_batch(self):
+        import torch
+        from benchmarks.standins import create_standin_agent
+
+        agent = create_standin_agent("gptneo.small")
+        texts = ["hi", PROMPT, "User: what do you like? Bot:"]
+
+        for seed in range(3):
+            torch.manual_seed(seed)
+            outputs = agent.predict_batch(texts, person_1="User", person_2="Bot", method="top_k")
+
+            for output in outputs:
+                self.assertNotIn("\n", output["output"])
+                self.assertLessEqual(output["kept_tokens"], output["generated_tokens"])
+
+
+if __name__ == '__main__':
+    unittest.main()
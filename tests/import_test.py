@@ -0,0 +1,26 @@
+import subprocess
+import sys
+import unittest
+
+HEAVY_MODULES = ["torch", "transformers", "parlai", "projects"]
+
+
+class ImportTester(unittest.TestCase):
+
+    def test_import_is_lazy(self):
+        code = (
+            "import sys\n"
+            "import openchat\n"
+            "models = openchat.OpenChat.available_models()\n"
+            f"print(sorted(m for m in {HEAVY_MODULES} if m in sys.modules))\n"
+            "print(len(models))\n"
+        )
+
+        output = subprocess.check_output([sys.executable, "-c", code])
+        loaded, num_models = output.decode().strip().split("\n")
+        self.assertEqual(loaded, "[]")
+        self.assertGreater(int(num_models), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
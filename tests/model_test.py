@@ -4,7 +4,7 @@ from openchat.agents.blender import BlenderGenerationAgent
 from openchat.agents.dialogpt import DialoGPTAgent
 from openchat.agents.dodecathlon import DodecathlonAgent
 from openchat.agents.reddit import RedditAgent
-from openchat.agents.offensive import SafetyAgent
+from openchat.agents.safety import OffensiveAgent, SensitiveAgent
 from openchat.agents.unlikelihood import UnlikelihoodAgent
 from openchat.agents.wow import WizardOfWikipediaGenerationAgent
 from openchat.base import WizardOfWikipediaAgent
@@ -13,7 +13,7 @@ from openchat.base import WizardOfWikipediaAgent
 class ModelTester(unittest.TestCase):
 
     def model_unittest(self, model_name, model_class):
-        model = model_class(model=model_name, device="cpu")
+        model = model_class(model=model_name, device="cpu", maxlen=-1)
         if isinstance(model, WizardOfWikipediaAgent):
             model.set_topic("Guitar")
 
@@ -38,8 +38,11 @@ class ModelTester(unittest.TestCase):
             self.model_unittest(model, RedditAgent)
 
     def test_safety(self):
-        for model in SafetyAgent.available_models():
-            self.model_unittest(model, SafetyAgent)
+        for model in OffensiveAgent.available_models():
+            self.model_unittest(model, OffensiveAgent)
+
+        for model in SensitiveAgent.available_models():
+            self.model_unittest(model, SensitiveAgent)
 
     def test_unlikelihood(self):
         for model in UnlikelihoodAgent.available_models():
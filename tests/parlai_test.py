@@ -0,0 +1,222 @@
+import importlib.util
+import os
+import tempfile
+import unittest
+
+HAS_PARLAI = all(importlib.util.find_spec(m) is not None for m in ["torch", "parlai"])
+HAS_SUBWORD_NMT = importlib.util.find_spec("subword_nmt") is not None
+WORDS = ["hello", "there", "how", "are", "you", "doing", "today"]
+CORPUS = [
+    "hello there, how are you doing today?",
+    "i'm fine, thanks. and you?",
+    "what do you like to do for fun?",
+    "i like playing the guitar and reading books.",
+    "that sounds great! i love music too.",
+    "see you later, bye.",
+]
+
+
+def create_classifier(words, classes, truncate=8):
+    from parlai.core.agents import create_agent
+    from parlai.core.params import ParlaiParser
+
+    directory = tempfile.mkdtemp(prefix="openchat_test_")
+    dict_file = os.path.join(directory, "model.dict")
+
+    with open(dict_file, "w", encoding="utf-8") as f:
+        for token in ["__null__", "__start__", "__end__", "__unk__"] + sorted(set(words)):
+            f.write(f"{token}\t1\n")
+
+    parser = ParlaiParser(True, True)
+    opt = parser.parse_args([
+        "--model", "transformer/classifier",
+        "--dict-file", dict_file,
+        "--classes", *classes,
+        "--embedding-size", "16",
+        "--ffn-size", "32",
+        "--n-heads", "2",
+        "--n-layers", "1",
+        "--truncate", str(truncate),
+        "--no-cuda",
+    ])
+
+    return create_agent(opt, requireModelExists=False)
+
+
+def create_dictionary(tokenizer):
+    """
+    BPE dictionary learned from `CORPUS`, so no dictionary files are downloaded.
+    """
+
+    from parlai.core.dict import DictionaryAgent
+    from parlai.core.params import ParlaiParser
+
+    directory = tempfile.mkdtemp(prefix="openchat_test_")
+    dict_file = os.path.join(directory, "model.dict")
+    args = ["--dict-file", dict_file, "--dict-tokenizer", tokenizer]
+
+    if tokenizer == "bytelevelbpe":
+        from tokenizers import ByteLevelBPETokenizer
+
+        bpe = ByteLevelBPETokenizer()
+        bpe.train_from_iterator(CORPUS, vocab_size=300, min_frequency=1)
+        bpe.save_model(directory, "model")
+        args += [
+            "--bpe-vocab", os.path.join(directory, "model-vocab.json"),
+            "--bpe-merge", os.path.join(directory, "model-merges.txt"),
+        ]
+
+    parser = ParlaiParser(False, False)
+    DictionaryAgent.add_cmdline_args(parser, None)
+    opt = parser.parse_args(args)
+
+    if tokenizer == "bpe":
+        dictionary = DictionaryAgent(opt)
+
+        for text in CORPUS:
+            dictionary.add_to_dict(dictionary.tokenize(text))
+
+        # codes are learned when the dictionary is saved
+        dictionary.save(dict_file, sort=True)
+
+    return DictionaryAgent(opt)
+
+
+@unittest.skipUnless(HAS_PARLAI, "parlai is not installed")
+class ParlaiClassificationTester(unittest.TestCase):
+
+    def setUp(self):
+        from openchat.base import ParlaiClassificationAgent
+
+        class StubClassifier(ParlaiClassificationAgent):
+
+            def labels(self):
+                return ["ok", "not ok"]
+
+            @staticmethod
+            def available_models():
+                return ["stub"]
+
+            @staticmethod
+            def default_maxlen():
+                return 128
+
+        self.agent = StubClassifier(
+            name="stub",
+            suffix="",
+            device="cpu",
+            maxlen=128,
+            model=create_classifier(WORDS, ["__ok__", "__notok__"]),
+        )
+
+    def observed_vector(self, text):
+        model = self.agent.model
+        vector = model.observe({"text": text, "episode_done": True})["text_vec"].tolist()
+        model.reset()
+        return vector
+
+    def test_vectors_equal_observe(self):
+        texts = ["hello there", "how are you doing today hello there how are you"]
+        messages = [self.agent.make_message(text) for text in texts]
+
+        for text, message in zip(texts, messages):
+            self.assertEqual(message["text_vec"].tolist(), self.observed_vector(text))
+
+        batch = self.agent.model.batchify(messages)
+
+        for i, text in enumerate(texts):
+            vector = self.observed_vector(text)
+            self.assertEqual(batch.text_vec[i, :len(vector)].tolist(), vector)
+
+    def test_score_batch(self):
+        scores = self.agent.score_batch(["hello there", "how are you"])
+
+        self.assertEqual(len(scores["labels"]), 2)
+        self.assertTrue(all(label in ["ok", "not ok"] for label in scores["labels"]))
+        self.assertEqual(len(scores["scores"][0]), 2)
+
+
+@unittest.skipUnless(HAS_PARLAI, "parlai is not installed")
+class ParlaiGenerationTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import torch
+        from benchmarks.standins import create_standin_agent
+
+        torch.manual_seed(0)
+        cls.agent = create_standin_agent("blender.small", words=WORDS, maxlen=16)
+        model = cls.agent.model
+
+        with torch.no_grad():
+            # the random model always predicts `__unk__`, without it the outputs depend on the input.
+            model.model.embeddings.weight[model.dict[model.dict.unk_token]].zero_()
+
+    def test_batch_equals_single(self):
+        # inputs of different lengths, so the shorter ones are padded
+        texts = ["hello", "how are you doing today", "hello there how are you"]
+        kwargs = {"method": "greedy", "num_beams": 1}
+
+        expected = [self.agent.predict(text, **kwargs)["output"] for text in texts]
+        outputs = self.agent.predict_batch(texts, **kwargs)
+
+        self.assertEqual([output["output"] for output in outputs], expected)
+        self.assertGreater(len(set(expected)), 1)
+
+
+@unittest.skipUnless(HAS_PARLAI, "parlai is not installed")
+class ParlaiDictionaryTester(unittest.TestCase):
+
+    def model_inputs(self, tokenizer):
+        """
+        Chat through the environment with a blender agent using a real BPE dictionary.
+
+        Returns:
+            (ParlaiGenerationAgent, List[Tuple[str, List[int]]]): agent and
+                model input and its cached token ids of each turn
+        """
+
+        from benchmarks.standins import create_standin_agent
+        from openchat.base.envs.base import BaseEnvironment
+
+        class Environment(BaseEnvironment):
+
+            def start(self, agent, **kwargs):
+                pass
+
+        # short `maxlen`, so the first turns are truncated from the later inputs.
+        agent = create_standin_agent("blender.small", words=WORDS, maxlen=48)
+        agent.model.dict = create_dictionary(tokenizer)
+        env, inputs = Environment(), []
+
+        for user_message, bot_message in zip(CORPUS[0::2], CORPUS[1::2]):
+            model_input = env.make_model_input("user", user_message, agent)
+            inputs.append((model_input, env.history("user")["model_input_ids"]))
+            env.add_user_message("user", user_message)
+            env.add_bot_message("user", bot_message, agent)
+
+        return agent, inputs
+
+    @unittest.skipUnless(HAS_SUBWORD_NMT, "subword-nmt is not installed")
+    def test_subword_bpe_ids_equal_txt2vec(self):
+        agent, inputs = self.model_inputs("bpe")
+
+        self.assertTrue(agent.concatenates_token_ids())
+        self.assertNotIn("hello", inputs[-1][0])
+
+        for model_input, model_input_ids in inputs:
+            self.assertEqual(model_input_ids, agent.model.dict.txt2vec(model_input))
+
+    def test_byte_level_bpe_falls_back_to_txt2vec(self):
+        agent, inputs = self.model_inputs("bytelevelbpe")
+
+        # every text gets a prefix space, so the cached ids are not passed as `text_vec`.
+        self.assertFalse(agent.concatenates_token_ids())
+        self.assertTrue(any(
+            model_input_ids != agent.model.dict.txt2vec(model_input)
+            for model_input, model_input_ids in inputs
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
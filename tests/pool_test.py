@@ -0,0 +1,61 @@
+import unittest
+
+from openchat.agents import registry
+from openchat.agents.pool import ModelPool
+
+
+class DummyAgent(object):
+    num_loads = 0
+
+    def __init__(self, model, device, maxlen):
+        DummyAgent.num_loads += 1
+        self.name = model
+        self.device = device
+        self.maxlen = maxlen if maxlen > 0 else 128
+        self.model = object()
+
+
+class ModelPoolTester(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        registry.register(
+            registry.ModelSpec(
+                name="dummy.pool",
+                backend=f"{__name__}:DummyAgent",
+                checkpoint="",
+                default_maxlen=128,
+                suffix="\n",
+            ),
+        )
+
+    @classmethod
+    def tearDownClass(cls):
+        registry.MODELS.pop("dummy.pool")
+
+    def test_acquire_shares_weights(self):
+        pool = ModelPool()
+        DummyAgent.num_loads = 0
+        agent_1 = pool.acquire("dummy.pool", "cpu")
+        agent_2 = pool.acquire("dummy.pool", "cpu", maxlen=64)
+
+        self.assertEqual(DummyAgent.num_loads, 1)
+        self.assertIs(agent_1.model, agent_2.model)
+        self.assertEqual(agent_1.maxlen, 128)
+        self.assertEqual(agent_2.maxlen, 64)
+        self.assertEqual(pool.loaded()[("dummy.pool", "cpu", "fp32")], 2)
+
+    def test_unload(self):
+        pool = ModelPool()
+        agent = pool.acquire("dummy.pool", "cpu")
+
+        with self.assertRaises(Exception):
+            pool.unload("dummy.pool", "cpu")
+
+        pool.release(agent)
+        pool.unload("dummy.pool", "cpu")
+        self.assertEqual(len(pool.loaded()), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from openchat.agents import registry
+from openchat.agents.registry import ModelSpec, DECODER, SEQ2SEQ, CONVAI2
+
+
+class RegistryTester(unittest.TestCase):
+
+    def test_available_models(self):
+        models = registry.available_models()
+        self.assertIn("dialogpt.small", models)
+        self.assertIn("dodecathlon.empathetic_dialogues", models)
+        self.assertIn("dodecathlon.eli5", models)
+        self.assertEqual(len(models), len(set(models)))
+
+    def test_model_spec(self):
+        spec = registry.get_model_spec("blender.xlarge")
+        self.assertEqual(spec.checkpoint, "zoo:blender/blender_3B/model")
+        self.assertEqual(spec.family, "blender")
+        self.assertTrue(spec.has(SEQ2SEQ))
+        self.assertTrue(spec.has(CONVAI2))
+        self.assertFalse(spec.has(DECODER))
+
+        spec = registry.get_model_spec("gptneo.large")
+        self.assertEqual(spec.checkpoint, "EleutherAI/gpt-neo-1.3B")
+        self.assertEqual(spec.suffix, " ")
+
+    def test_wrong_model(self):
+        with self.assertRaises(Exception):
+            registry.get_model_spec("blender.tiny")
+
+    def test_register(self):
+        spec = ModelSpec(
+            name="custom.small",
+            backend="openchat.agents.dialogpt:DialoGPTAgent",
+            checkpoint="custom/small",
+            default_maxlen=32,
+            suffix="\n",
+            capabilities=(DECODER,),
+        )
+
+        registry.register(spec)
+
+        try:
+            self.assertIs(registry.get_model_spec("custom.small"), spec)
+
+            with self.assertRaises(Exception):
+                registry.register(spec)
+        finally:
+            registry.MODELS.pop("custom.small")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,86 @@
+import importlib.util
+import unittest
+
+from openchat.base.agents.safety import add_safety_filter, FALLBACK_RESPONSE
+
+
+class EchoAgent(object):
+
+    def __init__(self):
+        self.name = "echo"
+        self.calls = 0
+
+    def predict_batch(self, texts, method="top_k", **kwargs):
+        self.calls += 1
+        self.num_texts = len(texts)
+        return [{
+            "input": text,
+            "output": f"{text} {i % 3}",
+        } for i, text in enumerate(texts)]
+
+
+class DummySafetyAgent(object):
+
+    def __init__(self):
+        self.string_matcher = {"bad 0"}
+        self.scored = []
+
+    def labels(self):
+        return ["safe", "unsafe"]
+
+    def score_batch(self, texts):
+        self.scored.append(sorted(texts))
+        labels = ["unsafe" if t.startswith("worse") or t.endswith("1") else "safe" for t in texts]
+        probabilities = [0.9 if t.endswith("2") else 0.6 for t in texts]
+        return {"labels": labels, "probabilities": probabilities}
+
+
+class SafetyFilterTester(unittest.TestCase):
+
+    def test_pick_safest_candidate(self):
+        safety_agent = DummySafetyAgent()
+        agent = add_safety_filter(EchoAgent(), safety_agent, num_candidates=3)
+        outputs = agent.predict_batch(["good", "bad", "worse"])
+
+        self.assertEqual(agent.calls, 1)
+        self.assertEqual(len(safety_agent.scored), 1)
+        self.assertNotIn("bad 0", safety_agent.scored[0])
+        self.assertEqual(outputs[0]["output"], "good 2")
+        self.assertEqual(outputs[1]["output"], "bad 2")
+        self.assertEqual(outputs[2]["output"], FALLBACK_RESPONSE)
+        self.assertEqual(agent.safety_stats["fallbacks"], 1)
+
+    def test_one_candidate_for_deterministic_methods(self):
+        safety_agent = DummySafetyAgent()
+        agent = add_safety_filter(EchoAgent(), safety_agent, num_candidates=3)
+
+        self.assertEqual(agent.predict_batch(["good", "worse"], method="greedy")[0]["output"], "good 0")
+        self.assertEqual(agent.num_texts, 2)
+        agent.predict_batch(["good", "worse"], method="beam")
+        self.assertEqual(agent.num_texts, 2)
+        agent.predict_batch(["good", "worse"])
+        self.assertEqual(agent.num_texts, 6)
+
+    @unittest.skipUnless(
+        all(importlib.util.find_spec(m) is not None for m in ["torch", "transformers"]),
+        "torch and transformers are not installed",
+    )
+    def test_huggingface_candidates_differ(self):
+        from benchmarks.standins import create_standin_agent
+
+        safety_agent = DummySafetyAgent()
+        agent = add_safety_filter(create_standin_agent("dialogpt.small"), safety_agent, num_candidates=4)
+        agent.predict("hello there", method="top_k")
+
+        self.assertEqual(len(safety_agent.scored[0]), 4)
+
+    def test_predict(self):
+        agent = add_safety_filter(EchoAgent(), DummySafetyAgent(), num_candidates=2)
+        output = agent.predict("good", user_id="user")
+
+        self.assertEqual(output["output"], "good 0")
+        self.assertIn("classify", output["timings"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+from dataclasses import dataclass
+
+from openchat.base.envs.scheduler import BatchScheduler
+
+
+@dataclass
+class Request:
+    user_id: str
+    arrived: float
+
+
+class BatchSchedulerTester(unittest.TestCase):
+
+    def test_wait_for_deadline(self):
+        scheduler = BatchScheduler(max_batch_size=4, max_wait=1.0)
+        scheduler.add(Request("a", 0.0), 10)
+
+        self.assertEqual(scheduler.next_batch(now=0.5), [])
+        self.assertAlmostEqual(scheduler.time_until_ready(now=0.5), 0.5)
+        self.assertEqual(len(scheduler.next_batch(now=1.0)), 1)
+        self.assertIsNone(scheduler.time_until_ready(now=1.0))
+
+    def test_bucket_by_length(self):
+        scheduler = BatchScheduler(max_batch_size=4, max_wait=1.0)
+        short_1, long_1 = Request("a", 0.0), Request("b", 0.0)
+        short_2, long_2 = Request("c", 0.0), Request("d", 0.0)
+        scheduler.add(short_1, 10)
+        scheduler.add(long_1, 120)
+        scheduler.add(short_2, 12)
+        scheduler.add(long_2, 118)
+
+        self.assertEqual(scheduler.next_batch(now=1.0), [short_1, short_2])
+        self.assertEqual(scheduler.next_batch(now=1.0), [long_1, long_2])
+        self.assertGreater(scheduler.stats()["padding_efficiency"], 0.9)
+
+    def test_full_bucket_before_deadline(self):
+        scheduler = BatchScheduler(max_batch_size=2, max_wait=1.0)
+        scheduler.add(Request("a", 0.0), 100)
+        scheduler.add(Request("b", 0.0), 10)
+        scheduler.add(Request("c", 0.0), 11)
+
+        batch = scheduler.next_batch(now=0.0)
+        self.assertEqual([r.user_id for r in batch], ["b", "c"])
+        self.assertEqual(len(scheduler), 1)
+
+    def test_max_batch_tokens(self):
+        scheduler = BatchScheduler(max_batch_size=8, max_batch_tokens=100, max_wait=0.0)
+
+        for i in range(4):
+            scheduler.add(Request(str(i), 0.0), 40)
+
+        self.assertEqual(len(scheduler.next_batch(now=0.0)), 2)
+        self.assertEqual(len(scheduler.next_batch(now=0.0)), 2)
+
+    def test_user_only_once(self):
+        scheduler = BatchScheduler(max_batch_size=4, max_wait=0.0)
+        first, second = Request("a", 0.0), Request("a", 0.0)
+        scheduler.add(first, 10)
+        scheduler.add(second, 10)
+
+        self.assertEqual(scheduler.next_batch(now=0.0), [first])
+        self.assertEqual(scheduler.next_batch(now=0.0), [second])
+
+    def test_busy_users(self):
+        scheduler = BatchScheduler(max_batch_size=4, max_wait=0.0)
+        scheduler.add(Request("a", 0.0), 10)
+
+        self.assertEqual(scheduler.next_batch(now=0.0, busy={"a"}), [])
+        self.assertIsNone(scheduler.time_until_ready(now=0.0, busy={"a"}))
+        self.assertEqual(len(scheduler.next_batch(now=0.0)), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
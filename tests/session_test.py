@@ -0,0 +1,65 @@
+import os
+import tempfile
+import time
+import unittest
+
+from openchat.base.envs.session import MemorySessionStore, SQLiteSessionStore
+
+
+def make_history(text):
+    return {"user_message": [text], "bot_message": []}
+
+
+class SessionStoreTester(unittest.TestCase):
+
+    def test_memory_max_sessions(self):
+        store = MemorySessionStore(max_sessions=2)
+        store["a"] = make_history("a")
+        store["b"] = make_history("b")
+        store.get("a")
+        store["c"] = make_history("c")
+
+        self.assertIn("a", store)
+        self.assertNotIn("b", store)
+        self.assertIn("c", store)
+        self.assertEqual(len(store), 2)
+
+    def test_memory_max_bytes(self):
+        store = MemorySessionStore(max_bytes=2000)
+        store["a"] = make_history("a")
+        store["b"] = make_history("b")
+
+        store["b"]["user_message"].append("x" * 2000)
+        store.save("b")
+
+        self.assertNotIn("a", store)
+        self.assertIn("b", store)
+
+    def test_memory_ttl(self):
+        store = MemorySessionStore(ttl=0.05)
+        store["a"] = make_history("a")
+        time.sleep(0.1)
+
+        self.assertNotIn("a", store)
+        self.assertIsNone(store.get("a"))
+
+    def test_sqlite_write_back(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.db")
+            store = SQLiteSessionStore(path, max_sessions=1)
+            store["a"] = make_history("a")
+            store["a"]["bot_message"].append("hello")
+            store["b"] = make_history("b")
+
+            self.assertEqual(store.stats()["size"], 1)
+            self.assertEqual(store["a"]["bot_message"], ["hello"])
+            store.close()
+
+            store = SQLiteSessionStore(path)
+            self.assertEqual(len(store), 2)
+            self.assertEqual(store["b"]["user_message"], ["b"])
+            store.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
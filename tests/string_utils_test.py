@@ -0,0 +1,106 @@
+import importlib.util
+import os
+import random
+import tempfile
+import unittest
+
+from openchat.utils.string_utils import PhraseMatcher, TopicIndex, split_tokenize, trie_phrases
+
+HAS_PARLAI = importlib.util.find_spec("parlai") is not None
+
+
+class PhraseMatcherTester(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = PhraseMatcher(["he", "she", "hers", "bad word", "bad"])
+
+    def test_find(self):
+        self.assertEqual(
+            self.matcher.find("She said: BAD  word, bad!"),
+            [(0, 3, "she"), (10, 13, "bad"), (21, 24, "bad")],
+        )
+        self.assertEqual(self.matcher.find("it's hers."), [(5, 9, "hers")])
+        self.assertEqual(self.matcher.find(""), [])
+
+    def test_find_batch(self):
+        self.assertEqual(
+            self.matcher.find_batch(["a bad word", "", "he!"]),
+            [[(2, 5, "bad")], [], [(0, 2, "he")]],
+        )
+
+    def test_whole_tokens(self):
+        self.assertNotIn("ushers and badge", self.matcher)
+        self.assertNotIn("a bad-thing", self.matcher)
+        self.assertIn("it is hers.", self.matcher)
+        self.assertEqual(
+            self.matcher.contains_batch(["hello", "he", "the sheep", ""]),
+            [False, True, False, False],
+        )
+
+    @unittest.skipUnless(HAS_PARLAI, "parlai is not installed")
+    def test_same_as_offensive_string_matcher(self):
+        from parlai.utils.safety import OffensiveStringMatcher
+
+        words = ["bad", "bad word", "ugly thing", "worse", "x-rated", "don't", "a.b"]
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "words.txt")
+
+            with open(path, "w") as f:
+                f.write("\n".join(words))
+
+            reference = OffensiveStringMatcher(path)
+
+        matcher = PhraseMatcher(trie_phrases(reference.offensive_trie))
+        vocabulary = words + ["bad-thing", "badly", "unbad", "thing", "ugly", "word", "ok", ",", "!", "  "]
+        rng = random.Random(0)
+        texts = ["", "Bad", "bad-thing", "BAD  WORD!", "ugly\tthing", "a.b", "x-rated", "don't"] + [
+            " ".join(rng.choice(vocabulary) for _ in range(rng.randint(1, 8)))
+            for _ in range(500)
+        ]
+
+        self.assertEqual(
+            matcher.contains_batch(texts),
+            [bool(reference.contains_offensive_language(text)) for text in texts],
+        )
+
+        for text in texts:
+            matches = matcher.find(text)
+            self.assertEqual(text in matcher, bool(reference.contains_offensive_language(text)), text)
+            self.assertEqual(
+                [phrase for _, _, phrase in matches],
+                reference.find_all_offensive_language(text) if text else [],
+            )
+
+            for start, end, phrase in matches:
+                # a span covers exactly the tokens of its phrase
+                self.assertEqual(" ".join(split_tokenize(text[start:end].lower())), phrase, text)
+
+    def test_trie_phrases(self):
+        trie = {"bad": {"__END__": True, "word": {"__END__": True}}, "ugly": {"__END__": True}}
+        self.assertEqual(sorted(trie_phrases(trie)), ["bad", "bad word", "ugly"])
+
+
+class TopicIndexTester(unittest.TestCase):
+
+    def setUp(self):
+        self.index = TopicIndex(["Jazz", "Java (island)", "Japan", "Blue", "Pizza", "Jazz"])
+
+    def test_membership(self):
+        self.assertEqual(len(self.index), 5)
+        self.assertIn("Japan", self.index)
+        self.assertNotIn("japan", self.index)
+
+    def test_suggest(self):
+        self.assertEqual(self.index.complete("ja", n=2), ["Japan", "Java (island)"])
+        self.assertEqual(self.index.suggest("Piza")[0], "Pizza")
+        self.assertEqual(self.index.complete("x"), [])
+
+    def test_sample_keeps_topics(self):
+        topics = self.index.topics
+        self.assertEqual(len(set(self.index.sample(3))), 3)
+        self.assertEqual(self.index.topics, topics)
+
+
+if __name__ == '__main__':
+    unittest.main()
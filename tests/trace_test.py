@@ -0,0 +1,53 @@
+import json
+import os
+import tempfile
+import unittest
+
+from openchat.utils import trace_utils
+from openchat.utils.trace_utils import span, HistogramSink, JsonLinesSink
+
+
+class TraceTester(unittest.TestCase):
+
+    def tearDown(self):
+        trace_utils.disable()
+
+    def test_disabled_span_is_shared(self):
+        self.assertIs(span("a"), span("b", model="x"))
+
+    def test_histogram(self):
+        sink = HistogramSink(buckets=(0.5, 1.0))
+        trace_utils.enable(sink)
+
+        for _ in range(3):
+            with span("stage", model="dummy"):
+                pass
+
+        stats = sink.stats()["stage{model=dummy}"]
+        self.assertEqual(stats["count"], 3)
+
+        text = sink.prometheus()
+        self.assertIn('openchat_span_seconds_bucket{span="stage",model="dummy",le="0.5"} 3', text)
+        self.assertIn('openchat_span_seconds_count{span="stage",model="dummy"} 3', text)
+
+    def test_json_lines(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "spans.jsonl")
+            sink = JsonLinesSink(path)
+            trace_utils.enable(sink)
+
+            with span("stage", model="dummy"):
+                pass
+
+            trace_utils.disable(sink)
+            sink.close()
+
+            with open(path) as f:
+                record = json.loads(f.readline())
+
+            self.assertEqual(record["span"], "stage")
+            self.assertEqual(record["model"], "dummy")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import importlib.util
+import unittest
+
+HAS_BACKENDS = all(importlib.util.find_spec(m) is not None for m in ["torch", "transformers", "parlai"])
+
+
+class FlakyAgent(object):
+
+    def __init__(self):
+        self.name = "flaky"
+        self.suffix = "\n"
+        self.maxlen = 128
+        self.fail = False
+
+    def tokenizer(self, text):
+        return {"input_ids": text.split()}
+
+    def predict_batch(self, texts, **kwargs):
+        if self.fail:
+            raise RuntimeError("generation failed")
+
+        return [{"input": text, "output": f"reply {i}"} for i, text in enumerate(texts)]
+
+
+@unittest.skipUnless(HAS_BACKENDS, "torch, transformers and parlai are not installed")
+class WebServerTester(unittest.TestCase):
+
+    def setUp(self):
+        from openchat.envs.webserver import WebServerEnvironment
+
+        self.env = WebServerEnvironment()
+        self.env.agent = FlakyAgent()
+
+    def request(self, user_id, message):
+        from openchat.envs.webserver import ChatRequest
+
+        return ChatRequest(user_id=user_id, message=message, data={}, future=None)
+
+    def test_failed_generation_keeps_history(self):
+        env, agent = self.env, self.env.agent
+        self.assertEqual(env.process_batch([self.request("a", "hello")]), ["reply 0"])
+
+        agent.fail = True
+        with self.assertRaises(RuntimeError):
+            env.process_batch([self.request("a", "lost message")])
+
+        agent.fail = False
+        env.process_batch([self.request("a", "how are you")])
+        history = env.history("a")
+
+        self.assertEqual(history["user_message"], ["hello", "how are you"])
+        self.assertEqual(history["bot_message"], ["reply 0", "reply 0"])
+        self.assertEqual(history["turn_tokens"], [
+            ["hello", "reply", "0"],
+            ["how", "are", "you", "reply", "0"],
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()